@@ -99,6 +99,12 @@ async fn main() -> Result<(), Box<dyn Error>> {
                             eprintln!("Error in list_uploads: {}", e);
                         }
                     }
+                    "storage" => {
+                        let request_site = REQUEST_SITE.lock().unwrap();
+                        if let Err(e) = request_site.storage().await {
+                            eprintln!("Error in storage: {}", e);
+                        }
+                    }
                     "log" => {
                         let request_site = REQUEST_SITE.lock().unwrap();
                         if let Err(e) = request_site.log().await {
@@ -75,6 +75,10 @@ impl RequestSite {
         self.post_to_endpoint("/list_uploads").await
     }
 
+    pub async fn storage(&self) -> Result<(), Box<dyn Error>> {
+        self.post_to_endpoint("/storage").await
+    }
+
     pub async fn log(&self) -> Result<(), Box<dyn Error>> {
         self.post_to_endpoint("/log").await
     }
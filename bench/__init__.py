@@ -0,0 +1,10 @@
+"""
+# benchmarks
+
+```
+python -m bench micro
+python -m bench load --concurrency 16 --duration 5
+python -m bench all --save bench/baseline.json
+python -m bench all --compare bench/baseline.json --threshold 0.2
+```
+"""
@@ -0,0 +1,85 @@
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def isolate_workdir(keep: bool = False) -> str:
+    """
+    Run inside a scratch directory so uploads, tokens and logs written by
+    the load test never touch the real ones. It is removed at exit unless
+    `keep` is set; registered before the server is imported, so the log
+    and token flushes at exit still find it.
+    """
+    workdir = tempfile.mkdtemp(prefix="hash_server_bench_")
+    if not keep:
+        atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.symlink(os.path.join(ROOT, "templates"), os.path.join(workdir, "templates"))
+    os.chdir(workdir)
+    return workdir
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="hash_server benchmarks")
+    parser.add_argument("suite", choices=["micro", "load", "all", "kdf"], nargs="?", default="all")
+    parser.add_argument("--duration", type=float, default=None, help="seconds per benchmark")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel requests in the load test")
+    parser.add_argument("--file-size", type=int, default=1024 * 1024, help="bytes per process_file upload")
+    parser.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail when results regress against this baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression, 0.2 = 20%%")
+    parser.add_argument("--target-ms", type=float, default=100.0, help="kdf: wanted time per key derivation")
+    parser.add_argument("--kdf", action="append", help="kdf: calibrate only this algorithm (repeatable)")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the scratch directory for inspection")
+    args = parser.parse_args(argv)
+
+    if args.suite == "kdf":
+        from bench import kdf
+        print("\n".join(kdf.run(args.target_ms, args.kdf)))
+        return 0
+
+    save = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = isolate_workdir(args.keep_workdir)
+    if args.keep_workdir:
+        print(f"workdir {workdir}")
+    # the load test is one client hammering the app, admission control would refuse most of it
+    os.environ.setdefault("RATE_LIMIT", "off")
+
+    from src.logging_utils import Logging
+    Logging.writer.echo = False
+
+    from bench import load, micro
+    from bench.stats import compare, format_table, load_baseline, save_baseline
+
+    results = {}
+    if args.suite in ("micro", "all"):
+        results.update(micro.run(duration=args.duration or 0.5))
+    if args.suite in ("load", "all"):
+        results.update(load.run(concurrency=args.concurrency, duration=args.duration or 3.0, file_size=args.file_size))
+
+    print(format_table(results))
+
+    if save:
+        save_baseline(save, results)
+        print(f"saved baseline {save}")
+
+    if baseline_path:
+        regressions = compare(load_baseline(baseline_path), results, args.threshold)
+        if regressions:
+            print(f"regressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"no regressions beyond {args.threshold:.0%}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+from src.config import Config
+from src.kdf import available_algorithms, calibrate
+
+
+def run(target_ms: float, algorithms=None) -> list[str]:
+    """
+    Pick KDF costs that take about `target_ms` per derivation on this
+    machine, returns report lines ending with the env vars to export
+    """
+    target = target_ms / 1000
+    lines = []
+    exports = []
+    for algorithm in algorithms or available_algorithms():
+        params, elapsed = calibrate(algorithm, target)
+        costs = ", ".join(f"{name}={value}" for name, value in params.describe().items() if name != "algorithm")
+        lines.append(f"{algorithm:<10} {elapsed * 1000:8.1f} ms  {costs}")
+
+        if algorithm == Config.KdfConfig.ALGORITHM:
+            first, second, third = params.costs
+            if algorithm == "pbkdf2":
+                exports.append(f"export KDF_PBKDF2_ITERATIONS={first}")
+            elif algorithm == "scrypt":
+                exports += [f"export KDF_SCRYPT_N={first}", f"export KDF_SCRYPT_R={second}", f"export KDF_SCRYPT_P={third}"]
+            else:
+                exports += [
+                    f"export KDF_ARGON2_ITERATIONS={first}",
+                    f"export KDF_ARGON2_MEMORY_KIB={second}",
+                    f"export KDF_ARGON2_LANES={third}",
+                ]
+
+    if exports:
+        lines.append("")
+        lines.append(f"# {Config.KdfConfig.ALGORITHM} at ~{target_ms:g} ms")
+        lines.append(f"export KDF_ALGORITHM={Config.KdfConfig.ALGORITHM}")
+        lines += exports
+    return lines
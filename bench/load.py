@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from bench.stats import summarize
+
+
+async def asgi_request(app, method: str, path: str, body: bytes = b"", headers: dict | None = None, query: str = ""):
+    """
+    Run one request straight through the ASGI app, no sockets involved.
+    Returns (status, response body).
+    """
+    raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    raw_headers.append((b"content-length", str(len(body)).encode("ascii")))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "root_path": "",
+        "query_string": query.encode("latin-1"),
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+        "extensions": {},
+    }
+
+    done = asyncio.Event()
+    body_sent = False
+    status = 0
+    chunks = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status, b"".join(chunks)
+
+
+def multipart_body(fields: dict, filename: str, data: bytes) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode("utf-8")
+    )
+    parts.append(data)
+    parts.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def run_scenario(request, concurrency: int, duration: float) -> dict:
+    """
+    Keep `concurrency` callers of `request()` busy for `duration` seconds,
+    `request()` returns the response status
+    """
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            begin = time.perf_counter()
+            status = await request()
+            latencies.append(time.perf_counter() - begin)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, elapsed, errors
+
+
+async def _run(concurrency: int, duration: float, text_size: int, file_size: int) -> dict:
+    from src.config import Config
+    from src.server import app
+    from src.routes.process_file.main import download_tokens
+    from src.blob_store import blob_store
+
+    results = {}
+    key = "bench-key-material"
+
+    text_body = json.dumps({"text": "x" * text_size, "key": key}).encode("utf-8")
+
+    async def encrypt_text():
+        status, _ = await asgi_request(
+            app, "POST", "/v0/api/aes/encrypt_text", text_body, {"content-type": "application/json"}
+        )
+        return status
+
+    latencies, elapsed, errors = await run_scenario(encrypt_text, concurrency, duration)
+    results["load.encrypt_text"] = dict(summarize(latencies, elapsed, text_size), errors=errors)
+
+    file_data = os.urandom(file_size)
+    upload_body, content_type = multipart_body({"key": key, "mode": "encrypt"}, "bench.txt", file_data)
+    last_upload = {}
+
+    async def process_file():
+        status, response = await asgi_request(
+            app, "POST", "/v0/hashing_file/process_file", upload_body, {"content-type": content_type}
+        )
+        if status == 200:
+            last_upload.update(json.loads(response))
+        return status
+
+    latencies, elapsed, errors = await run_scenario(process_file, concurrency, duration)
+    results["load.process_file"] = dict(summarize(latencies, elapsed, file_size), errors=errors)
+
+    # one output downloaded over and over with a token that does not run out
+    meta = download_tokens.token_meta(last_upload["download_token"])
+    blob_store.acquire(meta["blob"])
+    token = download_tokens.issue_token(
+        ttl=Config.TokensConfig.DOWNLOAD_TTL_SECONDS, uses=10 ** 9,
+        blob=meta["blob"], name=meta["name"], size=meta["size"]
+    )
+    download_path = "/v0/hashing_file/download/hashing_file/" + meta["name"]
+
+    async def download():
+        status, _ = await asgi_request(app, "GET", download_path, query=f"token={token}")
+        return status
+
+    latencies, elapsed, errors = await run_scenario(download, concurrency, duration)
+    results["load.download"] = dict(summarize(latencies, elapsed, file_size), errors=errors)
+
+    return results
+
+
+def run(concurrency: int = 8, duration: float = 3.0, text_size: int = 1024, file_size: int = 1024 * 1024) -> dict:
+    """
+    In-process load against /v0/api/aes/encrypt_text, /process_file and
+    downloads. Errors (including 503 from a full crypto executor) are
+    counted, not raised.
+    """
+    return asyncio.run(_run(concurrency, duration, text_size, file_size))
@@ -0,0 +1,72 @@
+import os
+import time
+
+from src.aes_crypto import StreamDecryptor, StreamEncryptor, decrypt_bytes, encrypt_bytes
+from src.config import Config
+from src.kdf import SALT_SIZE, KdfParams
+
+from bench.stats import summarize
+
+
+SIZES = (64, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+KEY = "bench-key-material"
+# streams derive a key per file, a minimal PBKDF2 keeps the KDF out of the AES numbers
+CHEAP_KDF = KdfParams("pbkdf2", bytes(SALT_SIZE), (1, 0, 0))
+
+
+def _size_name(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size // 1024 // 1024}MB"
+    if size >= 1024:
+        return f"{size // 1024}KB"
+    return f"{size}B"
+
+
+def measure(func, *args, duration: float = 0.5, min_runs: int = 5) -> tuple[list[float], float]:
+    """
+    Call `func(*args)` until `duration` seconds and `min_runs` calls passed,
+    returns (per call latencies, total elapsed)
+    """
+    func(*args)  # warm up caches and lazy imports
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < min_runs or time.perf_counter() - started < duration:
+        begin = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - begin)
+    return latencies, time.perf_counter() - started
+
+
+def stream_roundtrip(data: bytes) -> None:
+    encryptor = StreamEncryptor(KEY, params=CHEAP_KDF)
+    sealed = encryptor.update(data) + encryptor.finalize()
+    decryptor = StreamDecryptor(KEY)
+    decryptor.update(sealed)
+    decryptor.finalize()
+
+
+def run(sizes=SIZES, duration: float = 0.5) -> dict:
+    """
+    Microbenchmarks of the AES helpers across payload sizes
+    """
+    results = {}
+
+    params = KdfParams.new()
+    latencies, elapsed = measure(params.derive, KEY, duration=duration)
+    results[f"micro.kdf.{Config.KdfConfig.ALGORITHM}"] = summarize(latencies, elapsed)
+
+    for size in sizes:
+        data = os.urandom(size)
+        sealed = encrypt_bytes(data, KEY)
+        name = _size_name(size)
+
+        latencies, elapsed = measure(encrypt_bytes, data, KEY, duration=duration)
+        results[f"micro.encrypt_bytes.{name}"] = summarize(latencies, elapsed, size)
+
+        latencies, elapsed = measure(decrypt_bytes, sealed, KEY, duration=duration)
+        results[f"micro.decrypt_bytes.{name}"] = summarize(latencies, elapsed, size)
+
+        latencies, elapsed = measure(stream_roundtrip, data, duration=duration)
+        results[f"micro.stream_roundtrip.{name}"] = summarize(latencies, elapsed, size)
+
+    return results
@@ -0,0 +1,72 @@
+import json
+import math
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of unsorted `samples`
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(latencies: list[float], elapsed: float, payload_bytes: int = 0) -> dict:
+    """
+    One result row, latencies in seconds
+    """
+    count = len(latencies)
+    result = {
+        "count": count,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "ops_per_sec": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    if payload_bytes:
+        result["mb_per_sec"] = round(payload_bytes * count / elapsed / 1024 / 1024, 2) if elapsed > 0 else 0.0
+    return result
+
+
+def save_baseline(path: str, results: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_baseline(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Regressions of `current` against `baseline`: throughput down or p99 up
+    by more than `threshold` (0.2 = 20%). Benchmarks missing on either side
+    are skipped.
+    """
+    regressions = []
+    for name, now in sorted(current.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+
+        if before.get("ops_per_sec") and now["ops_per_sec"] < before["ops_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {now['ops_per_sec']} ops/s, baseline {before['ops_per_sec']} ops/s"
+            )
+        if before.get("p99_ms") and now["p99_ms"] > before["p99_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: p99 {now['p99_ms']} ms, baseline {before['p99_ms']} ms"
+            )
+    return regressions
+
+
+def format_table(results: dict) -> str:
+    columns = ("count", "p50_ms", "p99_ms", "ops_per_sec", "mb_per_sec", "errors")
+    width = max((len(name) for name in results), default=10)
+    lines = [f"{'benchmark':<{width}}  " + "  ".join(f"{column:>12}" for column in columns)]
+    for name, row in results.items():
+        lines.append(f"{name:<{width}}  " + "  ".join(f"{row.get(column, ''):>12}" for column in columns))
+    return "\n".join(lines)
@@ -1,10 +1,527 @@
+import atexit
+import fcntl
+import json
 import os
 import secrets
+import threading
+import time
 from pathlib import Path
 
+from src.timer_wheel import TimerWheel
+
+
+class _TokenTable:
+    """
+    # live tokens, their metadata and the expiry wheel
+
+    Shared by the backends. Records use one line per change:
+    - `+token` or `+token {json}` add a token (a bare `token` line too)
+    - `=token {json}` replace its metadata
+    - `-token` remove it
+
+    Metadata is a dict, tokens with an `expires` (unix time) entry are
+    put on a timer wheel so expired ones are found without a scan, and
+    tokens with a `blob` entry are indexed by it in `by_blob`.
+    """
+
+    def __init__(self, wheel_resolution: float = 1.0):
+        self.tokens: dict[str, dict | None] = {}
+        self.by_blob: dict[str, set[str]] = {}
+        self.wheel = TimerWheel(wheel_resolution)
+        self.expired_count = 0
+
+    def _reset_table(self) -> None:
+        self.tokens = {}
+        self.by_blob = {}
+        self.wheel.clear()
+
+    def _unindex(self, token: str) -> None:
+        blob = (self.tokens.get(token) or {}).get("blob")
+        if blob in self.by_blob:
+            self.by_blob[blob].discard(token)
+            if not self.by_blob[blob]:
+                del self.by_blob[blob]
+
+    def _put(self, token: str, meta: dict | None) -> None:
+        self._unindex(token)
+        self.tokens[token] = meta
+        if meta and meta.get("blob"):
+            self.by_blob.setdefault(meta["blob"], set()).add(token)
+        if meta and meta.get("expires") is not None:
+            self.wheel.schedule(token, meta["expires"])
+        else:
+            self.wheel.cancel(token)
+
+    def _drop(self, token: str) -> None:
+        self._unindex(token)
+        self.tokens.pop(token, None)
+        self.wheel.cancel(token)
+
+    def _for_blobs_locked(self, digests) -> dict[str, list[dict]]:
+        return {
+            digest: [self.tokens[token] for token in self.by_blob[digest]]
+            for digest in digests if digest in self.by_blob
+        }
+
+    def _apply_record(self, record: str) -> bool:
+        record = record.strip()
+        if not record:
+            return False
+
+        op = record[0]
+        if op in "+-=":
+            record = record[1:]
+        else:
+            op = "+"
+
+        token, _, meta_text = record.partition(" ")
+        if op == "-":
+            self._drop(token)
+            return True
+
+        meta = None
+        if meta_text:
+            try:
+                meta = json.loads(meta_text)
+            except ValueError:
+                meta = None
+        self._put(token, meta)
+        return True
+
+    @staticmethod
+    def _format_record(op: str, token: str, meta: dict | None = None) -> str:
+        if meta is None or op == "-":
+            return f"{op}{token}"
+        return f"{op}{token} {json.dumps(meta, separators=(',', ':'))}"
+
+    @staticmethod
+    def is_expired(meta: dict | None, now: float) -> bool:
+        return bool(meta) and meta.get("expires") is not None and meta["expires"] <= now
+
+    def _take_locked(self, token: str, now: float):
+        """
+        Consume one use of `token`, returns (result, record to persist).
+        Caller holds the lock and has caught up.
+        """
+        if token not in self.tokens:
+            return None, None
+
+        meta = self.tokens[token]
+        if self.is_expired(meta, now):
+            self._drop(token)
+            self.expired_count += 1
+            return None, self._format_record("-", token)
+
+        uses = meta.get("uses") if meta else None
+        if uses is not None and uses > 1:
+            meta = dict(meta, uses=uses - 1)
+            self._put(token, meta)
+            return meta, self._format_record("=", token, meta)
+
+        self._drop(token)
+        return (meta or {}), self._format_record("-", token)
+
+    def _update_locked(self, token: str, now: float, func):
+        """
+        Replace the metadata of `token` with `func(meta)`, which returns
+        (new meta or None to remove the token, result). Returns (result,
+        record to persist). Caller holds the lock and has caught up.
+        """
+        if token not in self.tokens:
+            return None, None
+
+        meta = self.tokens[token]
+        if self.is_expired(meta, now):
+            self._drop(token)
+            self.expired_count += 1
+            return None, self._format_record("-", token)
+
+        new_meta, result = func(dict(meta or {}))
+        if new_meta is None:
+            self._drop(token)
+            return result, self._format_record("-", token)
+        self._put(token, new_meta)
+        return result, self._format_record("=", token, new_meta)
+
+    def _due_locked(self, now: float) -> list:
+        """
+        Pop tokens whose expiry passed, returns [(token, meta)]
+        """
+        expired = []
+        for token in self.wheel.pop_due(now):
+            meta = self.tokens.get(token)
+            if token in self.tokens and self.is_expired(meta, now):
+                self._drop(token)
+                self.expired_count += 1
+                expired.append((token, meta))
+        return expired
+
+
+class MemoryTokenBackend(_TokenTable):
+    """
+    # tokens kept in memory, the file is only touched by load / save
+
+    The original store, useful for tests and read only token lists.
+    """
+
+    def __init__(self, tokens_file: str, wheel_resolution: float = 1.0):
+        super().__init__(wheel_resolution)
+        self.tokens_file = tokens_file
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            self._reset_table()  # start with empty table
+            if not os.path.exists(self.tokens_file):
+                return
+            try:
+                with open(self.tokens_file, "r", encoding="utf-8") as f:
+                    for line in f:
+                        self._apply_record(line)
+            except Exception as e:
+                # optional: log error, but don't crash the app
+                print(f"Warning: could not read tokens file {self.tokens_file}: {e}")
+
+    def add(self, token: str, meta: dict | None = None) -> bool:
+        with self._lock:
+            if token in self.tokens:
+                return False
+            self._put(token, meta)
+            return True
+
+    def remove(self, token: str) -> bool:
+        with self._lock:
+            if token not in self.tokens:
+                return False
+            self._drop(token)
+            return True
+
+    def take(self, token: str, now: float):
+        with self._lock:
+            meta, _ = self._take_locked(token, now)
+            return meta
+
+    def update(self, token: str, now: float, func):
+        with self._lock:
+            result, _ = self._update_locked(token, now, func)
+            return result
+
+    def expire(self, now: float) -> list:
+        with self._lock:
+            return self._due_locked(now)
+
+    def get(self, token: str):
+        return self.tokens.get(token)
+
+    def contains(self, token: str) -> bool:
+        return token in self.tokens
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.tokens)
+
+    def for_blobs(self, digests) -> dict[str, list[dict]]:
+        with self._lock:
+            return self._for_blobs_locked(digests)
+
+    def save(self) -> None:
+        path = Path(self.tokens_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(path, "w", encoding="utf-8") as f:
+            for token, meta in self.snapshot().items():
+                f.write(self._format_record("+", token, meta) + "\n")
+
+
+class AppendLogTokenBackend(_TokenTable):
+    """
+    # crash safe token store shared between processes
+
+    Every change is one appended record line (see `_TokenTable`). Old
+    one-token-per-line files load as is.
+
+    - add / remove are O(1): catch up on lines other processes appended,
+      then append one record under an exclusive `flock`
+    - remove / take are atomic across workers, only one of them consumes a token
+    - appends are fsynced in batches (`fsync_every` records or
+      `fsync_interval` seconds), compaction always fsyncs
+    - once dead records outnumber live tokens `compact_ratio` times the file
+      is rewritten to a temp file and renamed over the old one, other
+      processes notice the new inode and reload
+    """
+
+    def __init__(
+        self,
+        tokens_file: str,
+        fsync_every: int = 32,
+        fsync_interval: float = 1.0,
+        compact_ratio: float = 4.0,
+        compact_min_records: int = 1024,
+        wheel_resolution: float = 1.0
+    ):
+        super().__init__(wheel_resolution)
+        self.tokens_file = tokens_file
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+
+        self._lock = threading.RLock()
+        self._fd: int | None = None
+        self._pid: int | None = None
+        self._inode: int | None = None
+        self._offset = 0
+        self._partial = b""
+        self._records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        atexit.register(self.sync)
+
+    # file handling
+
+    def _open(self) -> int:
+        # a descriptor inherited through fork would share the flock
+        if self._fd is not None and self._pid == os.getpid() and self._inode_matches():
+            return self._fd
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+
+        Path(self.tokens_file).parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.tokens_file, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        self._pid = os.getpid()
+        # inode numbers of compacted files get reused, always reload a new file
+        self._inode = None
+        return self._fd
+
+    def _inode_matches(self) -> bool:
+        try:
+            return os.stat(self.tokens_file).st_ino == os.fstat(self._fd).st_ino
+        except OSError:
+            return False
+
+    def _apply(self, line: bytes) -> None:
+        if self._apply_record(line.decode("utf-8", "replace")):
+            self._records += 1
+
+    def _catch_up(self) -> None:
+        """
+        Apply records appended since the last call, reload after compaction
+        """
+        fd = self._open()
+        inode = os.fstat(fd).st_ino
+        if inode != self._inode:
+            self._inode = inode
+            self._offset = 0
+            self._partial = b""
+            self._records = 0
+            self._reset_table()
+
+        size = os.fstat(fd).st_size
+        while self._offset < size:
+            data = os.pread(fd, min(size - self._offset, 1024 * 1024), self._offset)
+            if not data:
+                break
+            self._offset += len(data)
+            *lines, self._partial = (self._partial + data).split(b"\n")
+            for line in lines:
+                self._apply(line)
+
+    def _append(self, record: str) -> None:
+        """
+        Persist and apply one record, must hold the exclusive file lock
+        """
+        fd = self._open()
+        # hand written files may lack the final newline, close that line
+        # first so the record does not glue onto it
+        prefix = b"\n" if self._partial else b""
+        os.write(fd, prefix + f"{record}\n".encode("utf-8"))
+        self._partial = b""
+        self._apply(record.encode("utf-8"))
+        self._offset = os.fstat(fd).st_size
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def _locked(self, exclusive: bool):
+        backend = self
+
+        class _FileLock:
+            def __enter__(self):
+                # a compaction may swap the file between open and flock,
+                # retry until the locked descriptor is the current file
+                while True:
+                    fd = backend._open()
+                    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                    if backend._inode_matches():
+                        self.fd = fd
+                        return
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+            def __exit__(self, *exc):
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return _FileLock()
+
+    # backend interface
+
+    def load(self) -> None:
+        with self._lock:
+            self._inode = None
+            with self._locked(exclusive=True):
+                self._catch_up()
+                if self._partial:
+                    # a last line without newline only counts in memory, the
+                    # file is left alone; it stays pending so records appended
+                    # after it are still read in order
+                    self._apply(self._partial)
+
+    def add(self, token: str, meta: dict | None = None) -> bool:
+        with self._lock, self._locked(exclusive=True):
+            self._catch_up()
+            if token in self.tokens:
+                return False
+            self._append(self._format_record("+", token, meta))
+            self._maybe_compact()
+            return True
+
+    def remove(self, token: str) -> bool:
+        with self._lock, self._locked(exclusive=True):
+            self._catch_up()
+            if token not in self.tokens:
+                return False
+            self._append(self._format_record("-", token))
+            self._maybe_compact()
+            return True
+
+    def take(self, token: str, now: float):
+        with self._lock:
+            # cheap rejection of unknown tokens without the file lock
+            self._catch_up()
+            if token not in self.tokens:
+                return None
+            with self._locked(exclusive=True):
+                self._catch_up()
+                meta, record = self._take_locked(token, now)
+                if record is not None:
+                    # the table is already updated, replaying the record is idempotent
+                    self._append(record)
+                    self._maybe_compact()
+                return meta
+
+    def update(self, token: str, now: float, func):
+        with self._lock, self._locked(exclusive=True):
+            self._catch_up()
+            result, record = self._update_locked(token, now, func)
+            if record is not None:
+                self._append(record)
+                self._maybe_compact()
+            return result
+
+    def expire(self, now: float) -> list:
+        with self._lock:
+            self._catch_up()
+            due = [token for token in self.wheel.pop_due(now) if self.is_expired(self.tokens.get(token), now)]
+            if not due:
+                return []
+
+            expired = []
+            with self._locked(exclusive=True):
+                self._catch_up()
+                for token in due:
+                    # another worker may have consumed or expired it already
+                    meta = self.tokens.get(token)
+                    if token in self.tokens and self.is_expired(meta, now):
+                        self._append(self._format_record("-", token))
+                        self.expired_count += 1
+                        expired.append((token, meta))
+                self._maybe_compact()
+            return expired
+
+    def get(self, token: str):
+        with self._lock:
+            self._catch_up()
+            return self.tokens.get(token)
+
+    def contains(self, token: str) -> bool:
+        with self._lock:
+            # appends are single write() calls, no file lock needed to read them
+            self._catch_up()
+            return token in self.tokens
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._catch_up()
+            return dict(self.tokens)
+
+    def for_blobs(self, digests) -> dict[str, list[dict]]:
+        with self._lock:
+            self._catch_up()
+            return self._for_blobs_locked(digests)
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid() and self._unsynced:
+                os.fsync(self._fd)
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def save(self) -> None:
+        """
+        Force a compaction, the file ends up with one line per live token
+        """
+        with self._lock, self._locked(exclusive=True):
+            self._catch_up()
+            self._compact()
+
+    # compaction
+
+    def _maybe_compact(self) -> None:
+        dead = self._records - len(self.tokens)
+        if self._records >= self.compact_min_records and dead > self.compact_ratio * max(len(self.tokens), 1):
+            self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rewrite the live set, must hold the exclusive file lock
+        """
+        temp_path = f"{self.tokens_file}.compact"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for token, meta in self.tokens.items():
+                f.write(self._format_record("+", token, meta) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.tokens_file)
+
+        directory = os.open(os.path.dirname(os.path.abspath(self.tokens_file)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        # the caller still holds the lock on the old descriptor,
+        # the next call reopens and reloads the compacted file
+        self._unsynced = 0
+
+
+def make_token_backend(tokens_file: str, kind: str):
+    if kind == "memory":
+        return MemoryTokenBackend(tokens_file)
+    if kind == "log":
+        return AppendLogTokenBackend(tokens_file)
+    raise ValueError(f"Unknown token backend {kind}")
+
+
 class Tokens:
     """
     # class for manage token mini database
+
+    Storage is pluggable, `backend="log"` (default from
+    `Config.TokensConfig.BACKEND`) keeps every change on disk and is shared
+    between workers, `backend="memory"` is the old in-process set.
+
+    Tokens may carry metadata: the file they unlock, creation time,
+    expiry and remaining uses (see `issue_token`).
     """
 
     def __init__(
@@ -12,7 +529,8 @@ class Tokens:
         tokens_file: str,
         tokens_length: int,
         symbols: str = "qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM123456789",
-        token_start: str = ""
+        token_start: str = "",
+        backend=None
         ):
         """
         # init Tokens object
@@ -26,16 +544,31 @@ class Tokens:
         ```python
         tokens = Tokens("tokens.txt", 15, your_symbols)
         ```
+
+        ## other storage
+        ```python
+        tokens = Tokens("tokens.txt", 15, backend="memory")
+        ```
         """
+        from src.config import Config
 
-        self.tokens: set[str] = set()
+        if backend is None:
+            backend = Config.TokensConfig.BACKEND
+        if isinstance(backend, str):
+            backend = make_token_backend(tokens_file, backend)
+
+        self.backend = backend
         self.tokens_file = tokens_file
         self.symbols = symbols
         self.tokens_length = tokens_length
         self.token_start = token_start
 
         self.read_tokens()
-    
+
+    @property
+    def tokens(self) -> set[str]:
+        return set(self.backend.snapshot())
+
     def gen_token(self) -> str:
         token = ''.join(
             secrets.choice(self.symbols)
@@ -43,10 +576,10 @@ class Tokens:
         )
         return self.token_start + token
 
-    def add_token(self, token: str) -> bool:
+    def add_token(self, token: str, meta: dict | None = None) -> bool:
         """
         # add new token to file if that not exist
-        
+
         ## example
         ```python
         token = tokens.gen_token()
@@ -56,16 +589,46 @@ class Tokens:
             print(f"adding {token} was error")
         ```
         """
-        if token not in self.tokens:
-            self.tokens.add(token)
-            return True
-        return False
+        return self.backend.add(token, meta)
+
+    def issue_token(
+        self,
+        target_file: str | None = None,
+        ttl: float | None = None,
+        uses: int | None = None,
+        **fields
+        ) -> str:
+        """
+        # generate and add a token with metadata
+
+        extra keyword arguments are stored in the metadata as is
+
+        ## example
+        ```python
+        token = tokens.issue_token("uploads/report.pdf.aes", ttl=3600, uses=1)
+        ```
+        """
+        now = time.time()
+        meta = dict(fields, created=now)
+        if target_file is not None:
+            meta["file"] = target_file
+        if ttl is not None:
+            meta["expires"] = now + ttl
+        if uses is not None:
+            meta["uses"] = uses
+
+        while True:
+            token = self.gen_token()
+            if self.add_token(token, meta):
+                return token
 
 
     def remove_token(self, token: str) -> bool:
         """
         # remove token from file
-        
+
+        only one caller (also across workers) gets True for the same token
+
         ## example
         ```python
         if tokens.remove_token(token):
@@ -74,15 +637,33 @@ class Tokens:
             print(f"removing token {token} was errors")
         ```
         """
-        if token in self.tokens:
-            self.tokens.remove(token)
-            return True
-        return False
+        return self.backend.remove(token)
+
+    def consume_token(self, token: str) -> dict | None:
+        """
+        # use a token once
+
+        Returns its metadata (`{}` for plain tokens) or None when the token
+        does not exist or expired. The token is removed when its last use
+        is taken, atomic across workers.
+        """
+        return self.backend.take(token, time.time())
+
+    def update_token(self, token: str, func):
+        """
+        # change a token's metadata atomically
+
+        `func(meta)` returns (new metadata or None to remove the token,
+        result), runs under the store lock (also across workers) and
+        `update_token` returns its result. None when the token does not
+        exist or expired.
+        """
+        return self.backend.update(token, time.time(), func)
 
 
     def check_token(self, token: str) -> bool:
         """
-        # check exist token in file
+        # check exist token in file, expired tokens don't count
 
         ## example
         ```python
@@ -92,35 +673,52 @@ class Tokens:
             print(f"Token {token} doesn't exist")
         ```
         """
-        return token in self.tokens
+        if not self.backend.contains(token):
+            return False
+        return not _TokenTable.is_expired(self.backend.get(token), time.time())
+
+    def token_meta(self, token: str) -> dict | None:
+        return self.backend.get(token)
+
+    def blob_tokens(self, digests) -> dict[str, list[dict]]:
+        """
+        Metadata of the live tokens pointing at each of `digests` (the
+        `blob` entry), looked up in the per-blob index without a scan.
+        Digests no live token points at are left out.
+        """
+        now = time.time()
+        found = {}
+        for digest, metas in self.backend.for_blobs(digests).items():
+            live = [meta for meta in metas if not _TokenTable.is_expired(meta, now)]
+            if live:
+                found[digest] = live
+        return found
+
+    def sweep(self) -> list:
+        """
+        Remove expired tokens, returns `[(token, meta)]` so the caller can
+        clean up what they pointed to
+        """
+        return self.backend.expire(time.time())
+
+    def stats(self) -> dict:
+        snapshot = self.backend.snapshot()
+        return {
+            "live": len(snapshot),
+            "with_expiry": len(self.backend.wheel),
+            "expired": self.backend.expired_count,
+        }
 
 
     def read_tokens(self):
         """
         Function for load tokens from file
         """
-        self.tokens = set()  # start with empty set
-        if not os.path.exists(self.tokens_file):
-            return
-        try:
-            with open(self.tokens_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    token = line.strip()
-                    if token:
-                        self.tokens.add(token)
-        except Exception as e:
-            # optional: log error, but don't crash the app
-            print(f"Warning: could not read tokens file {self.tokens_file}: {e}")
-
-        
+        self.backend.load()
+
+
     def write_tokens(self):
         """
-        Function for save tokens to file 
+        Function for save tokens to file
         """
-
-        path = Path(self.tokens_file)
-        path.parent.mkdir(parents=True, exist_ok=True)
-
-        with open(path, "w", encoding="utf-8") as f:
-            for token in self.tokens:
-                f.write(f"{token}\n")
\ No newline at end of file
+        self.backend.save()
@@ -1,15 +1,67 @@
 import base64
 import hashlib
+import hmac
+import mmap
 import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from src.compression import CODEC_SIZE, Codec, FrameReader, FrameWriter, compression_skipped, worth_compressing
+from src.config import Config
+from src.crypto_executor import crypto_executor
+from src.kdf import PARAMS_SIZE, KdfParams
+from src.key_cache import KeyCache
+from src.metrics import record_crypto
+
 
 AES_HEADER = b"AES1"
 NONCE_SIZE = 12
 
+# AES2: chunked container, every segment sealed on its own
+#   header  = b"AES2" | segment size (u32 BE) | nonce prefix (7 bytes)
+#   segment = AESGCM(nonce = prefix | index (u32 BE) | final flag (1 byte), aad = header)
+# the index and final flag live in the nonce, so reordering, dropping or
+# truncating segments breaks authentication
+AES2_HEADER = b"AES2"
+AES2_NONCE_PREFIX_SIZE = 7
+AES2_HEADER_SIZE = len(AES2_HEADER) + 4 + AES2_NONCE_PREFIX_SIZE
+SEGMENT_SIZE = 64 * 1024
+TAG_SIZE = 16
+
+# AES3: AES2 with a salted password KDF, new ciphertexts are written as AES3
+#   header  = b"AES3" | KDF params (see src/kdf.py) | segment size (u32 BE) | nonce prefix (7 bytes)
+# AES1 and AES2 keep the unsalted SHA-256 key and can still be decrypted
+AES3_HEADER = b"AES3"
+AES3_HEADER_SIZE = len(AES3_HEADER) + PARAMS_SIZE + 4 + AES2_NONCE_PREFIX_SIZE
+
+# AES4: AES3 over compressed frames (see src/compression.py)
+#   header  = b"AES4" | KDF params | codec id (1 byte) | level (1 byte) | segment size (u32 BE) | nonce prefix (7 bytes)
+# the codec is part of the header and so of every segment's AAD
+AES4_HEADER = b"AES4"
+AES4_HEADER_SIZE = AES3_HEADER_SIZE + CODEC_SIZE
+SEGMENTED_HEADERS = (AES2_HEADER, AES3_HEADER, AES4_HEADER)
+
+# size of the reads used by the file helpers
+IO_CHUNK_SIZE = 256 * 1024
+# reads that feed the segment pool, big enough to split across cores
+BATCH_READ_SIZE = Config.SegmentPoolConfig.BATCH_BYTES
+
+# one-shot encrypt/decrypt reuse ciphers from here, streams derive their own
+key_cache = KeyCache(
+    max_entries=Config.KeyCacheConfig.MAX_ENTRIES,
+    ttl_seconds=Config.KeyCacheConfig.TTL_SECONDS,
+)
+
 
 def _derive_key(key_material: str) -> bytes:
+    """
+    Legacy AES1 / AES2 key, a plain SHA-256 of the password
+    """
     if not key_material:
         raise ValueError("Key is required")
     return hashlib.sha256(key_material.encode("utf-8")).digest()
@@ -19,27 +71,551 @@ def generate_aes_key() -> str:
     return base64.urlsafe_b64encode(os.urandom(32)).decode("ascii")
 
 
+def _segment_nonce(prefix: bytes, index: int, final: bool) -> bytes:
+    if index > 0xFFFFFFFF:
+        raise ValueError("Too many segments")
+    return prefix + struct.pack(">I", index) + (b"\x01" if final else b"\x00")
+
+
+def _container_header(params: KdfParams | None, segment_size: int, prefix: bytes,
+                      codec: Codec | None = None) -> bytes:
+    if segment_size <= 0 or segment_size > 0xFFFFFFFF:
+        raise ValueError("Invalid segment size")
+    if len(prefix) != AES2_NONCE_PREFIX_SIZE:
+        raise ValueError("Invalid nonce prefix")
+    if params is None:
+        if codec is not None:
+            raise ValueError("Compression needs KDF parameters")
+        return AES2_HEADER + struct.pack(">I", segment_size) + prefix
+    if codec is not None:
+        return AES4_HEADER + params.encode() + codec.encode() + struct.pack(">I", segment_size) + prefix
+    return AES3_HEADER + params.encode() + struct.pack(">I", segment_size) + prefix
+
+
+def _parse_container_header(data) -> tuple | None:
+    """
+    (header, params or None, segment size, prefix, codec or None) of an
+    AES2 / AES3 / AES4 header at the start of `data`, None while it is
+    incomplete
+    """
+    magic = bytes(data[:len(AES2_HEADER)])
+    if magic == AES2_HEADER:
+        header_size, params_size, codec_size = AES2_HEADER_SIZE, 0, 0
+    elif magic == AES4_HEADER:
+        header_size, params_size, codec_size = AES4_HEADER_SIZE, PARAMS_SIZE, CODEC_SIZE
+    else:
+        header_size, params_size, codec_size = AES3_HEADER_SIZE, PARAMS_SIZE, 0
+    if len(data) < header_size:
+        return None
+
+    header = bytes(data[:header_size])
+    params_end = len(AES3_HEADER) + params_size
+    params = KdfParams.decode(header[len(AES3_HEADER):params_end]) if params_size else None
+    codec = Codec.decode(header[params_end:params_end + codec_size]) if codec_size else None
+    size_start = params_end + codec_size
+    (segment_size,) = struct.unpack(">I", header[size_start:size_start + 4])
+    if segment_size == 0:
+        raise ValueError("Invalid AES2 header")
+    return header, params, segment_size, header[size_start + 4:], codec
+
+
+class _SegmentPool:
+    """
+    Threads for segment level parallelism inside one payload.
+
+    Segments authenticate on their own and their position is part of the
+    nonce, so runs of them can be sealed / opened on any core and simply
+    joined in order. OpenSSL releases the GIL while it works, threads are
+    enough. Separate from the crypto executor, whose jobs block on this
+    pool and would deadlock sharing it.
+    """
+
+    def __init__(self, threads: int, min_bytes: int, run_bytes: int):
+        self.threads = threads
+        self.min_bytes = min_bytes
+        self.run_bytes = run_bytes
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="segment")
+        return self._pool
+
+    def map(self, func, size: int, step: int, count: int) -> list:
+        """
+        `func(start, stop)` over `count` units of `step` bytes each, spread
+        in runs across the threads when `size` is worth it, results in order
+        """
+        per_run = max(self.run_bytes // step, 1)
+        bounds = [(start, min(start + per_run, count)) for start in range(0, count, per_run)]
+        if self.threads < 2 or size < self.min_bytes or len(bounds) < 2:
+            return [func(start, stop) for start, stop in bounds]
+        return list(self._executor().map(lambda bound: func(*bound), bounds))
+
+
+segment_pool = _SegmentPool(
+    threads=Config.SegmentPoolConfig.THREADS,
+    min_bytes=Config.SegmentPoolConfig.MIN_BYTES,
+    run_bytes=Config.SegmentPoolConfig.RUN_BYTES,
+)
+
+
+def _seal_pieces(cipher: AESGCM, header: bytes, prefix: bytes, segment_size: int,
+                 first_index: int, data: bytes, final: bool) -> list[bytes]:
+    """
+    Sealed segments of `data` in order, callers join them once
+    """
+    view = memoryview(data)
+    count = max(-(-len(data) // segment_size), 1)
+
+    def seal_run(start: int, stop: int) -> list[bytes]:
+        pieces = []
+        for number in range(start, stop):
+            offset = number * segment_size
+            last = final and number == count - 1
+            nonce = _segment_nonce(prefix, first_index + number, last)
+            pieces.append(cipher.encrypt(nonce, view[offset:offset + segment_size], header))
+        return pieces
+
+    return [piece for run in segment_pool.map(seal_run, len(data), segment_size, count) for piece in run]
+
+
+def _seal_segments(cipher: AESGCM, header: bytes, prefix: bytes, segment_size: int,
+                   first_index: int, data: bytes, final: bool) -> bytes:
+    return b"".join(_seal_pieces(cipher, header, prefix, segment_size, first_index, data, final))
+
+
+def _open_pieces(cipher: AESGCM, header: bytes, prefix: bytes, segment_size: int,
+                 first_index: int, data: bytes, final: bool) -> list[bytes]:
+    """
+    Reverse of `_seal_pieces`, `data` is whole sealed segments (the
+    last one may be short when `final`)
+    """
+    sealed_size = segment_size + TAG_SIZE
+    view = memoryview(data)
+    count = -(-len(data) // sealed_size)
+
+    def open_run(start: int, stop: int) -> list[bytes]:
+        pieces = []
+        for number in range(start, stop):
+            offset = number * sealed_size
+            last = final and number == count - 1
+            nonce = _segment_nonce(prefix, first_index + number, last)
+            pieces.append(cipher.decrypt(nonce, view[offset:offset + sealed_size], header))
+        return pieces
+
+    return [piece for run in segment_pool.map(open_run, len(data), sealed_size, count) for piece in run]
+
+
+def _open_segments(cipher: AESGCM, header: bytes, prefix: bytes, segment_size: int,
+                   first_index: int, data: bytes, final: bool) -> bytes:
+    return b"".join(_open_pieces(cipher, header, prefix, segment_size, first_index, data, final))
+
+
+def _sealing_key(key_material: str):
+    """
+    Lease the key new one-shot ciphertexts are sealed with. Every password
+    gets a fresh salt that lives as long as its cache entry, so repeated
+    calls skip the KDF. `entry.info` holds the KdfParams.
+    """
+    def derive(key_material: str):
+        params = KdfParams.new()
+        return params.derive(key_material), params
+
+    return key_cache.lease_entry(key_material, derive, context=b"seal")
+
+
+def _opening_key(key_material: str, params: KdfParams | None):
+    if params is None:
+        return key_cache.lease(key_material, _derive_key)
+    return key_cache.lease(key_material, params.derive, context=params.encode())
+
+
+class StreamEncryptor:
+    """
+    Incremental AES3 encryptor.
+
+    Feed plaintext with `update()` and call `finalize()` once at the end,
+    every call returns ciphertext ready to be written. Memory use is bounded
+    by one segment no matter how big the input is.
+
+    Every stream gets its own salt (or `params`). The KDF runs on the first
+    `update()` / `finalize()`, so it happens wherever those run - on the
+    crypto executor, not the event loop.
+
+    With a `compress` codec the plaintext is compressed in blocks first and
+    the stream is AES4. With `sample` the first block is held back and test
+    compressed, when it does not shrink the stream stays plain AES3.
+    `compression` then reports the ratio and throughput.
+
+    ```python
+    encryptor = StreamEncryptor(key)
+    for chunk in chunks:
+        out.write(encryptor.update(chunk))
+    out.write(encryptor.finalize())
+    ```
+    """
+
+    def __init__(self, key_material: str, segment_size: int = SEGMENT_SIZE, params: KdfParams | None = None,
+                 compress: Codec | None = None, sample: bool = False):
+        if not key_material:
+            raise ValueError("Key is required")
+
+        self._key_material = key_material
+        self._params = params or KdfParams.new()
+        self._cipher: AESGCM | None = None
+        self._segment_size = segment_size
+        self._prefix = os.urandom(AES2_NONCE_PREFIX_SIZE)
+        self._header = b""
+        self._buffer = bytearray()
+        self._index = 0
+        self._header_sent = False
+        self._finalized = False
+
+        self._frames = FrameWriter(compress, map_blocks=segment_pool.map) if compress is not None else None
+        self._sample = bytearray() if compress is not None and sample else None
+
+    @property
+    def compression(self) -> dict | None:
+        """
+        Codec, sizes, ratio and MB/s of the compression stage, None without one
+        """
+        return self._frames.describe() if self._frames is not None else None
+
+    def _take_header(self) -> bytes:
+        if self._cipher is None:
+            self._cipher = AESGCM(self._params.derive(self._key_material))
+            self._key_material = None
+            codec = self._frames.codec if self._frames is not None else None
+            self._header = _container_header(self._params, self._segment_size, self._prefix, codec)
+        if self._header_sent:
+            return b""
+        self._header_sent = True
+        return self._header
+
+    def _sampled(self, data, final: bool):
+        """
+        Hold plaintext until the sample block is complete, then decide on
+        compression. Returns the data to go on with, None while waiting.
+        """
+        if self._sample is None:
+            return data
+        self._sample += data
+        if len(self._sample) < self._frames.block_size and not final:
+            return None
+        data = bytes(self._sample)
+        self._sample = None
+        if not worth_compressing(self._frames.codec, data[:self._frames.block_size]):
+            compression_skipped.inc(1, "sample")
+            self._frames = None
+        return data
+
+    def _seal_buffer(self, final: bool) -> list[bytes]:
+        if final:
+            ready = len(self._buffer)
+        else:
+            # keep at least one byte back, the last segment has to be sealed as final
+            ready = (len(self._buffer) - 1) // self._segment_size * self._segment_size
+        if ready <= 0 and not final:
+            return []
+        pieces = _seal_pieces(
+            self._cipher, self._header, self._prefix, self._segment_size,
+            self._index, bytes(self._buffer[:ready]), final=final,
+        )
+        self._index += len(pieces)
+        del self._buffer[:ready]
+        return pieces
+
+    def update(self, data: bytes) -> bytes:
+        if self._finalized:
+            raise ValueError("Encryptor already finalized")
+
+        data = self._sampled(data, final=False)
+        if data is None:
+            return b""
+        if self._frames is not None:
+            data = self._frames.update(data)
+
+        pieces = [self._take_header()]
+        started = time.perf_counter()
+        self._buffer += data
+        pieces += self._seal_buffer(final=False)
+        record_crypto("encrypt", len(data), started)
+        return b"".join(pieces)
+
+    def finalize(self) -> bytes:
+        if self._finalized:
+            raise ValueError("Encryptor already finalized")
+        self._finalized = True
+
+        data = self._sampled(b"", final=True)
+        if self._frames is not None:
+            data = self._frames.update(data) + self._frames.finalize()
+
+        header = self._take_header()
+        started = time.perf_counter()
+        self._buffer += data
+        size = len(self._buffer)
+        out = header + b"".join(self._seal_buffer(final=True))
+        self._buffer = bytearray()
+        record_crypto("encrypt", size, started)
+        return out
+
+
+class SegmentSealer:
+    """
+    Seals AES2 / AES3 segments at fixed positions of one stream.
+
+    Unlike `StreamEncryptor` calls do not depend on each other, parts of a
+    stream can be sealed out of order (or by different workers) and later
+    joined behind `header`. Only the last part of the stream is sealed with
+    `final=True`. With `params` the stream is AES3 and the derived key comes
+    from the key cache, without it is legacy AES2.
+
+    ```python
+    sealer = SegmentSealer(key, prefix, params=params)
+    part = sealer.seal(first_index=16, data=chunk, final=False)
+    ```
+    """
+
+    def __init__(self, key_material: str, prefix: bytes, segment_size: int = SEGMENT_SIZE,
+                 params: KdfParams | None = None):
+        if not key_material:
+            raise ValueError("Key is required")
+
+        self._key_material = key_material
+        self._params = params
+        self._prefix = prefix
+        self.segment_size = segment_size
+        self.header = _container_header(params, segment_size, prefix)
+
+    def seal(self, first_index: int, data: bytes, final: bool) -> bytes:
+        """
+        Seal `data` as the segments starting at `first_index`. Unless it is
+        `final`, `data` has to be a whole number of segments.
+        """
+        if not final and (not data or len(data) % self.segment_size):
+            raise ValueError("Partial segment in a non-final part")
+
+        with _opening_key(self._key_material, self._params) as cipher:
+            started = time.perf_counter()
+            out = _seal_segments(cipher, self.header, self._prefix, self.segment_size, first_index, data, final)
+            record_crypto("encrypt", len(data), started)
+        return out
+
+
+def key_fingerprint(key_material: str, context: bytes, params: KdfParams | None = None) -> str:
+    """
+    HMAC of `context` under the derived key, lets a stored record check
+    that later requests use the same key without keeping the key
+    """
+    if params is None:
+        return hmac.new(_derive_key(key_material), context, hashlib.sha256).hexdigest()
+    with key_cache.lease_entry(key_material, params.derive, context=params.encode()) as entry:
+        return hmac.new(bytes(entry.key), context, hashlib.sha256).hexdigest()
+
+
+class StreamDecryptor:
+    """
+    Incremental decryptor for AES4, AES3, AES2 and legacy AES1 data.
+
+    The container version is detected from the first bytes, AES3 / AES4
+    keys are derived with the KDF parameters from the header. AES2 - AES4
+    segments are only released after they authenticate, AES4 frames are
+    decompressed after that. AES1 was sealed as a single
+    GCM message, so its plaintext is released before the tag is checked in
+    `finalize()` - callers must throw the output away if it raises.
+    """
+
+    def __init__(self, key_material: str):
+        if not key_material:
+            raise ValueError("Key is required")
+
+        self._key_material = key_material
+        self._buffer = bytearray()
+        self._version: bytes | None = None
+        self._finalized = False
+
+        # AES2 / AES3 state
+        self._cipher: AESGCM | None = None
+        self._header = b""
+        self._prefix = b""
+        self._segment_size = 0
+        self._index = 0
+        self._frames: FrameReader | None = None
+
+        # AES1 state
+        self._legacy = None
+
+    def _read_header(self) -> bool:
+        """
+        Parse the container header once enough bytes arrived
+        """
+        if len(self._buffer) < len(AES_HEADER):
+            return False
+
+        magic = bytes(self._buffer[:len(AES_HEADER)])
+
+        if magic in SEGMENTED_HEADERS:
+            parsed = _parse_container_header(self._buffer)
+            if parsed is None:
+                return False
+            self._header, params, self._segment_size, self._prefix, codec = parsed
+            key = params.derive(self._key_material) if params else _derive_key(self._key_material)
+            self._cipher = AESGCM(key)
+            if codec is not None:
+                self._frames = FrameReader(codec, map_blocks=segment_pool.map)
+            del self._buffer[:len(self._header)]
+
+        elif magic == AES_HEADER:
+            header_size = len(AES_HEADER) + NONCE_SIZE
+            if len(self._buffer) < header_size:
+                return False
+            nonce = bytes(self._buffer[len(AES_HEADER):header_size])
+            self._legacy = Cipher(algorithms.AES(_derive_key(self._key_material)), modes.GCM(nonce)).decryptor()
+            del self._buffer[:header_size]
+
+        else:
+            raise ValueError("Invalid AES header")
+
+        self._key_material = None
+        self._version = magic
+        return True
+
+    @property
+    def legacy(self) -> bool:
+        """
+        AES1 input, nothing `update()` returned is authentic before `finalize()`
+        """
+        return self._version == AES_HEADER
+
+    def _open(self, segment: bytes, final: bool) -> bytes:
+        nonce = _segment_nonce(self._prefix, self._index, final)
+        self._index += 1
+        return self._cipher.decrypt(nonce, segment, self._header)
+
+    def update(self, data: bytes) -> bytes:
+        started = time.perf_counter()
+        out = self._update(data)
+        record_crypto("decrypt", len(out), started)
+        return self._frames.update(out) if self._frames is not None else out
+
+    def finalize(self) -> bytes:
+        started = time.perf_counter()
+        out = self._finalize()
+        record_crypto("decrypt", len(out), started)
+        if self._frames is None:
+            return out
+        return self._frames.update(out) + self._frames.finalize()
+
+    def _update(self, data: bytes) -> bytes:
+        if self._finalized:
+            raise ValueError("Decryptor already finalized")
+
+        self._buffer += data
+        if self._version is None and not self._read_header():
+            return b""
+
+        if self._version == AES_HEADER:
+            # hold back the trailing tag until finalize
+            if len(self._buffer) <= TAG_SIZE:
+                return b""
+            ready = bytes(self._buffer[:-TAG_SIZE])
+            del self._buffer[:-TAG_SIZE]
+            return self._legacy.update(ready)
+
+        sealed_size = self._segment_size + TAG_SIZE
+        # a segment is only known to be non-final once more data follows it
+        ready = (len(self._buffer) - 1) // sealed_size * sealed_size
+        if ready <= 0:
+            return b""
+        out = _open_segments(
+            self._cipher, self._header, self._prefix, self._segment_size,
+            self._index, bytes(self._buffer[:ready]), final=False,
+        )
+        self._index += ready // sealed_size
+        del self._buffer[:ready]
+        return out
+
+    def _finalize(self) -> bytes:
+        if self._finalized:
+            raise ValueError("Decryptor already finalized")
+        self._finalized = True
+
+        if self._version is None:
+            raise ValueError("Invalid encrypted data")
+
+        if self._version == AES_HEADER:
+            if len(self._buffer) != TAG_SIZE:
+                raise ValueError("Invalid encrypted data")
+            return self._legacy.finalize_with_tag(bytes(self._buffer))
+
+        if len(self._buffer) < TAG_SIZE:
+            raise ValueError("Invalid encrypted data")
+        out = self._open(bytes(self._buffer), final=True)
+        self._buffer = bytearray()
+        return out
+
+
+def _seal_once(cipher: AESGCM, params: KdfParams, data: bytes) -> bytes:
+    prefix = os.urandom(AES2_NONCE_PREFIX_SIZE)
+    header = _container_header(params, SEGMENT_SIZE, prefix)
+    return b"".join([header] + _seal_pieces(cipher, header, prefix, SEGMENT_SIZE, 0, data, final=True))
+
+
+def _open_segmented(data: bytes, key_material: str) -> bytes:
+    """
+    One-shot AES2 - AES4 decryption with a cached key
+    """
+    parsed = _parse_container_header(data)
+    if parsed is None:
+        raise ValueError("Invalid encrypted data")
+    header, params, segment_size, prefix, codec = parsed
+
+    body = memoryview(data)[len(header):]
+    if len(body) < TAG_SIZE:
+        raise ValueError("Invalid encrypted data")
+
+    with _opening_key(key_material, params) as cipher:
+        started = time.perf_counter()
+        # the last segment may be full size too, it is the one without data after it
+        out = _open_segments(cipher, header, prefix, segment_size, 0, body, final=True)
+        record_crypto("decrypt", len(out), started)
+    if codec is None:
+        return out
+    frames = FrameReader(codec, map_blocks=segment_pool.map)
+    return frames.update(out) + frames.finalize()
+
+
 def encrypt_bytes(data: bytes, key_material: str) -> bytes:
-    key = _derive_key(key_material)
-    nonce = os.urandom(NONCE_SIZE)
-    cipher = AESGCM(key)
-    ciphertext = cipher.encrypt(nonce, data, None)
-    return AES_HEADER + nonce + ciphertext
+    with _sealing_key(key_material) as entry:
+        started = time.perf_counter()
+        sealed = _seal_once(entry.cipher, entry.info, data)
+        record_crypto("encrypt", len(data), started)
+    return sealed
 
 
 def decrypt_bytes(data: bytes, key_material: str) -> bytes:
+    if data.startswith(SEGMENTED_HEADERS):
+        return _open_segmented(data, key_material)
+
     if len(data) < len(AES_HEADER) + NONCE_SIZE + 1:
         raise ValueError("Invalid encrypted data")
     if not data.startswith(AES_HEADER):
         raise ValueError("Invalid AES header")
 
-    key = _derive_key(key_material)
     nonce_start = len(AES_HEADER)
     nonce_end = nonce_start + NONCE_SIZE
     nonce = data[nonce_start:nonce_end]
     ciphertext = data[nonce_end:]
-    cipher = AESGCM(key)
-    return cipher.decrypt(nonce, ciphertext, None)
+    with key_cache.lease(key_material, _derive_key) as cipher:
+        started = time.perf_counter()
+        plain = cipher.decrypt(nonce, ciphertext, None)
+        record_crypto("decrypt", len(plain), started)
+        return plain
 
 
 def encrypt_text_to_base64(text: str, key_material: str) -> str:
@@ -47,34 +623,312 @@ def encrypt_text_to_base64(text: str, key_material: str) -> str:
     return base64.b64encode(encrypted).decode("ascii")
 
 
-def encrypt_file(file_path: str, key_material: str, output_path: str | None = None) -> str:
-    with open(file_path, "rb") as source_file:
-        file_data = source_file.read()
+def decrypt_base64_to_text(payload: str, key_material: str) -> str:
+    decrypted = decrypt_bytes(base64.b64decode(payload, validate=True), key_material)
+    return decrypted.decode("utf-8")
+
+
+def encrypt_texts_to_base64(texts: list[str], key_material: str) -> list[str]:
+    """
+    Batch form of `encrypt_text_to_base64`, one cipher lease for the whole list
+    """
+    results = []
+    size = 0
+    started = time.perf_counter()
+    with _sealing_key(key_material) as entry:
+        for text in texts:
+            plain = text.encode("utf-8")
+            size += len(plain)
+            encrypted = _seal_once(entry.cipher, entry.info, plain)
+            results.append(base64.b64encode(encrypted).decode("ascii"))
+    record_crypto("encrypt", size, started)
+    return results
+
+
+def decrypt_texts_from_base64(payloads: list[str], key_material: str,
+                              kdf_params: set | None = None) -> list[str | None]:
+    """
+    Batch form of `decrypt_base64_to_text`, items that fail to decode,
+    authenticate or are not utf-8 come back as None.
+
+    `kdf_params` collects the encoded KDF params keys were derived for and
+    may be shared by the groups of one request. Once it holds
+    `Config.BatchConfig.MAX_KDF_PARAMS` entries, items with other params
+    come back as None without a derivation, a batch can not make the
+    server run one KDF per item.
+    """
+    if kdf_params is None:
+        kdf_params = set()
+    results = []
+    for payload in payloads:
+        try:
+            data = base64.b64decode(payload, validate=True)
+            parsed = _parse_container_header(data) if data.startswith(SEGMENTED_HEADERS) else None
+            if parsed is not None and parsed[1] is not None:
+                encoded = parsed[1].encode()
+                if encoded not in kdf_params:
+                    if len(kdf_params) >= Config.BatchConfig.MAX_KDF_PARAMS:
+                        raise ValueError("Too many KDF parameters in one batch")
+                    kdf_params.add(encoded)
+            results.append(decrypt_bytes(data, key_material).decode("utf-8"))
+        except Exception:
+            results.append(None)
+    return results
+
+
+class _MappedInput:
+    """
+    Read-only mmap of a whole file, `view` slices go to the cipher without
+    being copied. Pages behind `done_until()` are dropped again, so a big
+    file never stays resident.
+    """
 
-    encrypted_data = encrypt_bytes(file_data, key_material)
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = None
+        self._dropped = 0
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self._map, "madvise"):
+                self._map.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self._map if self._map is not None else b"")
 
+    def done_until(self, offset: int) -> None:
+        if self._map is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        aligned = offset // mmap.PAGESIZE * mmap.PAGESIZE
+        if aligned > self._dropped:
+            self._map.madvise(mmap.MADV_DONTNEED, self._dropped, aligned - self._dropped)
+            self._dropped = aligned
+
+    def close(self) -> None:
+        try:
+            self.view.release()
+            if self._map is not None:
+                self._map.close()
+        except BufferError:
+            pass  # a traceback still holds slices, the mapping is freed with them
+        self._file.close()
+
+    def __enter__(self) -> "_MappedInput":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def _create_output(path: str, size: int) -> int:
+    """
+    Open `path` for writing with `size` bytes reserved up front, so the
+    file system allocates it in one go
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # not supported by this file system, plain writes still work
+    return fd
+
+
+def _write_pieces(fd: int, pieces: list) -> None:
+    """
+    Vectored write of all `pieces`, no joined copy is built
+    """
+    if not hasattr(os, "writev"):
+        for piece in pieces:
+            view = memoryview(piece)
+            while view:
+                view = view[os.write(fd, view):]
+        return
+
+    iov_max = os.sysconf("SC_IOV_MAX")
+    pending = list(pieces)
+    while pending:
+        written = os.writev(fd, pending[:iov_max])
+        # short writes are rare on regular files, skip what went out
+        while pending and written >= len(pending[0]):
+            written -= len(pending[0])
+            pending.pop(0)
+        if written:
+            pending[0] = memoryview(pending[0])[written:]
+
+
+def _map_to_file(file_path: str, output_path: str, work) -> None:
+    """
+    Run `work(source)` on a mapped input, the output it writes is removed
+    on failure
+    """
+    try:
+        with _MappedInput(file_path) as source:
+            work(source)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+def encrypted_file_path(file_path: str) -> str:
+    return f"{file_path}.aes"
+
+
+def decrypted_file_path(file_path: str) -> str:
+    if file_path.endswith(".aes"):
+        return file_path[:-4]
+    return f"{file_path}_decrypted"
+
+
+def _stream_mapped(source: _MappedInput, transform, output_path: str) -> None:
+    """
+    Run a mapped input through a StreamEncryptor / StreamDecryptor, for
+    AES4 whose output size is not known up front
+    """
+    fd = _create_output(output_path, 0)
+    try:
+        for offset in range(0, source.size, BATCH_READ_SIZE):
+            end = min(offset + BATCH_READ_SIZE, source.size)
+            _write_pieces(fd, [transform.update(source.view[offset:end])])
+            source.done_until(end)
+        _write_pieces(fd, [transform.finalize()])
+    finally:
+        os.close(fd)
+
+
+def encrypt_file(file_path: str, key_material: str, output_path: str | None = None,
+                 compress: Codec | None = None, sample: bool = False) -> str:
+    """
+    Encrypt a file into AES3. The input is memory mapped and sealed in
+    `BATCH_READ_SIZE` steps straight from the mapping, the output size is
+    known up front and reserved before the segments are written. With
+    `compress` (and `sample`) it goes through `StreamEncryptor` into AES4.
+    """
     if output_path is None:
-        output_path = f"{file_path}.aes"
+        output_path = encrypted_file_path(file_path)
 
-    with open(output_path, "wb") as output_file:
-        output_file.write(encrypted_data)
+    if compress is not None:
+        encryptor = StreamEncryptor(key_material, compress=compress, sample=sample)
+        _map_to_file(file_path, output_path, lambda source: _stream_mapped(source, encryptor, output_path))
+        return output_path
 
+    params = KdfParams.new()
+    prefix = os.urandom(AES2_NONCE_PREFIX_SIZE)
+    header = _container_header(params, SEGMENT_SIZE, prefix)
+    cipher = AESGCM(params.derive(key_material))
+    batch = max(BATCH_READ_SIZE // SEGMENT_SIZE, 1) * SEGMENT_SIZE
+
+    def work(source: _MappedInput) -> None:
+        segments = max(-(-source.size // SEGMENT_SIZE), 1)
+        fd = _create_output(output_path, len(header) + source.size + segments * TAG_SIZE)
+        try:
+            pieces = [header]
+            offset = 0
+            final = False
+            while not final:
+                end = min(offset + batch, source.size)
+                final = end >= source.size
+                started = time.perf_counter()
+                pieces += _seal_pieces(
+                    cipher, header, prefix, SEGMENT_SIZE, offset // SEGMENT_SIZE, source.view[offset:end], final,
+                )
+                record_crypto("encrypt", end - offset, started)
+                _write_pieces(fd, pieces)
+                pieces = []
+                source.done_until(end)
+                offset = end
+        finally:
+            os.close(fd)
+
+    _map_to_file(file_path, output_path, work)
     return output_path
 
 
 def decrypt_file(file_path: str, key_material: str, output_path: str | None = None) -> str:
-    with open(file_path, "rb") as source_file:
-        file_data = source_file.read()
+    """
+    Decrypt an AES4 / AES3 / AES2 / AES1 file, memory mapped like `encrypt_file`
+    """
+    if output_path is None:
+        output_path = decrypted_file_path(file_path)
 
-    decrypted_data = decrypt_bytes(file_data, key_material)
+    def work(source: _MappedInput) -> None:
+        magic = bytes(source.view[:len(AES_HEADER)])
+        if magic == AES_HEADER:
+            return _decrypt_legacy_mapped(source, key_material, output_path)
+        if magic == AES4_HEADER:
+            return _stream_mapped(source, StreamDecryptor(key_material), output_path)
+        if magic not in (AES2_HEADER, AES3_HEADER):
+            raise ValueError("Invalid AES header")
 
-    if output_path is None:
-        if file_path.endswith(".aes"):
-            output_path = file_path[:-4]
-        else:
-            output_path = f"{file_path}_decrypted"
+        parsed = _parse_container_header(source.view)
+        if parsed is None:
+            raise ValueError("Invalid encrypted data")
+        header, params, segment_size, prefix, _ = parsed
 
-    with open(output_path, "wb") as output_file:
-        output_file.write(decrypted_data)
+        sealed_size = segment_size + TAG_SIZE
+        body_size = source.size - len(header)
+        segments = -(-body_size // sealed_size)
+        if body_size < TAG_SIZE or body_size - (segments - 1) * sealed_size < TAG_SIZE:
+            raise ValueError("Invalid encrypted data")
 
+        cipher = AESGCM(params.derive(key_material) if params else _derive_key(key_material))
+        per_batch = max(BATCH_READ_SIZE // sealed_size, 1)
+        fd = _create_output(output_path, body_size - segments * TAG_SIZE)
+        try:
+            for first in range(0, segments, per_batch):
+                stop = min(first + per_batch, segments)
+                start = len(header) + first * sealed_size
+                end = min(len(header) + stop * sealed_size, source.size)
+                started = time.perf_counter()
+                pieces = _open_pieces(
+                    cipher, header, prefix, segment_size, first, source.view[start:end], final=stop == segments,
+                )
+                record_crypto("decrypt", sum(len(piece) for piece in pieces), started)
+                _write_pieces(fd, pieces)
+                source.done_until(end)
+        finally:
+            os.close(fd)
+
+    _map_to_file(file_path, output_path, work)
     return output_path
+
+
+def _decrypt_legacy_mapped(source: _MappedInput, key_material: str, output_path: str) -> None:
+    """
+    AES1 is one GCM message, the tag is only checked at the end; the output
+    is removed by the caller when it does not match
+    """
+    body_start = len(AES_HEADER) + NONCE_SIZE
+    body_end = source.size - TAG_SIZE
+    if body_end < body_start:
+        raise ValueError("Invalid encrypted data")
+
+    nonce = bytes(source.view[len(AES_HEADER):body_start])
+    decryptor = Cipher(algorithms.AES(_derive_key(key_material)), modes.GCM(nonce)).decryptor()
+    fd = _create_output(output_path, body_end - body_start)
+    try:
+        for offset in range(body_start, body_end, BATCH_READ_SIZE):
+            end = min(offset + BATCH_READ_SIZE, body_end)
+            started = time.perf_counter()
+            plain = decryptor.update(source.view[offset:end])
+            record_crypto("decrypt", len(plain), started)
+            _write_pieces(fd, [plain])
+            source.done_until(end)
+        _write_pieces(fd, [decryptor.finalize_with_tag(bytes(source.view[body_end:]))])
+    finally:
+        os.close(fd)
+
+
+# async variants, the work runs on the crypto executor so the event loop
+# stays free. they raise CryptoExecutorBusy when the pool is full
+
+
+async def encrypt_text_to_base64_async(text: str, key_material: str) -> str:
+    return await crypto_executor.run(encrypt_text_to_base64, text, key_material)
+
+
+async def encrypt_file_async(file_path: str, key_material: str, output_path: str | None = None) -> str:
+    return await crypto_executor.run(encrypt_file, file_path, key_material, output_path)
+
+
+async def decrypt_file_async(file_path: str, key_material: str, output_path: str | None = None) -> str:
+    return await crypto_executor.run(decrypt_file, file_path, key_material, output_path)
@@ -0,0 +1,185 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from starlette.responses import Response
+
+from src.config import Config
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+STATIC_REFERENCE = re.compile(rb'((?:href|src)=")(/static/[^"?#]+)(")')
+
+
+class Asset:
+    """
+    One file held in memory with its precompressed variants
+    """
+
+    def __init__(self, body: bytes, media_type: str, mtime: float):
+        self.media_type = media_type
+        self.mtime = mtime
+        digest = hashlib.sha256(body).hexdigest()
+        self.version = digest[:12]
+        self.etag = f'"{digest[:20]}"'
+        # encoding -> (body, etag)
+        self.variants = {"identity": (body, self.etag)}
+
+    def compress(self, min_size: int, gzip_level: int, brotli_quality: int) -> None:
+        body = self.variants["identity"][0]
+        if len(body) < min_size or not self.media_type.startswith(COMPRESSIBLE):
+            return
+
+        packed = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        if len(packed) < len(body):
+            self.variants["gzip"] = (packed, self.etag[:-1] + '-gz"')
+
+        if brotli is not None:
+            packed = brotli.compress(body, quality=brotli_quality)
+            if len(packed) < len(body):
+                self.variants["br"] = (packed, self.etag[:-1] + '-br"')
+
+    def choose(self, accept_encoding: str) -> str:
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in accept_encoding.split(",")
+            if not part.replace(" ", "").endswith(";q=0")
+        }
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return "identity"
+
+    def matches(self, if_none_match: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        tags = {etag for _, etag in self.variants.values()}
+        return any(tag.strip().removeprefix("W/") in tags for tag in if_none_match.split(","))
+
+
+class AssetCache:
+    """
+    # templates served from memory
+
+    `load()` reads every file under `root`, precomputes gzip (and brotli when
+    the `brotli` package is installed) variants and content-hash ETags.
+    `/static/...` references inside HTML are rewritten to `?v=<hash>` URLs,
+    which can then be cached for a year. With `watch` (dev mode) a changed
+    file reloads the cache on its next request, otherwise nothing touches
+    the disk after startup.
+
+    ```python
+    asset_cache.load()
+    return asset_cache.response(request, "main/index.html", "no-cache")
+    ```
+    """
+
+    def __init__(self, root: str, url_prefix: str = "/static", watch: bool = False,
+                 min_size: int = 512, gzip_level: int = 9, brotli_quality: int = 11):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.watch = watch
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        self._assets: dict[str, Asset] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        assets = {}
+        pages = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+                # Response adds the charset to text/* types
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                with open(path, "rb") as f:
+                    body = f.read()
+                if media_type.startswith("text/html"):
+                    pages.append((relative, body, media_type, os.path.getmtime(path)))
+                else:
+                    assets[relative] = Asset(body, media_type, os.path.getmtime(path))
+
+        # pages last, they link to the versions of the other assets
+        for relative, body, media_type, mtime in pages:
+            assets[relative] = Asset(self._version_links(body, assets), media_type, mtime)
+
+        for asset in assets.values():
+            asset.compress(self.min_size, self.gzip_level, self.brotli_quality)
+
+        self._assets = assets
+        self._loaded = True
+
+    def _version_links(self, body: bytes, assets: dict) -> bytes:
+        prefix = self.url_prefix.encode("utf-8") + b"/"
+
+        def versioned(match):
+            target = match.group(2)[len(prefix):].decode("utf-8")
+            asset = assets.get(target)
+            if asset is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + b"?v=" + asset.version.encode("ascii") + match.group(3)
+
+        return STATIC_REFERENCE.sub(versioned, body)
+
+    def _changed(self, relative: str) -> bool:
+        asset = self._assets.get(relative)
+        path = os.path.join(self.root, relative)
+        if asset is None:
+            # only files that appeared inside root, not every 404
+            root = os.path.realpath(self.root) + os.sep
+            return os.path.realpath(path).startswith(root) and os.path.isfile(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return True
+        return mtime != asset.mtime
+
+    def get(self, relative: str) -> Asset | None:
+        if not self._loaded or (self.watch and self._changed(relative)):
+            with self._lock:
+                if not self._loaded or (self.watch and self._changed(relative)):
+                    self.load()
+        return self._assets.get(relative)
+
+    def response(self, request, relative: str, cache_control: str) -> Response:
+        asset = self.get(relative)
+        if asset is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+
+        encoding = asset.choose(request.headers.get("accept-encoding", ""))
+        body, etag = asset.variants[encoding]
+        headers = {"etag": etag, "cache-control": cache_control, "vary": "Accept-Encoding"}
+
+        if asset.matches(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+        return Response(body, media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "assets": len(self._assets),
+            "bytes": sum(len(body) for asset in self._assets.values() for body, _ in asset.variants.values()),
+        }
+
+
+asset_cache = AssetCache(
+    Config.Paths.Sites.SITES_FOLDER,
+    watch=Config.AssetConfig.WATCH,
+    min_size=Config.AssetConfig.COMPRESS_MIN_SIZE,
+    gzip_level=Config.AssetConfig.GZIP_LEVEL,
+    brotli_quality=Config.AssetConfig.BROTLI_QUALITY,
+)
@@ -0,0 +1,358 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+from src.config import Config
+
+
+COLUMNS = ("digest", "size", "refs", "name", "created", "accessed")
+SORT_KEYS = {
+    "created": "created",
+    "accessed": "accessed",
+    "size": "size",
+    "name": "COALESCE(name, '')",
+}
+
+
+class BlobWriter:
+    """
+    # one blob being written
+
+    Data goes to a temp file while its SHA-256 is computed, `commit()`
+    moves it under its digest (or drops it when that content is already
+    stored) and returns the digest. `abort()` throws the temp file away.
+    """
+
+    def __init__(self, store: "BlobStore"):
+        self.store = store
+        self.temp_path = os.path.join(store.temp_dir, uuid.uuid4().hex)
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(self.temp_path, "wb")
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        """
+        Finish writing, the temp file can be read before `commit()`
+        """
+        self._file.close()
+
+    def commit(self, name: str | None = None, ref: bool = True) -> str:
+        """
+        With `ref` the caller owns a reference, without it the blob is only
+        kept while there is room (kept uploads)
+        """
+        self._file.close()
+        digest = self._hash.hexdigest()
+        self.store._commit(self.temp_path, digest, self.size, name, 1 if ref else 0)
+        return digest
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class BlobStore:
+    """
+    # content addressed, reference counted file store
+
+    Blobs live in `<root>/blobs/<aa>/<sha256>`. A small SQLite index keeps
+    size, reference count and timestamps, so the same content is kept once
+    no matter how many requests produced it. Index updates run in
+    `BEGIN IMMEDIATE` transactions, which also serializes commits and
+    releases between workers.
+
+    ```python
+    writer = blob_store.writer()
+    writer.write(data)
+    digest = writer.commit("report.pdf.aes")
+    ...
+    blob_store.release(digest)
+    ```
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.temp_dir = os.path.join(root, "tmp")
+        self.index_path = os.path.join(root, "blobs.sqlite3")
+        self._ready = False
+
+    def _setup(self) -> None:
+        if self._ready:
+            return
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " digest TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " refs INTEGER NOT NULL,"
+                " name TEXT,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            # least recently used first for the storage janitor, the rest
+            # serve the sorted, cursor paged admin listing
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed, digest)")
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_created ON blobs (created, digest)")
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_size ON blobs (size, digest)")
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_name ON blobs (COALESCE(name, ''), digest)")
+            # small JSON records every worker shares, like the uploads clear
+            db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._ready = True
+
+    def _connect(self) -> sqlite3.Connection:
+        # short lived connections, safe across threads and forked workers
+        return sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        self._setup()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def writer(self) -> BlobWriter:
+        self._setup()
+        return BlobWriter(self)
+
+    def _commit(self, temp_path: str, digest: str, size: int, name: str | None, refs: int = 1) -> None:
+        now = time.time()
+        target = self.path(digest)
+        with self._transaction() as db:
+            row = db.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is not None and os.path.exists(target):
+                db.execute("UPDATE blobs SET refs = refs + ?, accessed = ? WHERE digest = ?", (refs, now, digest))
+                os.remove(temp_path)
+                return
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+            if row is not None:
+                # the file went missing, the tokens holding references stay valid
+                db.execute(
+                    "UPDATE blobs SET refs = refs + ?, size = ?, accessed = ? WHERE digest = ?",
+                    (refs, size, now, digest)
+                )
+                return
+            db.execute(
+                "INSERT INTO blobs (digest, size, refs, name, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, size, refs, name, now, now)
+            )
+
+    def acquire(self, digest: str) -> bool:
+        """
+        Add a reference to an existing blob
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE blobs SET refs = refs + 1, accessed = ? WHERE digest = ?",
+                (time.time(), digest)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, digest: str) -> bool:
+        """
+        Drop a reference, the blob is deleted with its last one.
+        Returns True when the file was removed.
+        """
+        with self._transaction() as db:
+            row = db.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return False
+            if row[0] > 1:
+                db.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", (digest,))
+                return False
+            db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            target = self.path(digest)
+            if os.path.exists(target):
+                os.remove(target)
+            return True
+
+    def touch(self, digest: str) -> None:
+        with self._transaction() as db:
+            db.execute("UPDATE blobs SET accessed = ? WHERE digest = ?", (time.time(), digest))
+
+    def info(self, digest: str) -> dict | None:
+        self._setup()
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT digest, size, refs, name, created, accessed FROM blobs WHERE digest = ?",
+                (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("digest", "size", "refs", "name", "created", "accessed"), row))
+
+    def entries(self) -> list[dict]:
+        self._setup()
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT digest, size, refs, name, created, accessed FROM blobs ORDER BY created"
+            ).fetchall()
+        return [dict(zip(("digest", "size", "refs", "name", "created", "accessed"), row)) for row in rows]
+
+    def stats(self) -> dict:
+        self._setup()
+        with closing(self._connect()) as db:
+            blobs, size, refs = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refs), 0) FROM blobs"
+            ).fetchone()
+        return {"blobs": blobs, "bytes": size, "references": refs}
+
+    def page(self, sort: str = "created", descending: bool = True, limit: int = 100, after: tuple | None = None,
+             name: str | None = None, min_size: int | None = None, max_size: int | None = None,
+             since: float | None = None, until: float | None = None) -> tuple[list[dict], tuple | None]:
+        """
+        One page of blobs in `sort` order (`SORT_KEYS`), filtered by a name
+        substring, size and creation time. `after` is the key returned with
+        the previous page, each page is an index range scan however deep
+        it is. Returns (entries, key of the next page or None).
+        """
+        self._setup()
+        column = SORT_KEYS[sort]
+        where, args = [], []
+        if name:
+            escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append(f"%{escaped}%")
+        if min_size is not None:
+            where.append("size >= ?")
+            args.append(min_size)
+        if max_size is not None:
+            where.append("size <= ?")
+            args.append(max_size)
+        if since is not None:
+            where.append("created >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("created < ?")
+            args.append(until)
+        if after is not None:
+            where.append(f"({column}, digest) {'<' if descending else '>'} (?, ?)")
+            args.extend(after)
+
+        order = "DESC" if descending else "ASC"
+        sql = (
+            f"SELECT {', '.join(COLUMNS)}, {column} FROM blobs"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" ORDER BY {column} {order}, digest {order} LIMIT ?"
+        )
+        with closing(self._connect()) as db:
+            rows = db.execute(sql, args + [limit + 1]).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_key = (rows[-1][-1], rows[-1][0]) if more else None
+        return [dict(zip(COLUMNS, row)) for row in rows], next_key
+
+    def least_recent(self, limit: int, accessed_before: float | None = None,
+                     referenced: bool | None = None) -> list[dict]:
+        """
+        Blobs in least recently used order, only those not touched since
+        `accessed_before` when given. `referenced` False keeps to blobs no
+        one holds a reference to, True to the others.
+        """
+        self._setup()
+        where = "accessed < ?"
+        if referenced is not None:
+            where += " AND refs > 0" if referenced else " AND refs = 0"
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                f"SELECT digest, size, refs, name, created, accessed FROM blobs WHERE {where} ORDER BY accessed LIMIT ?",
+                (accessed_before if accessed_before is not None else float("inf"), limit)
+            ).fetchall()
+        return [dict(zip(("digest", "size", "refs", "name", "created", "accessed"), row)) for row in rows]
+
+    def drop(self, digests: list[str]) -> int:
+        """
+        Delete blobs regardless of references, returns the bytes freed
+        """
+        freed = 0
+        with self._transaction() as db:
+            for digest in digests:
+                row = db.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+                if row is None:
+                    continue
+                db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                target = self.path(digest)
+                if os.path.exists(target):
+                    os.remove(target)
+                freed += row[0]
+        return freed
+
+    def get_state(self, key: str) -> dict | None:
+        self._setup()
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def update_state(self, key: str, func):
+        """
+        `func(value or None)` returns (new value, result) inside one
+        transaction, so workers never interleave on a record
+        """
+        with self._transaction() as db:
+            row = db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+            value, result = func(json.loads(row[0]) if row is not None else None)
+            db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        return result
+
+    def staged(self) -> dict:
+        """
+        Bytes staged outside the blob store per area (upload session
+        chunks, job inputs), kept current by `add_staged`
+        """
+        return self.get_state("staged") or {}
+
+    def add_staged(self, area: str, delta: int) -> None:
+        if not delta:
+            return
+
+        def add(state: dict | None):
+            state = dict(state or {})
+            # files staged before counting started are uncounted when removed, stop at 0
+            state[area] = max(state.get(area, 0) + delta, 0)
+            return state, None
+
+        self.update_state("staged", add)
+
+    def clear(self, limit: int | None = None) -> int:
+        """
+        Drop up to `limit` blobs (all by default) regardless of references,
+        returns how many
+        """
+        with self._transaction() as db:
+            digests = [row[0] for row in db.execute("SELECT digest FROM blobs LIMIT ?", (limit or -1,))]
+            for digest in digests:
+                db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                target = self.path(digest)
+                if os.path.exists(target):
+                    os.remove(target)
+        return len(digests)
+
+
+blob_store = BlobStore(Config.Paths.Client.UPLOADS)
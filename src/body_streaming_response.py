@@ -0,0 +1,23 @@
+from starlette.responses import StreamingResponse
+
+from src.logging_utils import Logging
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose generator still reads the request body.
+
+    StreamingResponse listens for disconnects on `receive`, which would eat
+    the body messages the generator is waiting for, so this one only
+    streams; a disconnect shows up as `ClientDisconnect` in the body
+    reader instead. A body that fails after the headers went out ends the
+    response without its last chunk, the client sees a broken transfer.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except Exception as e:
+            Logging.server_log(f"  Stream aborted: {e}")
+        finally:
+            await self.body_iterator.aclose()
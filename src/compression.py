@@ -0,0 +1,295 @@
+import os
+import struct
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib / lz4 without it
+    zstandard = None
+
+try:
+    import lz4.block as lz4_block
+except ImportError:  # optional
+    lz4_block = None
+
+from src.config import Config
+from src.metrics import metrics
+
+
+CODEC_IDS = {"zlib": 1, "zstd": 2, "lz4": 3}
+CODEC_NAMES = {number: name for name, number in CODEC_IDS.items()}
+LEVEL_RANGES = {"zlib": (0, 9), "zstd": (-7, 22), "lz4": (0, 16)}
+# codec id (1 byte) | level (signed byte)
+CODEC_SIZE = 2
+
+# compressed plaintext is a run of frames, each one block compressed on its own
+#   frame = kind (1 byte) | raw size (u32 BE) | payload size (u32 BE) | padding (u32 BE) | payload | padding
+# STORED frames carry the block as is when it does not shrink. A frame
+# holds at least 1/MAX_FRAME_RATIO of its raw size (short payloads are
+# padded), so opening never expands data by more than that.
+FRAME_HEADER = struct.Struct(">BIII")
+STORED = 0
+PACKED = 1
+MAX_FRAME_RATIO = 16
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+
+compression_raw_bytes = metrics.counter(
+    "hash_server_compression_raw_bytes_total", "Plaintext bytes run through compression", ("op",),
+)
+compression_framed_bytes = metrics.counter(
+    "hash_server_compression_framed_bytes_total", "Framed bytes compression produced or read", ("op",),
+)
+compression_seconds = metrics.counter(
+    "hash_server_compression_seconds_total", "Time spent compressing / decompressing", ("op",),
+)
+compression_skipped = metrics.counter(
+    "hash_server_compression_skipped_total", "Uploads stored without compression", ("reason",),
+)
+
+
+def _installed(name: str) -> bool:
+    return {"zlib": True, "zstd": zstandard is not None, "lz4": lz4_block is not None}[name]
+
+
+def available_codecs() -> list[str]:
+    """
+    Installed codecs in `Config.CompressionConfig.CODECS` order
+    """
+    return [name for name in Config.CompressionConfig.CODECS if name in CODEC_IDS and _installed(name)]
+
+
+def skip_extension(filename: str) -> bool:
+    """
+    True for files whose format is compressed already
+    """
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    return extension in Config.CompressionConfig.SKIP_EXTENSIONS
+
+
+class Codec:
+    """
+    # block compressor, name and level
+
+    The encoded form (`CODEC_SIZE` bytes) goes into AES4 headers, so a file
+    is always opened with the codec it was written with.
+
+    ```python
+    codec = Codec.pick()
+    packed = codec.compress(block)
+    block = Codec.decode(codec.encode()).decompress(packed, len(block))
+    ```
+    """
+
+    def __init__(self, name: str, level: int | None = None):
+        if name not in CODEC_IDS:
+            raise ValueError(f"Unknown compression codec {name}")
+        if not _installed(name):
+            raise ValueError(f"Compression codec {name} is not installed")
+        if level is None:
+            level = Config.CompressionConfig.LEVELS[name]
+        low, high = LEVEL_RANGES[name]
+        if not low <= level <= high:
+            raise ValueError(f"{name} level out of range")
+        self.name = name
+        self.level = level
+
+    @classmethod
+    def pick(cls) -> "Codec":
+        """
+        The preferred installed codec, zlib is always there
+        """
+        return cls(available_codecs()[0])
+
+    def encode(self) -> bytes:
+        return struct.pack(">Bb", CODEC_IDS[self.name], self.level)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Codec":
+        if len(data) != CODEC_SIZE:
+            raise ValueError("Invalid compression codec")
+        number, level = struct.unpack(">Bb", data)
+        if number not in CODEC_NAMES:
+            raise ValueError("Unknown compression codec")
+        return cls(CODEC_NAMES[number], level)
+
+    def compress(self, data) -> bytes:
+        if self.name == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        if self.name == "lz4":
+            mode = "high_compression" if self.level else "default"
+            return lz4_block.compress(data, mode=mode, compression=self.level, store_size=False)
+        return zlib.compress(data, self.level)
+
+    def decompress(self, payload, raw_size: int) -> bytes:
+        """
+        Inverse of `compress`, never produces more than `raw_size` bytes
+        """
+        if self.name == "zstd":
+            if zstandard.frame_content_size(payload) != raw_size:
+                raise ValueError("Invalid compressed frame")
+            out = zstandard.ZstdDecompressor().decompress(payload, max_output_size=raw_size)
+        elif self.name == "lz4":
+            out = lz4_block.decompress(payload, uncompressed_size=raw_size)
+        else:
+            inflater = zlib.decompressobj()
+            out = inflater.decompress(payload, raw_size)
+            if not inflater.eof or inflater.unconsumed_tail or inflater.unused_data:
+                raise ValueError("Invalid compressed frame")
+        if len(out) != raw_size:
+            raise ValueError("Invalid compressed frame")
+        return out
+
+    def describe(self) -> dict:
+        return {"codec": self.name, "level": self.level}
+
+
+def worth_compressing(codec: Codec, sample: bytes) -> bool:
+    """
+    Compress a sample block, False when it does not get below
+    `SAMPLE_MAX_RATIO` of its size (media, archives, random data)
+    """
+    if not sample:
+        return False
+    return len(codec.compress(sample)) <= len(sample) * Config.CompressionConfig.SAMPLE_MAX_RATIO
+
+
+def _serial_map(func, size: int, step: int, count: int) -> list:
+    return [func(0, count)]
+
+
+class FrameWriter:
+    """
+    Compresses a plaintext stream into frames of `block_size` bytes.
+
+    Only whole blocks leave `update()`, `finalize()` writes the rest.
+    Blocks are independent, `map_blocks` (the `segment_pool.map` signature)
+    can spread them across threads; zlib and zstd release the GIL.
+    """
+
+    def __init__(self, codec: Codec, block_size: int = Config.CompressionConfig.BLOCK_SIZE, map_blocks=None):
+        if not 0 < block_size <= MAX_BLOCK_SIZE:
+            raise ValueError("Invalid compression block size")
+        self.codec = codec
+        self.block_size = block_size
+        self._map = map_blocks or _serial_map
+        self._buffer = bytearray()
+        self.raw_bytes = 0
+        self.framed_bytes = 0
+        self.seconds = 0.0
+
+    def _frame(self, block) -> bytes:
+        payload = self.codec.compress(block)
+        kind = PACKED
+        if len(payload) >= len(block):
+            payload, kind = bytes(block), STORED
+        padding = max(-(-len(block) // MAX_FRAME_RATIO) - len(payload), 0)
+        return FRAME_HEADER.pack(kind, len(block), len(payload), padding) + payload + bytes(padding)
+
+    def _pack(self, data) -> bytes:
+        if not data:
+            return b""
+        started = time.perf_counter()
+        view = memoryview(data)
+        count = -(-len(data) // self.block_size)
+
+        def pack_run(start: int, stop: int) -> list[bytes]:
+            return [self._frame(view[number * self.block_size:(number + 1) * self.block_size])
+                    for number in range(start, stop)]
+
+        out = b"".join(frame for run in self._map(pack_run, len(data), self.block_size, count) for frame in run)
+        elapsed = time.perf_counter() - started
+        self.raw_bytes += len(data)
+        self.framed_bytes += len(out)
+        self.seconds += elapsed
+        compression_raw_bytes.inc(len(data), "compress")
+        compression_framed_bytes.inc(len(out), "compress")
+        compression_seconds.inc(elapsed, "compress")
+        return out
+
+    def update(self, data) -> bytes:
+        self._buffer += data
+        ready = len(self._buffer) // self.block_size * self.block_size
+        if not ready:
+            return b""
+        out = self._pack(bytes(self._buffer[:ready]))
+        del self._buffer[:ready]
+        return out
+
+    def finalize(self) -> bytes:
+        out = self._pack(bytes(self._buffer))
+        self._buffer = bytearray()
+        return out
+
+    def describe(self) -> dict:
+        """
+        Codec, sizes, framed / raw ratio and compression MB/s so far
+        """
+        return dict(
+            self.codec.describe(),
+            raw_bytes=self.raw_bytes,
+            compressed_bytes=self.framed_bytes,
+            ratio=round(self.framed_bytes / self.raw_bytes, 4) if self.raw_bytes else None,
+            mb_per_s=round(self.raw_bytes / self.seconds / 1024 / 1024, 1) if self.seconds else None,
+        )
+
+
+class FrameReader:
+    """
+    Reverse of `FrameWriter`, fed with authenticated plaintext.
+
+    Frames are checked against `MAX_BLOCK_SIZE` and `MAX_FRAME_RATIO`
+    before anything is decompressed, one `update()` returns at most
+    `MAX_FRAME_RATIO` times what it was given (plus a block carried over).
+    """
+
+    def __init__(self, codec: Codec, map_blocks=None):
+        self.codec = codec
+        self._map = map_blocks or _serial_map
+        self._buffer = bytearray()
+
+    def _frames(self) -> list[tuple]:
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= FRAME_HEADER.size:
+            kind, raw_size, payload_size, padding = FRAME_HEADER.unpack_from(self._buffer, offset)
+            if kind not in (STORED, PACKED) or not 0 < raw_size <= MAX_BLOCK_SIZE:
+                raise ValueError("Invalid compressed frame")
+            if raw_size > (payload_size + padding) * MAX_FRAME_RATIO:
+                raise ValueError("Invalid compressed frame")
+            if kind == STORED and payload_size != raw_size:
+                raise ValueError("Invalid compressed frame")
+            end = offset + FRAME_HEADER.size + payload_size + padding
+            if end > len(self._buffer):
+                break
+            start = offset + FRAME_HEADER.size
+            frames.append((kind, raw_size, bytes(self._buffer[start:start + payload_size])))
+            offset = end
+        del self._buffer[:offset]
+        return frames
+
+    def update(self, data) -> bytes:
+        self._buffer += data
+        frames = self._frames()
+        if not frames:
+            return b""
+        started = time.perf_counter()
+
+        def open_run(start: int, stop: int) -> list[bytes]:
+            return [payload if kind == STORED else self.codec.decompress(payload, raw_size)
+                    for kind, raw_size, payload in frames[start:stop]]
+
+        size = sum(raw_size for _, raw_size, _ in frames)
+        out = b"".join(
+            block for run in self._map(open_run, size, Config.CompressionConfig.BLOCK_SIZE, len(frames))
+            for block in run
+        )
+        compression_raw_bytes.inc(len(out), "decompress")
+        compression_framed_bytes.inc(len(data), "decompress")
+        compression_seconds.inc(time.perf_counter() - started, "decompress")
+        return out
+
+    def finalize(self) -> bytes:
+        if self._buffer:
+            raise ValueError("Truncated compressed data")
+        return b""
@@ -8,7 +8,22 @@ class Config:
     """
     Class for contain info about
     - class Links
+    - class ServerConfig
     - class Paths
+    - class TokensConfig
+    - class LogConfig
+    - class AssetConfig
+    - class ProcessFileConfig
+    - class UploadSessionConfig
+    - class JobConfig
+    - class StorageConfig
+    - class CryptoExecutorConfig
+    - class SegmentPoolConfig
+    - class BatchConfig
+    - class KeyCacheConfig
+    - class KdfConfig
+    - class CompressionConfig
+    - class RateLimitConfig
     - class FileManaging
     """
 
@@ -21,6 +36,21 @@ class Config:
         HOST = url_info._IP
         PORT = url_info._PORT
 
+    class ServerConfig:
+        """
+        How `python main.py` runs the server
+        - MODE "dev" single process with auto reload
+        - MODE "production" WORKERS processes behind a pre-fork master,
+          SIGHUP starts new workers and drains the old ones
+        - REUSE_PORT every worker binds its own SO_REUSEPORT socket,
+          otherwise the master binds one socket and hands it to the workers
+        """
+        MODE = os.getenv("SERVER_MODE", "dev")
+        WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+        REUSE_PORT = sys.platform.startswith("linux")
+        GRACEFUL_TIMEOUT = 30
+        BACKLOG = 2048
+
     class Paths:
         """
         Class contain
@@ -46,8 +76,231 @@ class Config:
             LOG_FOLDER = "log/"
             SERVER_LOG = "server.log"
     
+    class TokensConfig:
+        """
+        Token storage backend
+        - "log" append-only file shared by all workers
+        - "memory" in-process set, saved only by write_tokens()
+        """
+        BACKEND = "log"
+        # download tokens expire and are bound to the file they unlock
+        DOWNLOAD_TTL_SECONDS = 60 * 60
+        DOWNLOAD_USES = 1
+        SWEEP_INTERVAL = 30
+
+    class LogConfig:
+        """
+        Background log writer
+        - FORMAT "text" or "json" (one JSON record per line)
+        - flushed every FLUSH_LINES records or FLUSH_INTERVAL seconds
+        - rotated at MAX_BYTES, BACKUP_COUNT old files are kept
+        - <log>.idx holds the byte offset of every INDEX_BUCKET_SECONDS bucket
+        """
+        FORMAT = "text"
+        FLUSH_LINES = 256
+        FLUSH_INTERVAL = 0.5
+        MAX_BYTES = 64 * 1024 * 1024  # 64MB
+        BACKUP_COUNT = 5
+        ECHO = True
+        INDEX_BUCKET_SECONDS = 60
+        # /v0/admin/log paging
+        PAGE_LIMIT = 200
+        MAX_PAGE_LIMIT = 5000
+        MAX_SCAN_BYTES = 64 * 1024 * 1024  # 64MB
+        FOLLOW_POLL_INTERVAL = 0.5
+
+    class AssetConfig:
+        """
+        Pages and /static files are served from memory
+        - WATCH reloads changed files, dev mode only
+        - ?v=<hash> asset URLs are cached for VERSIONED_MAX_AGE
+        """
+        WATCH = os.getenv("SERVER_MODE", "dev") == "dev"
+        PAGE_CACHE_CONTROL = "no-cache"
+        STATIC_MAX_AGE = 60 * 60
+        VERSIONED_MAX_AGE = 365 * 24 * 60 * 60
+        COMPRESS_MIN_SIZE = 512
+        GZIP_LEVEL = 9
+        BROTLI_QUALITY = 11
+
     class ProcessFileConfig:
+        """
+        Limits of /v0/hashing_file/process_file
+        - a Content-Length above MAX_FILE_SIZE + MULTIPART_OVERHEAD is refused unread
+        - /decrypt_stream keeps nothing on disk and takes up to STREAM_MAX_FILE_SIZE,
+          legacy AES1 input is held in memory and stays under MAX_FILE_SIZE
+        """
         MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+        STREAM_MAX_FILE_SIZE = 8 * 1024 * 1024 * 1024  # 8GB
+        MULTIPART_OVERHEAD = 64 * 1024
+        MAX_FIELD_SIZE = 16 * 1024
+
+    class UploadSessionConfig:
+        """
+        Resumable chunked uploads
+        - CHUNK_SIZE is rounded up to whole AES2 segments
+        - unfinished sessions are removed TTL_SECONDS after their last chunk
+        """
+        MAX_FILE_SIZE = 8 * 1024 * 1024 * 1024  # 8GB
+        CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+        MAX_CHUNK_SIZE = 64 * 1024 * 1024  # 64MB
+        TTL_SECONDS = 24 * 60 * 60
+
+    class JobConfig:
+        """
+        Background file jobs (/v0/hashing_file/jobs)
+        - every worker runs up to MAX_RUNNING jobs, looking for queued
+          ones every POLL_INTERVAL seconds
+        - a job is tried MAX_ATTEMPTS times (worker crashes included)
+        - finished jobs are kept TTL_SECONDS for status polling
+        """
+        MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
+        MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", 2))
+        POLL_INTERVAL = 1.0
+        MAX_ATTEMPTS = 3
+        TTL_SECONDS = 24 * 60 * 60
+        EVENTS_POLL_INTERVAL = 0.5
+        EVENTS_HEARTBEAT = 15
+
+    class StorageConfig:
+        """
+        Disk quota for the uploads directory: stored outputs, kept uploads,
+        upload session chunks and staged jobs
+        - over HIGH_WATERMARK of QUOTA_BYTES the least recently used blobs
+          are removed until usage is under LOW_WATERMARK, blobs without a
+          download token first; new uploads, sessions and jobs get 507
+          while a pass still ends above HIGH_WATERMARK
+        - unreferenced blobs not accessed for MAX_AGE_SECONDS are removed
+          (0 keeps them)
+        - the janitor runs every JANITOR_INTERVAL seconds, BATCH_SIZE blobs
+          per transaction
+        - /v0/admin/list_uploads pages hold LIST_PAGE_LIMIT entries by default
+        """
+        QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", 20 * 1024 * 1024 * 1024))  # 20GB
+        HIGH_WATERMARK = 0.9
+        LOW_WATERMARK = 0.8
+        MAX_AGE_SECONDS = int(os.getenv("STORAGE_MAX_AGE_SECONDS", 7 * 24 * 60 * 60))
+        JANITOR_INTERVAL = 10
+        BATCH_SIZE = 500
+        LIST_PAGE_LIMIT = 100
+        LIST_MAX_PAGE_LIMIT = 1000
+
+    class CryptoExecutorConfig:
+        """
+        Pool that runs AES work off the event loop
+        - MAX_WORKERS threads
+        - MAX_QUEUE jobs may wait, more answer 503
+        """
+        MAX_WORKERS = os.cpu_count() or 4
+        MAX_QUEUE = 32
+        SLOW_JOB_SECONDS = 1.0
+
+    class SegmentPoolConfig:
+        """
+        Threads that seal / open the segments of one large payload in parallel
+        - only inputs of at least MIN_BYTES are split, in runs of RUN_BYTES
+        - file helpers read BATCH_BYTES at a time to feed them
+        """
+        THREADS = int(os.getenv("CRYPTO_SEGMENT_THREADS", os.cpu_count() or 1))
+        MIN_BYTES = 2 * 1024 * 1024  # 2MB
+        RUN_BYTES = 1024 * 1024  # 1MB
+        BATCH_BYTES = 8 * 1024 * 1024  # 8MB
+
+    class BatchConfig:
+        """
+        Limits for /v0/api/aes/encrypt_batch and decrypt_batch
+        - GROUP_SIZE items are sent to the crypto executor at once
+        - MAX_KDF_PARAMS distinct KDF salts / costs one decrypt_batch may
+          derive keys for, items beyond that fail without a derivation
+        """
+        MAX_ITEMS = 10000
+        MAX_BATCH_BYTES = 16 * 1024 * 1024  # 16MB
+        GROUP_SIZE = 256
+        MAX_KDF_PARAMS = 1
+
+    class KeyCacheConfig:
+        """
+        Derived AES keys kept ready for repeated text encryption
+        """
+        MAX_ENTRIES = 256
+        TTL_SECONDS = 300
+
+    class KdfConfig:
+        """
+        Password to AES key derivation for new ciphertexts (AES3)
+        - ALGORITHM "scrypt", "pbkdf2" or "argon2id" (cryptography 44+)
+        - costs come from `python -m bench kdf --target-ms 100`
+        - MAX_* bound the costs a ciphertext header may ask for
+        - MAX_COST_FACTOR on top of that, a header may ask for at most this
+          many times the configured time and memory cost of its algorithm
+        """
+        ALGORITHM = os.getenv("KDF_ALGORITHM", "scrypt")
+        PBKDF2_ITERATIONS = int(os.getenv("KDF_PBKDF2_ITERATIONS", 600_000))
+        SCRYPT_N = int(os.getenv("KDF_SCRYPT_N", 2 ** 15))
+        SCRYPT_R = int(os.getenv("KDF_SCRYPT_R", 8))
+        SCRYPT_P = int(os.getenv("KDF_SCRYPT_P", 1))
+        ARGON2_ITERATIONS = int(os.getenv("KDF_ARGON2_ITERATIONS", 3))
+        ARGON2_MEMORY_KIB = int(os.getenv("KDF_ARGON2_MEMORY_KIB", 64 * 1024))
+        ARGON2_LANES = int(os.getenv("KDF_ARGON2_LANES", 4))
+
+        MAX_PBKDF2_ITERATIONS = 10_000_000
+        MAX_ARGON2_ITERATIONS = 32
+        MAX_PARALLELISM = 16
+        MAX_MEMORY_BYTES = 256 * 1024 * 1024  # 256MB
+        MAX_COST_FACTOR = int(os.getenv("KDF_MAX_COST_FACTOR", 4))
+
+    class CompressionConfig:
+        """
+        Optional compression before encryption (AES4 containers)
+        - DEFAULT_MODE for requests without a `compress` field: "off",
+          "auto" or a codec name
+        - CODECS preference order, "auto" takes the first one installed
+        - BLOCK_SIZE plaintext compressed per frame
+        - SAMPLE_MAX_RATIO "auto" skips compression when the first block
+          packs to more than this share of its size
+        - SKIP_EXTENSIONS "auto" never compresses these, they are packed already
+        """
+        DEFAULT_MODE = os.getenv("COMPRESSION_DEFAULT", "off")
+        CODECS = ("zstd", "lz4", "zlib")
+        LEVELS = {"zstd": 3, "lz4": 0, "zlib": 6}
+        BLOCK_SIZE = 256 * 1024
+        SAMPLE_MAX_RATIO = 0.9
+        SKIP_EXTENSIONS = (
+            "zip", "rar", "7z", "gz", "bz2", "xz", "zst",
+            "jpg", "jpeg", "png", "gif", "webp", "mp3", "mp4", "docx", "xlsx",
+        )
+
+    class RateLimitConfig:
+        """
+        Admission control in front of all routes
+        - RULES (path prefix, requests per second, burst), first match wins,
+          every client IP and every bearer / ?token= gets its own bucket
+        - buckets are shared by all workers through STATE_FILE, kept in
+          Paths.Client.UPLOADS next to the blob index
+        - uploads in flight may hold MAX_INFLIGHT_UPLOAD_BYTES per worker,
+          bodies without Content-Length count as UNKNOWN_UPLOAD_SIZE
+        """
+        ENABLED = os.getenv("RATE_LIMIT", "on") != "off"
+        RULES = (
+            ("/v0/hashing_file/process_file", 2, 6),
+            ("/v0/hashing_file/decrypt_stream", 2, 6),
+            ("/v0/hashing_file/upload_sessions", 30, 60),
+            ("/v0/hashing_file/jobs", 10, 30),
+            ("/v0/hashing_file/download/", 10, 30),
+            ("/v0/api/aes/", 20, 40),
+            ("/v0/admin/", 5, 10),
+            ("/", 100, 200),
+        )
+        UPLOAD_PATHS = (
+            "/v0/hashing_file/process_file",
+            "/v0/hashing_file/decrypt_stream",
+            "/v0/hashing_file/upload_sessions/",
+            "/v0/hashing_file/jobs",
+        )
+        MAX_INFLIGHT_UPLOAD_BYTES = 512 * 1024 * 1024  # 512MB
+        UNKNOWN_UPLOAD_SIZE = 64 * 1024 * 1024  # 64MB
+        SLOTS = 64 * 1024
+        STATE_FILE = "rate_limit.bin"
 
     class FileManaging:
         LEAVE_UPLOADED_FILE = False
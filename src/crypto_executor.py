@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import Config
+from src.logging_utils import Logging
+
+
+class CryptoExecutorBusy(Exception):
+    """
+    Raised when the executor already holds `max_pending` jobs,
+    routes answer it with 503
+    """
+
+
+class CryptoJob:
+    """
+    # one admitted job on the crypto executor
+
+    A job can submit several steps (for example one per upload chunk),
+    they all count as a single slot in the queue and their time is summed.
+    A job reserved with `hold=False` keeps no slot between steps, every
+    `run()` takes one for as long as the step runs (waiting for it when
+    the executor is full), so time spent on the network costs nothing.
+
+    ```python
+    async with crypto_executor.reserve("encrypt") as job:
+        out = await job.run(encryptor.update, chunk)
+    ```
+    """
+
+    def __init__(self, executor: "CryptoExecutor", name: str, hold: bool = True):
+        self.executor = executor
+        self.name = name
+        self.hold = hold
+        self.started = time.perf_counter()
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    async def run(self, func, *args):
+        if self.hold:
+            return await self._run(func, *args)
+        await self.executor._take_slot()
+        try:
+            return await self._run(func, *args)
+        finally:
+            self.executor._release_slot()
+
+    async def _run(self, func, *args):
+        submitted = time.perf_counter()
+
+        def timed():
+            begin = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                end = time.perf_counter()
+                self.wait_seconds += begin - submitted
+                self.busy_seconds += end - begin
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor.pool, timed)
+
+    async def __aenter__(self) -> "CryptoJob":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.executor._release(self)
+
+
+class CryptoExecutor:
+    """
+    # bounded worker pool for AES / SHA-256 work
+
+    Keeps CPU heavy crypto off the asyncio event loop. Admission is limited
+    to `max_pending` jobs (running + queued), anything above that raises
+    `CryptoExecutorBusy` right away instead of piling up.
+
+    Threads are used because the OpenSSL calls behind `cryptography`
+    release the GIL and stream ciphers keep state between chunks.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, slow_job_seconds: float = 1.0):
+        self.max_workers = max_workers
+        self.max_pending = max_workers + max_queue
+        self.slow_job_seconds = slow_job_seconds
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crypto")
+
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_busy_seconds = 0.0
+        self.max_job_seconds = 0.0
+
+    def reserve(self, name: str = "job", hold: bool = True) -> CryptoJob:
+        """
+        Admit a job, `hold=False` only checks there is room right now and
+        leaves the slots to its steps
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise CryptoExecutorBusy(f"crypto executor full ({self.pending} jobs)")
+            if hold:
+                self.pending += 1
+        return CryptoJob(self, name, hold)
+
+    async def _take_slot(self) -> None:
+        while True:
+            with self._lock:
+                if self.pending < self.max_pending:
+                    self.pending += 1
+                    return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # pass the free slot on
+                raise
+
+    def _wake(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self.pending -= 1
+        self._wake()
+
+    async def run(self, func, *args, name: str | None = None):
+        """
+        Admit and run a single call, shortcut for one step jobs
+        """
+        async with self.reserve(name or func.__name__) as job:
+            return await job.run(func, *args)
+
+    def _release(self, job: CryptoJob) -> None:
+        elapsed = time.perf_counter() - job.started
+        with self._lock:
+            if job.hold:
+                self.pending -= 1
+            self.completed += 1
+            self.total_busy_seconds += job.busy_seconds
+            self.max_job_seconds = max(self.max_job_seconds, elapsed)
+        if job.hold:
+            self._wake()
+
+        if elapsed >= self.slow_job_seconds:
+            Logging.server_log(
+                f"  Slow crypto job {job.name}: {elapsed:.3f}s "
+                f"(cpu {job.busy_seconds:.3f}s, queued {job.wait_seconds:.3f}s)"
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "total_busy_seconds": round(self.total_busy_seconds, 6),
+                "max_job_seconds": round(self.max_job_seconds, 6),
+            }
+
+
+crypto_executor = CryptoExecutor(
+    max_workers=Config.CryptoExecutorConfig.MAX_WORKERS,
+    max_queue=Config.CryptoExecutorConfig.MAX_QUEUE,
+    slow_job_seconds=Config.CryptoExecutorConfig.SLOW_JOB_SECONDS,
+)
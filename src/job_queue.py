@@ -0,0 +1,357 @@
+import asyncio
+import fcntl
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from src.blob_store import blob_store
+from src.config import Config
+from src.crypto_executor import CryptoExecutorBusy
+from src.logging_utils import Logging
+
+
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+FINISHED = ("done", "failed")
+
+
+class JobStore:
+    """
+    # durable journal of background jobs
+
+    Every job is a directory `<root>/<id>/` holding
+    - `job.json` its state, replaced atomically (and fsynced on state changes)
+    - `input` the staged upload
+    - `key` the AES key (mode 0600), removed as soon as the job ends
+    - `run.lock` flock'ed by the worker running the job
+
+    The lock dies with its process, so a job whose worker crashed or was
+    restarted is simply claimed again by whichever worker looks next.
+    `track(delta)` is told the input bytes of submitted jobs and when they
+    are gone again, the storage quota counts them without walking the jobs.
+
+    ```python
+    job_id = job_store.stage()
+    ... write job_store.input_path(job_id) ...
+    job_store.submit(job_id, {"filename": "a.txt", ...}, key)
+    ```
+    """
+
+    def __init__(self, root: str, ttl_seconds: float, track=None):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.track = track or (lambda delta: None)
+
+    def _dir(self, job_id: str) -> str:
+        if not JOB_ID.fullmatch(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.root, job_id)
+
+    def stage(self) -> str:
+        """
+        Directory for an upload that is not a job yet
+        """
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._dir(job_id))
+        return job_id
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self._dir(job_id), "input")
+
+    def submit(self, job_id: str, meta: dict, key: str) -> dict:
+        directory = self._dir(job_id)
+        fd = os.open(os.path.join(directory, "key"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(key)
+        meta = dict(meta, state="queued", progress=0.0, attempts=0, created=time.time())
+        self._write(job_id, meta, durable=True)
+        self.track(os.path.getsize(self.input_path(job_id)))
+        return meta
+
+    def _write(self, job_id: str, meta: dict, durable: bool) -> None:
+        path = os.path.join(self._dir(job_id), "job.json")
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def load(self, job_id: str) -> dict | None:
+        try:
+            with open(os.path.join(self._dir(job_id), "job.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def update(self, job_id: str, durable: bool = False, **fields) -> dict | None:
+        """
+        Only the worker holding the job's claim writes to it
+        """
+        meta = self.load(job_id)
+        if meta is None:
+            return None
+        meta.update(fields)
+        self._write(job_id, meta, durable)
+        return meta
+
+    def key(self, job_id: str) -> str | None:
+        try:
+            with open(os.path.join(self._dir(job_id), "key"), "r", encoding="utf-8") as f:
+                return f.read()
+        except (KeyError, OSError):
+            return None
+
+    def finish(self, job_id: str, **fields) -> dict | None:
+        """
+        Record the end of a job and drop its key and input
+        """
+        for name in ("key", "input"):
+            try:
+                path = os.path.join(self._dir(job_id), name)
+                size = os.path.getsize(path)
+                os.remove(path)
+            except (KeyError, OSError):
+                continue
+            if name == "input":
+                self.track(-size)
+        return self.update(job_id, durable=True, finished=time.time(), **fields)
+
+    def claim(self, job_id: str):
+        """
+        Lock the job for this process, returns the lock fd or None when
+        another worker runs it
+        """
+        try:
+            fd = os.open(os.path.join(self._dir(job_id), "run.lock"), os.O_WRONLY | os.O_CREAT, 0o600)
+        except (KeyError, OSError):
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def unclaim(self, fd) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def jobs(self) -> list[str]:
+        try:
+            return [name for name in os.listdir(self.root) if JOB_ID.fullmatch(name)]
+        except OSError:
+            return []
+
+    def scan(self) -> tuple[list[str], dict]:
+        """
+        One pass over all jobs, returns (unfinished job ids most urgent
+        first, number of jobs per state). Reads every job.json, run it
+        off the event loop.
+        """
+        waiting = []
+        counts = {}
+        for job_id in self.jobs():
+            meta = self.load(job_id)
+            state = meta["state"] if meta else "staging"
+            counts[state] = counts.get(state, 0) + 1
+            if meta is not None and state not in FINISHED:
+                waiting.append((meta["priority"], meta["created"], job_id))
+        return [job_id for _, _, job_id in sorted(waiting)], counts
+
+    def remove(self, job_id: str) -> None:
+        try:
+            directory = self._dir(job_id)
+        except KeyError:
+            return
+        # renamed away first, of two racing removals only one uncounts the input
+        doomed = f"{directory}.{uuid.uuid4().hex}.removing"
+        try:
+            os.rename(directory, doomed)
+        except OSError:
+            return
+        # only submitted jobs are counted, `finish` already uncounted finished ones
+        if os.path.exists(os.path.join(doomed, "job.json")):
+            try:
+                self.track(-os.path.getsize(os.path.join(doomed, "input")))
+            except OSError:
+                pass
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def sweep(self) -> int:
+        """
+        Remove finished jobs and abandoned uploads older than the TTL
+        """
+        now = time.time()
+        removed = 0
+        for job_id in self.jobs():
+            meta = self.load(job_id)
+            if meta is None:
+                try:
+                    stale = now - os.stat(self._dir(job_id)).st_mtime > self.ttl_seconds
+                except OSError:
+                    continue
+            else:
+                stale = meta["state"] in FINISHED and now - meta.get("finished", now) > self.ttl_seconds
+            if stale:
+                self.remove(job_id)
+                removed += 1
+        # removals a crash interrupted, already uncounted
+        try:
+            leftovers = [name for name in os.listdir(self.root) if name.endswith(".removing")]
+        except OSError:
+            leftovers = []
+        for name in leftovers:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        return removed
+
+
+class JobRunner:
+    """
+    # runs queued jobs in this worker
+
+    At most `max_running` jobs run at once per worker, picked by priority
+    then age. New submissions `wake()` the runner, otherwise it looks for
+    work every `poll_interval` seconds, which is also how jobs left behind
+    by a dead worker get picked up. The scan and every job.json write run
+    in the threadpool; `counts` keeps the per-state numbers of the last
+    scan for the metrics.
+
+    `handler(job_id, meta, key, progress)` does the work and returns the
+    result to store, `await progress(fraction)` records how far it got.
+    Raising `CryptoExecutorBusy` puts the job back in the queue until the
+    next poll, any other error fails it after `max_attempts` tries.
+    """
+
+    def __init__(self, store: JobStore, max_running: int, poll_interval: float, max_attempts: int):
+        self.store = store
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+        self._handler = None
+        self._running: dict[str, asyncio.Task] = {}
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self.counts: dict = {}
+
+    def start(self, handler) -> None:
+        self._handler = handler
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        # the claims go with the tasks, another worker finishes the jobs
+        for task in list(self._running.values()):
+            task.cancel()
+
+    def wake(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self._fill()
+            except Exception as e:
+                Logging.server_log(f"Job runner error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _claim(self, wanted: int, skip: set) -> list[tuple]:
+        """
+        Scan the queue and lock up to `wanted` jobs, returns (job id, lock)
+        pairs. Runs in the threadpool.
+        """
+        pending, self.counts = self.store.scan()
+        claimed = []
+        for job_id in pending:
+            if len(claimed) >= wanted:
+                break
+            if job_id in skip:
+                continue
+            lock = self.store.claim(job_id)
+            if lock is not None:
+                claimed.append((job_id, lock))
+        return claimed
+
+    async def _fill(self) -> None:
+        wanted = max(self.max_running - len(self._running), 0)
+        for job_id, lock in await run_in_threadpool(self._claim, wanted, set(self._running)):
+            self._running[job_id] = asyncio.create_task(self._run(job_id, lock))
+
+    async def _run(self, job_id: str, lock) -> None:
+        busy = False
+        try:
+            meta = await run_in_threadpool(self.store.load, job_id)
+            key = await run_in_threadpool(self.store.key, job_id)
+            if meta is None or meta["state"] in FINISHED:
+                return
+            if key is None or meta["attempts"] >= self.max_attempts:
+                await run_in_threadpool(self.store.finish, job_id, state="failed", error="File processing failed")
+                return
+
+            meta = await run_in_threadpool(
+                lambda: self.store.update(
+                    job_id, durable=True, state="running", progress=0.0,
+                    attempts=meta["attempts"] + 1, started=time.time(),
+                )
+            )
+            Logging.server_log(f"Job {job_id[:8]} started", attempt=meta["attempts"], priority=meta["priority"])
+
+            last_report = 0.0
+
+            async def progress(fraction: float) -> None:
+                nonlocal last_report
+                now = time.monotonic()
+                if now - last_report >= 0.5:
+                    last_report = now
+                    await run_in_threadpool(self.store.update, job_id, progress=round(min(fraction, 1.0), 4))
+
+            try:
+                result = await self._handler(job_id, meta, key, progress)
+            except CryptoExecutorBusy:
+                busy = True
+                await run_in_threadpool(
+                    self.store.update, job_id, durable=True, state="queued", attempts=meta["attempts"] - 1,
+                )
+                return
+            except Exception as e:
+                Logging.server_log(f"Job {job_id[:8]} failed: {e}")
+                await run_in_threadpool(self.store.finish, job_id, state="failed", error="File processing failed")
+                return
+
+            await run_in_threadpool(self.store.finish, job_id, state="done", progress=1.0, result=result)
+            Logging.server_log(f"Job {job_id[:8]} done")
+        finally:
+            self._running.pop(job_id, None)
+            self.store.unclaim(lock)
+            # a slot is free, look for the next job right away; a job put
+            # back because the executor is full waits for the next poll
+            if not busy:
+                self.wake()
+
+
+job_store = JobStore(
+    os.path.join(Config.Paths.Client.UPLOADS, "jobs"),
+    Config.JobConfig.TTL_SECONDS,
+    track=lambda delta: blob_store.add_staged("jobs", delta),
+)
+
+job_runner = JobRunner(
+    job_store,
+    max_running=Config.JobConfig.MAX_RUNNING,
+    poll_interval=Config.JobConfig.POLL_INTERVAL,
+    max_attempts=Config.JobConfig.MAX_ATTEMPTS,
+)
@@ -0,0 +1,221 @@
+import os
+import struct
+import time
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # needs cryptography 44+
+    Argon2id = None
+
+from src.config import Config
+
+
+KEY_SIZE = 32
+SALT_SIZE = 16
+# algorithm id (1 byte) | salt | three u32 costs
+PARAMS_SIZE = 1 + SALT_SIZE + 12
+
+ALGORITHM_IDS = {"pbkdf2": 1, "scrypt": 2, "argon2id": 3}
+ALGORITHM_NAMES = {number: name for name, number in ALGORITHM_IDS.items()}
+
+
+def available_algorithms() -> list[str]:
+    return [name for name in ALGORITHM_IDS if name != "argon2id" or Argon2id is not None]
+
+
+class KdfParams:
+    """
+    # password KDF, salt and costs
+
+    `costs` is three numbers whose meaning depends on the algorithm
+    - pbkdf2: (iterations, 0, 0), HMAC-SHA256
+    - scrypt: (n, r, p)
+    - argon2id: (iterations, memory in KiB, lanes)
+
+    The encoded form (`PARAMS_SIZE` bytes) goes into AES3 headers, so a file
+    can always be decrypted with the costs it was sealed with. Decoding
+    checks the costs against `Config.KdfConfig` limits and against
+    `MAX_COST_FACTOR` times the configured costs, a header can not make
+    the server burn much more CPU or memory than its own ciphertexts do.
+
+    ```python
+    params = KdfParams.new()
+    key = params.derive(password)
+    same = KdfParams.decode(params.encode()).derive(password)
+    ```
+    """
+
+    def __init__(self, algorithm: str, salt: bytes, costs: tuple[int, int, int]):
+        if algorithm not in ALGORITHM_IDS:
+            raise ValueError(f"Unknown KDF {algorithm}")
+        if len(salt) != SALT_SIZE:
+            raise ValueError("Invalid KDF salt")
+        self.algorithm = algorithm
+        self.salt = salt
+        self.costs = tuple(costs)
+
+    @classmethod
+    def new(cls, algorithm: str | None = None) -> "KdfParams":
+        """
+        Fresh random salt with the configured costs
+        """
+        algorithm = algorithm or Config.KdfConfig.ALGORITHM
+        return cls(algorithm, os.urandom(SALT_SIZE), default_costs(algorithm))
+
+    def encode(self) -> bytes:
+        return struct.pack(">B", ALGORITHM_IDS[self.algorithm]) + self.salt + struct.pack(">III", *self.costs)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "KdfParams":
+        if len(data) != PARAMS_SIZE:
+            raise ValueError("Invalid KDF parameters")
+        algorithm = ALGORITHM_NAMES.get(data[0])
+        if algorithm is None:
+            raise ValueError("Unknown KDF")
+        params = cls(algorithm, bytes(data[1:1 + SALT_SIZE]), struct.unpack(">III", data[1 + SALT_SIZE:]))
+        params.check()
+        params.check_budget()
+        return params
+
+    def check(self) -> None:
+        limits = Config.KdfConfig
+        first, second, third = self.costs
+
+        if self.algorithm == "pbkdf2":
+            if not 1 <= first <= limits.MAX_PBKDF2_ITERATIONS:
+                raise ValueError("PBKDF2 iterations out of range")
+
+        elif self.algorithm == "scrypt":
+            if first < 2 or first & (first - 1):
+                raise ValueError("scrypt n must be a power of two")
+            if not 1 <= second or not 1 <= third <= limits.MAX_PARALLELISM:
+                raise ValueError("scrypt r / p out of range")
+            if 128 * first * second > limits.MAX_MEMORY_BYTES:
+                raise ValueError("scrypt memory cost too high")
+
+        else:
+            if Argon2id is None:
+                raise ValueError("Argon2id needs cryptography 44 or newer")
+            if not 1 <= first <= limits.MAX_ARGON2_ITERATIONS:
+                raise ValueError("Argon2id iterations out of range")
+            if not 1 <= third <= limits.MAX_PARALLELISM:
+                raise ValueError("Argon2id lanes out of range")
+            if not 8 * third <= second or second * 1024 > limits.MAX_MEMORY_BYTES:
+                raise ValueError("Argon2id memory cost out of range")
+
+    def check_budget(self) -> None:
+        """
+        Time and memory cost at most `MAX_COST_FACTOR` times what the
+        configured costs of the algorithm take
+        """
+        factor = Config.KdfConfig.MAX_COST_FACTOR
+        time_cost, memory_cost = _work(self.algorithm, self.costs)
+        base_time, base_memory = _work(self.algorithm, default_costs(self.algorithm))
+        if time_cost > factor * base_time or memory_cost > factor * base_memory:
+            raise ValueError("KDF cost above the server budget")
+
+    def derive(self, key_material: str) -> bytes:
+        if not key_material:
+            raise ValueError("Key is required")
+        password = key_material.encode("utf-8")
+        first, second, third = self.costs
+
+        if self.algorithm == "pbkdf2":
+            kdf = PBKDF2HMAC(hashes.SHA256(), KEY_SIZE, self.salt, first)
+        elif self.algorithm == "scrypt":
+            kdf = Scrypt(salt=self.salt, length=KEY_SIZE, n=first, r=second, p=third)
+        else:
+            kdf = Argon2id(salt=self.salt, length=KEY_SIZE, iterations=first, lanes=third, memory_cost=second)
+        return kdf.derive(password)
+
+    def describe(self) -> dict:
+        names = {
+            "pbkdf2": ("iterations",),
+            "scrypt": ("n", "r", "p"),
+            "argon2id": ("iterations", "memory_kib", "lanes"),
+        }[self.algorithm]
+        return dict({"algorithm": self.algorithm}, **dict(zip(names, self.costs)))
+
+
+def default_costs(algorithm: str) -> tuple[int, int, int]:
+    config = Config.KdfConfig
+    if algorithm == "pbkdf2":
+        return (config.PBKDF2_ITERATIONS, 0, 0)
+    if algorithm == "scrypt":
+        return (config.SCRYPT_N, config.SCRYPT_R, config.SCRYPT_P)
+    if algorithm == "argon2id":
+        return (config.ARGON2_ITERATIONS, config.ARGON2_MEMORY_KIB, config.ARGON2_LANES)
+    raise ValueError(f"Unknown KDF {algorithm}")
+
+
+def _work(algorithm: str, costs: tuple[int, int, int]) -> tuple[int, int]:
+    """
+    (time, memory) cost of a derivation in algorithm units
+    """
+    first, second, third = costs
+    if algorithm == "pbkdf2":
+        return first, 0
+    if algorithm == "scrypt":
+        return first * second * third, first * second
+    return first * second, second
+
+
+def time_derive(params: KdfParams, rounds: int = 3) -> float:
+    """
+    Best of `rounds` derivations in seconds
+    """
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        params.derive("calibration")
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(algorithm: str, target_seconds: float) -> tuple[KdfParams, float]:
+    """
+    Raise the cost of `algorithm` until one derivation takes at least
+    `target_seconds` on this machine, within the configured limits.
+    Returns the params and the measured time.
+
+    - pbkdf2 scales iterations
+    - scrypt doubles n (memory grows with it), r and p stay as configured
+    - argon2id keeps the configured memory and lanes, scales iterations
+    """
+    limits = Config.KdfConfig
+    salt = os.urandom(SALT_SIZE)
+
+    if algorithm == "pbkdf2":
+        probe = KdfParams(algorithm, salt, (100_000, 0, 0))
+        per_iteration = time_derive(probe) / 100_000
+        iterations = min(max(int(target_seconds / per_iteration), 1), limits.MAX_PBKDF2_ITERATIONS)
+        params = KdfParams(algorithm, salt, (iterations, 0, 0))
+        return params, time_derive(params)
+
+    if algorithm == "scrypt":
+        costs = [2 ** 10, limits.SCRYPT_R, limits.SCRYPT_P]
+        step = lambda costs: [costs[0] * 2, costs[1], costs[2]]
+    elif algorithm == "argon2id":
+        costs = [1, limits.ARGON2_MEMORY_KIB, limits.ARGON2_LANES]
+        step = lambda costs: [costs[0] + 1, costs[1], costs[2]]
+    else:
+        raise ValueError(f"Unknown KDF {algorithm}")
+
+    params = KdfParams(algorithm, salt, tuple(costs))
+    params.check()
+    elapsed = time_derive(params)
+    while elapsed < target_seconds:
+        candidate = KdfParams(algorithm, salt, tuple(step(costs)))
+        try:
+            candidate.check()
+        except ValueError:
+            break
+        costs = list(candidate.costs)
+        params = candidate
+        elapsed = time_derive(params)
+    return params, elapsed
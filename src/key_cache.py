@@ -0,0 +1,154 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class _Entry:
+    __slots__ = ("key", "cipher", "info", "expires", "leases", "evicted")
+
+    def __init__(self, key: bytearray, expires: float, info=None):
+        self.key = key
+        self.info = info
+        # AESGCM keeps a reference to the buffer, wiping `key` disables the cipher too
+        self.cipher = AESGCM(key)
+        self.expires = expires
+        self.leases = 0
+        self.evicted = False
+
+    def wipe(self) -> None:
+        self.key[:] = bytes(len(self.key))
+
+
+class KeyCache:
+    """
+    # bounded LRU + TTL cache of ready AESGCM objects
+
+    Entries are looked up by an HMAC of the key material with a per process
+    secret, so neither the password nor the derived key is used as a dict key.
+    Derived keys live in bytearrays that are zeroed when their entry leaves
+    the cache. Ciphers are handed out as leases, an evicted entry is only
+    wiped after its last lease is returned.
+
+    ```python
+    with key_cache.lease(password, derive_key) as cipher:
+        ciphertext = cipher.encrypt(nonce, data, None)
+    ```
+
+    Salted keys pass the KDF parameters as `context`, one password gets one
+    entry per salt. `derive` may return `(key, info)` to keep something next
+    to the key, `lease_entry()` hands it back.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        if max_entries < 1:
+            raise ValueError("KeyCache needs room for at least one entry")
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._secret = os.urandom(32)
+        self._entries: "OrderedDict[bytes, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _cache_key(self, key_material: str, context: bytes) -> bytes:
+        mac = hmac.new(self._secret, context, hashlib.sha256)
+        mac.update(b"\x00" + key_material.encode("utf-8"))
+        return mac.digest()
+
+    def _evict(self, cache_key: bytes) -> None:
+        """
+        Drop an entry, must be called with the lock held
+        """
+        entry = self._entries.pop(cache_key)
+        entry.evicted = True
+        self.evictions += 1
+        if entry.leases == 0:
+            entry.wipe()
+
+    def _expire(self, now: float) -> None:
+        # entries are kept in LRU order, not expiry order, so check them all;
+        # the cache is small and this only runs on a miss
+        for cache_key in [k for k, entry in self._entries.items() if entry.expires <= now]:
+            self._evict(cache_key)
+
+    def _acquire(self, cache_key: bytes, now: float) -> _Entry | None:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            self._evict(cache_key)
+            return None
+        self._entries.move_to_end(cache_key)
+        entry.leases += 1
+        return entry
+
+    @contextmanager
+    def lease(self, key_material: str, derive: Callable[[str], bytes], context: bytes = b"") -> Iterator[AESGCM]:
+        with self.lease_entry(key_material, derive, context) as entry:
+            yield entry.cipher
+
+    @contextmanager
+    def lease_entry(self, key_material: str, derive: Callable, context: bytes = b"") -> Iterator[_Entry]:
+        """
+        Like `lease()`, yields the entry with `.cipher` and `.info`
+        """
+        cache_key = self._cache_key(key_material, context)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._acquire(cache_key, now)
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            # derive outside the lock, another thread may race us to insert
+            derived = derive(key_material)
+            key, info = derived if isinstance(derived, tuple) else (derived, None)
+            fresh = _Entry(bytearray(key), now + self.ttl_seconds, info)
+            with self._lock:
+                entry = self._acquire(cache_key, now)
+                if entry is None:
+                    self._expire(now)
+                    while len(self._entries) >= self.max_entries:
+                        self._evict(next(iter(self._entries)))
+                    entry = fresh
+                    entry.leases += 1
+                    self._entries[cache_key] = entry
+                else:
+                    fresh.wipe()
+
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                if entry.evicted and entry.leases == 0:
+                    entry.wipe()
+
+    def clear(self) -> None:
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._evict(cache_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
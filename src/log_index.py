@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+
+class LogIndex:
+    """
+    # sidecar index of a log file
+
+    One `<bucket start> <byte offset>` line is appended to `<log>.idx` for the
+    first record written in every time bucket. Readers use it to jump close
+    to a point in time instead of scanning from the start. Offsets are only
+    hints, readers still check the timestamp of every line.
+    """
+
+    def __init__(self, log_path: str, bucket_seconds: int = 60):
+        self.log_path = log_path
+        self.path = log_path + ".idx"
+        self.bucket_seconds = bucket_seconds
+
+        self._buckets: list[int] = []
+        self._offsets: list[int] = []
+        self._read_pos = 0
+        self._last_bucket: int | None = None
+
+    def bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds) * self.bucket_seconds
+
+    # writer side
+
+    def track(self, timestamp: float, offset: int, pending: list) -> None:
+        """
+        Remember `offset` when `timestamp` opens a new bucket,
+        entries are collected in `pending` and written by `append()`
+        """
+        bucket = self.bucket(timestamp)
+        if bucket != self._last_bucket:
+            self._last_bucket = bucket
+            pending.append((bucket, offset))
+
+    def append(self, entries: list) -> None:
+        if not entries:
+            return
+        with open(self.path, "a", encoding="ascii") as f:
+            f.write("".join(f"{bucket} {offset}\n" for bucket, offset in entries))
+
+    def reset(self) -> None:
+        """
+        Called after the log file was rotated
+        """
+        self._last_bucket = None
+        self._buckets.clear()
+        self._offsets.clear()
+        self._read_pos = 0
+
+    # reader side
+
+    def refresh(self) -> None:
+        """
+        Load entries appended since the last call
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self.reset()
+            return
+
+        if size < self._read_pos:
+            # rotated under us
+            self._buckets.clear()
+            self._offsets.clear()
+            self._read_pos = 0
+
+        if size == self._read_pos:
+            return
+
+        with open(self.path, "r", encoding="ascii") as f:
+            f.seek(self._read_pos)
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                self._read_pos += len(line)
+                parts = line.split()
+                if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+                    self._buckets.append(int(parts[0]))
+                    self._offsets.append(int(parts[1]))
+
+    def start_offset(self, since: float) -> int:
+        """
+        Byte offset from which lines newer than `since` can be found
+        """
+        self.refresh()
+        if not self._buckets:
+            return 0
+        position = bisect.bisect_left(self._buckets, self.bucket(since))
+        if position >= len(self._offsets):
+            return self._offsets[-1]
+        return self._offsets[position]
+
+
+def line_timestamp(line: str) -> float | None:
+    """
+    Timestamp of a text ("<iso> message") or json ({"ts": ...}) log line
+    """
+    try:
+        if line.startswith("{"):
+            moment = json.loads(line).get("ts")
+        else:
+            moment = line.split(" ", 1)[0]
+        parsed = datetime.fromisoformat(moment)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_time(value) -> float | None:
+    """
+    Accept unix seconds or an ISO 8601 string
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.fromisoformat(str(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class LogQuery:
+    """
+    Filter shared by the page, tail and follow readers
+    """
+
+    def __init__(self, since: float | None = None, until: float | None = None, grep: re.Pattern | None = None):
+        self.since = since
+        self.until = until
+        self.grep = grep
+
+    def matches(self, line: str) -> bool:
+        if self.since is not None or self.until is not None:
+            timestamp = line_timestamp(line)
+            if timestamp is None:
+                return False
+            if self.since is not None and timestamp < self.since:
+                return False
+            if self.until is not None and timestamp > self.until:
+                return False
+        return self.grep is None or self.grep.search(line) is not None
+
+    def past_until(self, line: str) -> bool:
+        if self.until is None:
+            return False
+        timestamp = line_timestamp(line)
+        return timestamp is not None and timestamp > self.until
+
+
+def read_page(path: str, offset: int, limit: int, query: LogQuery, max_scan_bytes: int) -> dict:
+    """
+    Read up to `limit` matching lines forward from `offset`.
+
+    Scans at most `max_scan_bytes`, `next_offset` says where to continue.
+    """
+    lines = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            offset = min(max(offset, 0), size)
+            f.seek(offset)
+            position = offset
+            done = False
+
+            while len(lines) < limit and position - offset < max_scan_bytes:
+                raw = f.readline()
+                if not raw or not raw.endswith(b"\n"):
+                    done = True
+                    break
+                position += len(raw)
+                line = raw.decode("utf-8", "replace").rstrip("\n")
+                if query.past_until(line):
+                    done = True
+                    break
+                if query.matches(line):
+                    lines.append(line)
+    except FileNotFoundError:
+        return {"lines": [], "offset": 0, "next_offset": 0, "eof": True}
+
+    return {
+        "lines": lines,
+        "offset": offset,
+        "next_offset": position,
+        "eof": done or position >= size,
+    }
+
+
+def _reverse_lines(f, end: int, block_size: int = 64 * 1024):
+    """
+    Yield complete lines walking backwards from `end`
+    """
+    position = end
+    tail = b""
+    while position > 0:
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        block = f.read(step) + tail
+        parts = block.split(b"\n")
+        tail = parts[0]
+        for part in reversed(parts[1:]):
+            if part:
+                yield part
+    if tail:
+        yield tail
+
+
+def read_tail(path: str, limit: int, query: LogQuery, max_scan_bytes: int) -> dict:
+    """
+    Last `limit` matching lines, oldest first
+    """
+    lines = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            scanned = 0
+            for raw in _reverse_lines(f, size):
+                scanned += len(raw) + 1
+                line = raw.decode("utf-8", "replace")
+                if query.since is not None:
+                    timestamp = line_timestamp(line)
+                    if timestamp is not None and timestamp < query.since:
+                        break
+                if query.matches(line):
+                    lines.append(line)
+                if len(lines) >= limit or scanned >= max_scan_bytes:
+                    break
+    except FileNotFoundError:
+        return {"lines": [], "offset": 0, "next_offset": 0, "eof": True}
+
+    lines.reverse()
+    return {"lines": lines, "offset": max(size - scanned, 0), "next_offset": size, "eof": True}
+
+
+async def follow(path: str, offset: int, query: LogQuery, poll_interval: float, is_disconnected):
+    """
+    Yield new matching lines as they are appended, starting at `offset`.
+
+    Reopens from the start when the file is rotated. Stops once
+    `is_disconnected()` returns True.
+    """
+    position = offset
+    partial = b""
+    inode = None
+
+    while not await is_disconnected():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        if inode is not None and (stat.st_ino != inode or stat.st_size < position):
+            position = 0
+            partial = b""
+        inode = stat.st_ino
+
+        if stat.st_size > position:
+            with open(path, "rb") as f:
+                f.seek(position)
+                data = f.read(min(stat.st_size - position, 1024 * 1024))
+            position += len(data)
+            *complete, partial = (partial + data).split(b"\n")
+            for raw in complete:
+                line = raw.decode("utf-8", "replace")
+                if line and query.matches(line):
+                    yield line
+        else:
+            await asyncio.sleep(poll_interval)
@@ -1,15 +1,177 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
 from src.config import Config
+from src.log_index import LogIndex
+
+
+class LogWriter:
+    """
+    # buffered background log writer
+
+    `write()` only appends a record to a deque (append / popleft are atomic,
+    no lock on the hot path). A daemon thread drains it and writes batches
+    when `FLUSH_LINES` records are waiting or every `FLUSH_INTERVAL` seconds,
+    rotating the file at `MAX_BYTES` and keeping `BACKUP_COUNT` old files.
+    A `LogIndex` sidecar records where every time bucket starts.
+
+    Several worker processes may share one file, flushes and rotation run
+    under an exclusive `flock` on `<log>.lock`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        log_format: str = "text",
+        flush_lines: int = 256,
+        flush_interval: float = 0.5,
+        max_bytes: int = 0,
+        backup_count: int = 0,
+        echo: bool = True,
+        index_bucket_seconds: int = 60
+    ):
+        self.path = path
+        self.log_format = log_format
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.echo = echo
+        self.index = LogIndex(path, index_bucket_seconds)
+        self.lock_path = path + ".lock"
+        self._end = 0
+
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pid = None
+
+    def write(self, message: str, fields: dict | None = None) -> None:
+        self._ensure_thread()
+        self._queue.append((time.time(), message, fields))
+        if len(self._queue) >= self.flush_lines:
+            self._wakeup.set()
+
+    def _ensure_thread(self) -> None:
+        # started lazily and again after a fork, threads do not survive fork
+        if self._pid == os.getpid():
+            return
+        if self._pid is not None:
+            # forked child, queued records belong to the parent
+            self._queue = deque()
+            self._wakeup = threading.Event()
+            self._flush_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Server Error: Error save log: {e}")
+
+    def format_record(self, timestamp: float, message: str, fields: dict | None) -> str:
+        moment = datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+        if self.log_format == "json":
+            record = {"ts": moment, "msg": message}
+            if fields:
+                record.update(fields)
+            return json.dumps(record, default=str)
+        if fields:
+            extra = " ".join(f"{name}={value}" for name, value in fields.items())
+            return f"{moment} {message} {extra}"
+        return f"{moment} {message}"
+
+    def flush(self) -> None:
+        """
+        Write out everything queued so far
+        """
+        with self._flush_lock:
+            if not self._queue:
+                return
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                with open(self.path, "ab") as f:
+                    offset = f.tell()
+                    if offset < self._end:
+                        # another worker rotated the file
+                        self.index.reset()
+                    chunks = []
+                    index_entries = []
+                    while self._queue:
+                        record = self._queue.popleft()
+                        line = (self.format_record(*record) + "\n").encode("utf-8")
+                        self.index.track(record[0], offset, index_entries)
+                        offset += len(line)
+                        chunks.append(line)
+
+                    data = b"".join(chunks)
+                    f.write(data)
+                    size = f.tell()
+                self.index.append(index_entries)
+                self._end = size
+
+                if self.max_bytes and size >= self.max_bytes:
+                    self._rotate()
+                    self._end = 0
+
+            if self.echo:
+                print(data.decode("utf-8"), end="")
+
+    def _rotate(self) -> None:
+        for path in (self.path, self.index.path):
+            if self.backup_count <= 0:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+
+            for number in range(self.backup_count - 1, 0, -1):
+                older = f"{path}.{number}"
+                if os.path.exists(older):
+                    os.replace(older, f"{path}.{number + 1}")
+            if os.path.exists(path):
+                os.replace(path, f"{path}.1")
+
+        self.index.reset()
+
 
 class Logging:
 
-    def server_log(log: str) -> None:
+    writer = LogWriter(
+        path=Config.Paths.Log.LOG_FOLDER + Config.Paths.Log.SERVER_LOG,
+        log_format=Config.LogConfig.FORMAT,
+        flush_lines=Config.LogConfig.FLUSH_LINES,
+        flush_interval=Config.LogConfig.FLUSH_INTERVAL,
+        max_bytes=Config.LogConfig.MAX_BYTES,
+        backup_count=Config.LogConfig.BACKUP_COUNT,
+        echo=Config.LogConfig.ECHO,
+        index_bucket_seconds=Config.LogConfig.INDEX_BUCKET_SECONDS,
+    )
+
+    def server_log(log: str, **fields) -> None:
         """
-        Print and save log to file
+        Queue a log line for the background writer
+
+        extra keyword arguments become fields of the record,
+        `Logging.server_log("upload done", size=1024)`
         """
-        with open(Config.Paths.Log.LOG_FOLDER + Config.Paths.Log.SERVER_LOG, 'a') as f:
-            try:
-                f.write(f"{log}\n")
-            except FileExistsError:
-                print("Server Error: Error save log")
-            
-        print(log)
+        Logging.writer.write(log, fields or None)
+
+    def flush() -> None:
+        Logging.writer.flush()
+
+
+atexit.register(Logging.flush)
@@ -0,0 +1,285 @@
+import bisect
+import math
+import threading
+import time
+
+
+class _Shards:
+    """
+    Per-thread value maps.
+
+    Every thread only ever writes its own dict, so updates need no lock and
+    never contend. A lock is taken once per thread to register its shard and
+    when a scrape collects them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: list[dict] = []
+
+    def mine(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._all.append(shard)
+        return shard
+
+    def collect(self) -> list[dict]:
+        with self._lock:
+            shards = list(self._all)
+        # dict.copy() is atomic, the owner may keep writing meanwhile
+        return [shard.copy() for shard in shards]
+
+
+def _label_text(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """
+    Monotonic counter, `counter.inc(5, "encrypt")` with one value per label
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._shards = _Shards()
+
+    def inc(self, value: float = 1, *labels) -> None:
+        shard = self._shards.mine()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def values(self) -> dict:
+        totals = {}
+        for shard in self._shards.collect():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(self.values().items())
+        ]
+
+
+class Histogram:
+    """
+    Cumulative bucket histogram, `histogram.observe(0.012, "/v0/x", "POST")`
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _Shards()
+
+    def observe(self, value: float, *labels) -> None:
+        shard = self._shards.mine()
+        cell = shard.get(labels)
+        if cell is None:
+            # bucket counts, then sum and count
+            cell = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def render(self) -> list[str]:
+        merged = {}
+        for shard in self._shards.collect():
+            for labels, cell in shard.items():
+                total = merged.setdefault(labels, [0] * len(cell))
+                for position, value in enumerate(list(cell)):
+                    total[position] += value
+
+        lines = []
+        for labels, cell in sorted(merged.items()):
+            running = 0
+            for bound, count in zip(self.buckets + (math.inf,), cell):
+                running += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {running}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {_number(cell[-2])}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cell[-1]}")
+        return lines
+
+
+class GaugeFunc:
+    """
+    Value read at scrape time, `func()` returns a number or `{labels: value}`.
+    `kind="counter"` for totals kept elsewhere (crypto executor)
+    """
+
+    def __init__(self, name: str, help_text: str, func, labelnames: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+        self.labelnames = labelnames
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class MetricsRegistry:
+    """
+    # metrics in the Prometheus text format
+
+    ```python
+    requests_total = metrics.counter("requests_total", "Requests", ("route",))
+    requests_total.inc(1, "/v0/api/aes/encrypt_text")
+    text = metrics.render()
+    ```
+    """
+
+    def __init__(self):
+        self._metrics: dict = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = ()) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_func(self, name: str, help_text: str, func, labelnames: tuple = (), kind: str = "gauge") -> GaugeFunc:
+        return self._add(GaugeFunc(name, help_text, func, labelnames, kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                body = metric.render()
+            except Exception:
+                # a broken gauge must not take the whole scrape down
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(body)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+http_requests = metrics.counter(
+    "hash_server_http_requests_total", "HTTP requests by route, method and status",
+    ("route", "method", "status"),
+)
+http_latency = metrics.histogram(
+    "hash_server_http_request_duration_seconds", "Time until the response body was sent",
+    ("route", "method"), LATENCY_BUCKETS,
+)
+http_bytes_in = metrics.counter("hash_server_http_request_bytes_total", "Request body bytes read", ("route",))
+http_bytes_out = metrics.counter("hash_server_http_response_bytes_total", "Response body bytes sent", ("route",))
+
+crypto_bytes = metrics.counter("hash_server_crypto_bytes_total", "Bytes run through AES", ("op",))
+crypto_seconds = metrics.counter("hash_server_crypto_seconds_total", "Time spent in AES calls", ("op",))
+
+
+def record_crypto(op: str, size: int, started: float) -> None:
+    """
+    Count `size` bytes of `op` ("encrypt" / "decrypt") that started at
+    `started` (time.perf_counter()), MB/s is rate(bytes) / rate(seconds)
+    """
+    crypto_seconds.inc(time.perf_counter() - started, op)
+    crypto_bytes.inc(size, op)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording count, status, latency and body sizes per route.
+
+    The route label is the matched path template (`/download/hashing_file/{filename}`),
+    so paths with ids do not blow up the number of series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        received = 0
+        sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopy":
+                sent += message.get("count") or 0
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            route = route_label(scope)
+            method = scope["method"]
+            http_requests.inc(1, route, method, str(status))
+            http_latency.observe(time.perf_counter() - started, route, method)
+            if received:
+                http_bytes_in.inc(received, route)
+            if sent:
+                http_bytes_out.inc(sent, route)
+
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return scope.get("root_path", "") + route.path
+    if scope.get("app_root_path") is not None and scope.get("root_path"):
+        # mounted app, static files
+        return scope["root_path"]
+    return "unmatched"
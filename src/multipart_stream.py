@@ -0,0 +1,131 @@
+from multipart import MultipartParser
+from multipart.multipart import parse_options_header
+
+
+class MultipartError(Exception):
+    pass
+
+
+class MultipartPart:
+    def __init__(self):
+        self.headers: list[tuple[bytes, bytes]] = []
+        self.name: str = ""
+        self.filename: str | None = None
+        self.size = 0
+
+
+class MultipartStream:
+    """
+    # incremental multipart/form-data parser
+
+    Unlike Starlette's form parser nothing is spooled, every `feed()` returns
+    the events found in that piece of the body and the caller decides where
+    the data goes:
+
+    - `("begin", part, b"")` headers of a part are complete
+    - `("data", part, bytes)` some of its body
+    - `("end", part, b"")` the part is complete
+
+    ```python
+    stream = MultipartStream(request.headers["content-type"])
+    async for piece in request.stream():
+        for event, part, data in stream.feed(piece):
+            ...
+    stream.finish()
+    ```
+    """
+
+    def __init__(self, content_type: str, max_parts: int = 16, max_header_size: int = 16 * 1024):
+        kind, options = parse_options_header(content_type or "")
+        if kind != b"multipart/form-data":
+            raise MultipartError("Expected multipart/form-data")
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise MultipartError("Missing boundary in multipart")
+
+        self.charset = options.get(b"charset", b"utf-8").decode("latin-1")
+        self.max_parts = max_parts
+        self.max_header_size = max_header_size
+        self.done = False
+
+        self._events: list = []
+        self._part: MultipartPart | None = None
+        self._parts = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._header_size = 0
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_end": self._on_end,
+        })
+
+    def decode(self, value: bytes) -> str:
+        try:
+            return value.decode(self.charset)
+        except (UnicodeDecodeError, LookupError):
+            return value.decode("latin-1")
+
+    def _on_part_begin(self) -> None:
+        self._parts += 1
+        if self._parts > self.max_parts:
+            raise MultipartError(f"Too many parts, maximum is {self.max_parts}")
+        self._part = MultipartPart()
+        self._header_size = 0
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._part.size += end - start
+        self._events.append(("data", self._part, data[start:end]))
+
+    def _on_part_end(self) -> None:
+        self._events.append(("end", self._part, b""))
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+        self._count_header(end - start)
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+        self._count_header(end - start)
+
+    def _count_header(self, size: int) -> None:
+        self._header_size += size
+        if self._header_size > self.max_header_size:
+            raise MultipartError("Part headers too large")
+
+    def _on_header_end(self) -> None:
+        self._part.headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        disposition = dict(self._part.headers).get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        if b"name" not in options:
+            raise MultipartError('Content-Disposition of a part needs a "name"')
+        self._part.name = self.decode(options[b"name"])
+        if b"filename" in options:
+            self._part.filename = self.decode(options[b"filename"])
+        self._events.append(("begin", self._part, b""))
+
+    def _on_end(self) -> None:
+        self.done = True
+
+    def feed(self, data: bytes) -> list:
+        try:
+            self._parser.write(data)
+        except MultipartError:
+            raise
+        except Exception as e:
+            raise MultipartError(str(e)) from e
+        events, self._events = self._events, []
+        return events
+
+    def finish(self) -> None:
+        if not self.done:
+            raise MultipartError("Multipart body ended early")
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from src.logging_utils import Logging
+
+
+def bind_socket(host: str, port: int, reuse_port: bool, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app: str, host: str, port: int, sock: socket.socket | None,
+               reuse_port: bool, backlog: int, graceful_timeout: float) -> None:
+    """
+    Body of one worker process, uvicorn drains open requests on SIGTERM
+    """
+    import uvicorn
+
+    if sock is None:
+        sock = bind_socket(host, port, reuse_port, backlog)
+
+    config = uvicorn.Config(
+        app,
+        log_level="info",
+        timeout_graceful_shutdown=graceful_timeout,
+        backlog=backlog,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class WorkerSupervisor:
+    """
+    # pre-fork master
+
+    Keeps `workers` uvicorn processes running. With `reuse_port` every
+    worker binds its own `SO_REUSEPORT` socket and the kernel spreads
+    connections, otherwise the master binds once and shares the socket.
+
+    - SIGTERM / SIGINT stop the workers, each drains for `graceful_timeout`
+    - SIGHUP starts a fresh generation first, then drains the old one, so
+      code and config reload without refusing connections
+    - workers that die are replaced
+
+    Workers are spawned, not forked, each imports the app on its own and
+    shares state only through files (token log, blob index, sessions).
+    """
+
+    def __init__(self, app: str, host: str, port: int, workers: int,
+                 reuse_port: bool = True, graceful_timeout: float = 30, backlog: int = 2048):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(workers, 1)
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+
+        self._context = multiprocessing.get_context("spawn")
+        self._socket = None if reuse_port else bind_socket(host, port, False, backlog)
+        self._processes: list = []
+        self._reload = False
+        self._stop = False
+
+    def _spawn(self):
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.app, self.host, self.port, self._socket,
+                  self.reuse_port, self.backlog, self.graceful_timeout),
+            name="hash-server-worker",
+        )
+        process.start()
+        Logging.server_log(f"Started worker {process.pid}")
+        return process
+
+    def _drain(self, processes: list) -> None:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                Logging.server_log(f"Worker {process.pid} did not drain in time, killing it")
+                process.kill()
+                process.join()
+
+    def _on_stop(self, signum, frame) -> None:
+        self._stop = True
+
+    def _on_reload(self, signum, frame) -> None:
+        self._reload = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        Logging.server_log(f"Master {os.getpid()} starting {self.workers} workers")
+        self._processes = [self._spawn() for _ in range(self.workers)]
+
+        try:
+            while not self._stop:
+                time.sleep(0.5)
+
+                if self._reload:
+                    self._reload = False
+                    Logging.server_log("Reloading workers")
+                    old = self._processes
+                    self._processes = [self._spawn() for _ in range(self.workers)]
+                    self._drain(old)
+                    continue
+
+                for position, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        Logging.server_log(f"Worker {process.pid} exited with {process.exitcode}, restarting")
+                        time.sleep(1)
+                        self._processes[position] = self._spawn()
+        finally:
+            Logging.server_log("Stopping workers")
+            self._drain(self._processes)
+            Logging.flush()
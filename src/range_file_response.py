@@ -0,0 +1,234 @@
+import asyncio
+import os
+import uuid
+from email.utils import formatdate
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+
+from src.aes_crypto import IO_CHUNK_SIZE
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_etag(stat: os.stat_result, digest: str | None = None) -> str:
+    """
+    Strong ETag, the content digest when it is known
+    """
+    if digest:
+        return f'"{digest}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]]:
+    """
+    Parse a `bytes=` Range header into sorted, merged (start, end) pairs,
+    `end` exclusive. Raises `RangeNotSatisfiable` when no range fits.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        raise ValueError("unsupported range unit")
+
+    ranges = []
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            raise ValueError("malformed range")
+        if first == "":
+            # suffix range, the last N bytes
+            length = int(last)
+            if length <= 0:
+                continue
+            ranges.append((max(size - length, 0), size))
+            continue
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if end <= start and last:
+            raise ValueError("malformed range")
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    # file response with Range, If-Range and ETag support
+
+    The file is opened when the response is built, so it can be unlinked
+    (for example by a released blob) while the body is still streaming.
+    Uses the ASGI `http.response.zerocopy` extension (sendfile) when the
+    server offers it, otherwise streams `IO_CHUNK_SIZE` preads from a
+    worker thread. `background` runs once the body is done or the client
+    went away; by then `sent` holds the file bytes that went out and
+    `complete` whether the whole body did, with the client still there.
+
+    ```python
+    response = RangeFileResponse(path, request.headers, filename="report.pdf")
+    planned = response.body_bytes(request.method)
+    ```
+    """
+
+    chunk_size = IO_CHUNK_SIZE
+
+    def __init__(
+        self,
+        path: str,
+        request_headers,
+        filename: str | None = None,
+        media_type: str = "application/octet-stream",
+        digest: str | None = None,
+        background: BackgroundTask | None = None
+    ):
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.etag = file_etag(stat, digest)
+        self.media_type = media_type
+        self.background = background
+        self.parts: list[tuple[bytes, int, int]] = []
+        self.closing = b""
+        self.sent = 0
+        self.complete = False
+        self.disconnected = False
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": self.etag,
+            "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        }
+        if filename:
+            headers["content-disposition"] = f'attachment; filename="{filename}"'
+
+        status_code, content_length = self._select(request_headers, headers)
+        headers["content-length"] = str(content_length)
+        self.status_code = status_code
+        self.init_headers(headers)
+
+    def _select(self, request_headers, headers: dict) -> tuple[int, int]:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and self._etag_matches(if_none_match):
+            return 304, 0
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or if_range.strip() == self.etag):
+            try:
+                ranges = parse_range(range_header, self.size)
+            except RangeNotSatisfiable:
+                headers["content-range"] = f"bytes */{self.size}"
+                return 416, 0
+            except ValueError:
+                ranges = None
+
+            if ranges == [(0, self.size)]:
+                ranges = None
+
+            if ranges and len(ranges) == 1:
+                start, end = ranges[0]
+                headers["content-type"] = self.media_type
+                headers["content-range"] = f"bytes {start}-{end - 1}/{self.size}"
+                self.parts = [(b"", start, end)]
+                return 206, end - start
+
+            if ranges:
+                boundary = uuid.uuid4().hex
+                headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+                length = 0
+                for start, end in ranges:
+                    prefix = (
+                        f"--{boundary}\r\n"
+                        f"Content-Type: {self.media_type}\r\n"
+                        f"Content-Range: bytes {start}-{end - 1}/{self.size}\r\n\r\n"
+                    ).encode("latin-1")
+                    self.parts.append((prefix, start, end))
+                    length += len(prefix) + end - start + 2
+                self.closing = f"--{boundary}--\r\n".encode("latin-1")
+                return 206, length + len(self.closing)
+
+        headers["content-type"] = self.media_type
+        self.parts = [(b"", 0, self.size)]
+        return 200, self.size
+
+    def _etag_matches(self, header: str) -> bool:
+        if header.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == self.etag for tag in header.split(","))
+
+    def body_bytes(self, method: str) -> int:
+        """
+        File bytes the body will carry for a `method` request
+        """
+        if method == "HEAD":
+            return 0
+        return sum(end - start for _, start, end in self.parts)
+
+    async def __call__(self, scope, receive, send) -> None:
+        async def watch_disconnect() -> None:
+            # servers drop sends to a gone client silently, this is how we learn about it
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            self.disconnected = True
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD" or not self.parts:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                self.complete = not self.disconnected
+                return
+
+            zerocopy = "http.response.zerocopy" in scope.get("extensions", {})
+            multipart = len(self.parts) > 1
+            for prefix, start, end in self.parts:
+                if self.disconnected:
+                    break
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopy",
+                        "file": self.file.fileno(),
+                        "offset": start,
+                        "count": end - start,
+                        "more_body": True,
+                    })
+                    self.sent += end - start
+                else:
+                    await self._send_chunks(send, start, end)
+                if multipart:
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            await send({"type": "http.response.body", "body": self.closing, "more_body": False})
+            # checked before the server's own end-of-response wakes the watcher
+            self.complete = not self.disconnected and self.sent == self.body_bytes(scope["method"])
+        finally:
+            watcher.cancel()
+            self.file.close()
+            if self.background is not None:
+                await self.background()
+
+    async def _send_chunks(self, send, start: int, end: int) -> None:
+        fd = self.file.fileno()
+        position = start
+        while position < end and not self.disconnected:
+            count = min(self.chunk_size, end - position)
+            data = await anyio.to_thread.run_sync(os.pread, fd, count, position)
+            if not data:
+                break
+            position += len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": True})
+            self.sent += len(data)
@@ -0,0 +1,201 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from src.config import Config
+from src.logging_utils import Logging
+from src.metrics import metrics
+
+
+# key hash, tokens left, last update (unix time)
+SLOT = struct.Struct("<Qdd")
+
+
+class SharedBuckets:
+    """
+    # token buckets shared by all workers
+
+    Buckets live in a small memory mapped file, one fixed slot per hashed
+    key, so every worker of the pre-fork server sees the same counts. A
+    slot is updated under an `fcntl` record lock on just its bytes; keys
+    that collide on a slot simply start over with a full bucket.
+
+    ```python
+    wait = buckets.take(b"ip|/v0/api/aes/|10.0.0.1", rate=20, burst=40)
+    if wait:
+        ...  # over the limit, retry in `wait` seconds
+    ```
+    """
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        size = slots * SLOT.size
+
+        # never follow a link planted where the state file should be
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        info = os.fstat(self._fd)
+        if not stat.S_ISREG(info.st_mode):
+            os.close(self._fd)
+            raise OSError(f"{path} is not a regular file")
+        if info.st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # fcntl locks belong to the process, threads also need this one
+        self._lock = threading.Lock()
+
+    def take(self, key: bytes, rate: float, burst: float, cost: float = 1) -> float:
+        """
+        Take `cost` tokens, returns 0 when admitted or the seconds until
+        enough tokens are back
+        """
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+        offset = digest % self.slots * SLOT.size
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, offset)
+            try:
+                stored, tokens, updated = SLOT.unpack_from(self._map, offset)
+                now = time.time()
+                if stored != digest:
+                    tokens, updated = burst, now
+                tokens = min(burst, tokens + max(now - updated, 0) * rate)
+
+                if tokens >= cost:
+                    tokens -= cost
+                    wait = 0.0
+                else:
+                    wait = (cost - tokens) / rate
+                SLOT.pack_into(self._map, offset, digest, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, offset)
+        return wait
+
+
+class UploadBudget:
+    """
+    Bytes of uploads currently being received by this worker
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.inflight = 0
+
+    def reserve(self, size: int) -> bool:
+        # one upload is always let in, even when it alone is over the budget
+        if self.inflight and self.inflight + size > self.max_bytes:
+            return False
+        self.inflight += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.inflight -= size
+
+
+upload_budget = UploadBudget(Config.RateLimitConfig.MAX_INFLIGHT_UPLOAD_BYTES)
+
+admission_rejected = metrics.counter(
+    "hash_server_admission_rejected_total", "Requests refused by admission control", ("reason",),
+)
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def request_token(scope) -> str:
+    """
+    Credential a request carries outside its body, `Authorization: Bearer`
+    or a `?token=` download link
+    """
+    authorization = _header(scope, b"authorization")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    query = scope.get("query_string", b"").decode("latin-1")
+    if "token=" in query:
+        return (parse_qs(query).get("token") or [""])[0]
+    return ""
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware limiting every client before the route runs.
+
+    - the first rule in `Config.RateLimitConfig.RULES` whose prefix matches
+      the path gives a token bucket per client IP and one per token
+      (bearer / `?token=`), an empty bucket answers 429 with `Retry-After`
+    - upload requests reserve their `Content-Length` from an in-flight
+      byte budget until they finish, a full budget answers 503
+    """
+
+    def __init__(self, app, buckets: SharedBuckets | None = None, budget: UploadBudget = upload_budget,
+                 config=Config.RateLimitConfig):
+        self.app = app
+        self.config = config
+        self.buckets = buckets
+        self.budget = budget
+
+    def _buckets(self) -> SharedBuckets:
+        # opened on first use, so importing the app never touches the state file
+        if self.buckets is None:
+            os.makedirs(Config.Paths.Client.UPLOADS, exist_ok=True)
+            path = os.path.join(Config.Paths.Client.UPLOADS, self.config.STATE_FILE)
+            self.buckets = SharedBuckets(path, self.config.SLOTS)
+        return self.buckets
+
+    async def _reject(self, scope, receive, send, status: int, reason: str, error: str, wait: float) -> None:
+        admission_rejected.inc(1, reason)
+        client = scope.get("client") or ("unknown", 0)
+        Logging.server_log(f"{client[0]} {error} on {scope['path']}", retry_after=round(wait, 3))
+        response = JSONResponse(
+            {"error": error}, status_code=status, headers={"Retry-After": str(max(math.ceil(wait), 1))},
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.config.ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        client = (scope.get("client") or ("unknown", 0))[0]
+
+        for prefix, rate, burst in self.config.RULES:
+            if path.startswith(prefix):
+                buckets = self._buckets()
+                rule = prefix.encode("utf-8")
+                wait = buckets.take(b"ip|" + rule + b"|" + client.encode("utf-8"), rate, burst)
+                token = request_token(scope) if not wait else ""
+                if token:
+                    wait = buckets.take(b"token|" + rule + b"|" + token.encode("utf-8"), rate, burst)
+                if wait:
+                    await self._reject(scope, receive, send, 429, "rate", "Too many requests", wait)
+                    return
+                break
+
+        if scope["method"] not in ("POST", "PUT") or not path.startswith(self.config.UPLOAD_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        declared = _header(scope, b"content-length")
+        size = int(declared) if declared.isdigit() else self.config.UNKNOWN_UPLOAD_SIZE
+        if not self.budget.reserve(size):
+            await self._reject(scope, receive, send, 503, "upload_budget", "Server busy, try again", 1)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.budget.release(size)
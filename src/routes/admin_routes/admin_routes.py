@@ -1,12 +1,25 @@
 from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import base64
+import json
 import os
+import re
 
 from src.logging_utils import Logging
 from src.config import Config
 from src.Tokens import Tokens
+from src.log_index import LogIndex, LogQuery, follow, parse_time, read_page, read_tail
+from src.routes.process_file.main import download_tokens
+from src.blob_store import SORT_KEYS, blob_store
+from src.storage import storage
+from src.metrics import metrics
 
 router = APIRouter()
 
+log_path = Config.Paths.Log.LOG_FOLDER + Config.Paths.Log.SERVER_LOG
+log_index = LogIndex(log_path, Config.LogConfig.INDEX_BUCKET_SECONDS)
+
 admin_tokens = Tokens(tokens_file=Config.Paths.Tokens.TOKENS_FOLDER + Config.Paths.Tokens.ADMIN_TOKENS, tokens_length=15, token_start="admin_")
 
 @router.post("/")
@@ -20,15 +33,56 @@ async def admin(request: Request):
     
     token = data["token"]
 
-    if admin_tokens.check_token(token):
+    if await run_in_threadpool(admin_tokens.check_token, token):
         text = "/admin/uploads"
         return text
     else:
         Logging.server_log(" Incorrect token permission denied")
         return "Permission Denied"
 
+
+def encode_cursor(key: tuple, sort: str, descending: bool) -> str:
+    raw = json.dumps([sort, descending, key[0], key[1]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: str, descending: bool) -> tuple:
+    try:
+        cursor_sort, cursor_descending, value, digest = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (AttributeError, ValueError, TypeError, UnicodeError):
+        raise ValueError("invalid cursor")
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError("cursor belongs to another sort order")
+    return value, digest
+
+
+def token_state(digests: list[str]) -> dict:
+    """
+    Live download tokens of each blob in `digests`, count, last expiry and
+    uses left
+    """
+    state = {}
+    for digest, metas in download_tokens.blob_tokens(digests).items():
+        entry = state[digest] = {"live": 0, "expires": None, "uses_left": 0}
+        for meta in metas:
+            entry["live"] += 1
+            if meta.get("expires") is not None:
+                entry["expires"] = max(entry["expires"] or 0, meta["expires"])
+            entry["uses_left"] += meta.get("uses", 0)
+    return state
+
+
 @router.post("/list_uploads")
 async def admin_list_uploads(request: Request):
+    """
+    Endpoint /v0/admin/list_uploads
+
+    Stored outputs from the blob index, one page at a time. Besides the
+    token the body may hold `limit`, `cursor` (the `next_cursor` of the
+    previous page), `sort` (created, accessed, size, name), `order` (asc,
+    desc), `name` (substring), `min_size`, `max_size` and `since`/`until`
+    (creation time, unix seconds or ISO 8601).
+    """
     Logging.server_log(f"{request.client.host} request /admin/list_uploads")
 
     try:
@@ -42,20 +96,40 @@ async def admin_list_uploads(request: Request):
     
     token = data["token"]
 
-    if not admin_tokens.check_token(token):
+    if not await run_in_threadpool(admin_tokens.check_token, token):
         Logging.server_log(" Incorrect token permission denied")
         return "Permission Denied"
 
-    directory_path = Config.Paths.Client.UPLOADS
+    try:
+        sort = data.get("sort", "created")
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        descending = data.get("order", "desc") != "asc"
+        limit = min(int(data.get("limit", Config.StorageConfig.LIST_PAGE_LIMIT)), Config.StorageConfig.LIST_MAX_PAGE_LIMIT)
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        after = decode_cursor(data["cursor"], sort, descending) if data.get("cursor") else None
+        filters = {
+            "name": str(data["name"]) if data.get("name") else None,
+            "min_size": int(data["min_size"]) if data.get("min_size") is not None else None,
+            "max_size": int(data["max_size"]) if data.get("max_size") is not None else None,
+            "since": parse_time(data.get("since")),
+            "until": parse_time(data.get("until")),
+        }
+    except (TypeError, ValueError) as e:
+        Logging.server_log(f"  Error: bad list_uploads query {e}")
+        return JSONResponse({"error": f"Invalid list_uploads query: {e}"}, status_code=400)
 
-    files = ""
+    entries, next_key = await run_in_threadpool(blob_store.page, sort, descending, limit, after, **filters)
 
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-        if os.path.isfile(file_path):
-            files += file_path + "\n"
-    
-    return files
+    tokens = await run_in_threadpool(token_state, [entry["digest"] for entry in entries])
+    for entry in entries:
+        entry["tokens"] = tokens.get(entry["digest"], {"live": 0, "expires": None, "uses_left": 0})
+
+    return {
+        "items": entries,
+        "next_cursor": encode_cursor(next_key, sort, descending) if next_key else None,
+    }
 
 
 @router.post("/clear_uploads")
@@ -73,7 +147,7 @@ async def admin_clear_upload(request: Request):
     
     token = data["token"]
 
-    if not admin_tokens.check_token(token):
+    if not await run_in_threadpool(admin_tokens.check_token, token):
         Logging.server_log(" Incorrect token permission denied")
         return "Permission Denied"
     
@@ -83,17 +157,96 @@ async def admin_clear_upload(request: Request):
         Logging.server_log(f"  Error: Directory '{directory_path}' does not exist.")
         return {"error": f"Error: Directory '{directory_path}' does not exist."}
 
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-        if os.path.isfile(file_path):
-            try:
-                os.remove(file_path)
-            except OSError as e:
-                Logging.server_log("  Error: removing files was not ended")
-                return {"error": "Error: removing files was not ended"}
-    Logging.server_log("  Successfully removed all files")
-    return "Successfully removed all files"
-    
+    # removing runs in the background in batches, /admin/storage shows progress
+    # the clear state is shared, a clear started by another worker also answers 409
+    started = await storage.start_clear()
+    clear = await run_in_threadpool(lambda: storage.clearing)
+    if not started:
+        return JSONResponse({"error": "Clearing uploads already running", "clear": clear}, status_code=409)
+    Logging.server_log("  Started clearing uploads")
+    return JSONResponse({"success": True, "message": "Clearing uploads", "clear": clear}, status_code=202)
+
+
+@router.post("/storage")
+async def admin_storage(request: Request):
+    Logging.server_log(f"{request.client.host} request /admin/storage")
+
+    try:
+        data = await request.json()
+    except:
+        return {"error": "Invalid JSON"}, 400
+
+    if not data or "token" not in data:
+        Logging.server_log("  token is not requested")
+        return {"error": "token is not requested"}
+
+    if not await run_in_threadpool(admin_tokens.check_token, data["token"]):
+        Logging.server_log(" Incorrect token permission denied")
+        return "Permission Denied"
+
+    return await run_in_threadpool(storage.usage)
+
+
+@router.post("/token_stats")
+async def admin_token_stats(request: Request):
+    Logging.server_log(f"{request.client.host} request /admin/token_stats")
+
+    try:
+        data = await request.json()
+    except:
+        return {"error": "Invalid JSON"}, 400
+
+    if not data or "token" not in data:
+        Logging.server_log("  token is not requested")
+        return {"error": "token is not requested"}
+
+    if not await run_in_threadpool(admin_tokens.check_token, data["token"]):
+        Logging.server_log(" Incorrect token permission denied")
+        return "Permission Denied"
+
+    return {
+        "uploads": await run_in_threadpool(blob_store.stats),
+        "admin_tokens": await run_in_threadpool(admin_tokens.stats),
+        "download_tokens": await run_in_threadpool(download_tokens.stats),
+    }
+
+
+@router.get("/metrics")
+async def admin_metrics_scrape(request: Request):
+    """
+    Endpoint /v0/admin/metrics for Prometheus, admin token as
+    `Authorization: Bearer <token>`
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not await run_in_threadpool(admin_tokens.check_token, token.strip()):
+        Logging.server_log(f"{request.client.host} /admin/metrics permission denied")
+        return PlainTextResponse("Permission Denied", status_code=403)
+
+    text = await run_in_threadpool(metrics.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@router.post("/metrics")
+async def admin_metrics(request: Request):
+    Logging.server_log(f"{request.client.host} request /admin/metrics")
+
+    try:
+        data = await request.json()
+    except:
+        return {"error": "Invalid JSON"}, 400
+
+    if not data or "token" not in data:
+        Logging.server_log("  token is not requested")
+        return {"error": "token is not requested"}
+
+    if not await run_in_threadpool(admin_tokens.check_token, data["token"]):
+        Logging.server_log(" Incorrect token permission denied")
+        return "Permission Denied"
+
+    text = await run_in_threadpool(metrics.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
 @router.post("/log")
 async def admin_log(request: Request):
     Logging.server_log(f"{request.client.host} request /admin/log")
@@ -109,12 +262,47 @@ async def admin_log(request: Request):
     
     token = data["token"]
 
-    if not admin_tokens.check_token(token):
+    if not await run_in_threadpool(admin_tokens.check_token, token):
         Logging.server_log(" Incorrect token permission denied")
         return "Permission Denied"
 
-    log = ""
-    with open(Config.Paths.Log.LOG_FOLDER + Config.Paths.Log.SERVER_LOG, "r") as f:
-        log = f.read()
-    
-    return log
+    # optional query, without it the last PAGE_LIMIT lines are returned
+    try:
+        limit = min(int(data.get("limit", Config.LogConfig.PAGE_LIMIT)), Config.LogConfig.MAX_PAGE_LIMIT)
+        offset = data.get("offset")
+        offset = int(offset) if offset is not None else None
+        since = parse_time(data.get("since"))
+        until = parse_time(data.get("until"))
+        grep = data.get("grep")
+        flags = re.IGNORECASE if data.get("ignore_case") else 0
+        pattern = re.compile(str(grep), flags) if grep else None
+    except (TypeError, ValueError, re.error) as e:
+        Logging.server_log(f"  Error: bad log query {e}")
+        return JSONResponse({"error": f"Invalid log query: {e}"}, status_code=400)
+
+    if limit <= 0:
+        return JSONResponse({"error": "limit must be positive"}, status_code=400)
+
+    query = LogQuery(since=since, until=until, grep=pattern)
+
+    if offset is None and since is not None:
+        offset = await run_in_threadpool(log_index.start_offset, since)
+
+    if data.get("follow"):
+        # server-sent events, one event per new matching line
+        if offset is None:
+            offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+        async def events():
+            async for line in follow(log_path, offset, query,
+                                     Config.LogConfig.FOLLOW_POLL_INTERVAL, request.is_disconnected):
+                yield f"data: {json.dumps(line)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if offset is None:
+        page = await run_in_threadpool(read_tail, log_path, limit, query, Config.LogConfig.MAX_SCAN_BYTES)
+    else:
+        page = await run_in_threadpool(read_page, log_path, offset, limit, query, Config.LogConfig.MAX_SCAN_BYTES)
+
+    return page
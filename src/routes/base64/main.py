@@ -1,9 +1,20 @@
 from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+import functools
+import json
 
 router = APIRouter()
 
 from src.logging_utils import Logging
-from src.aes_crypto import encrypt_text_to_base64, generate_aes_key
+from src.config import Config
+from src.aes_crypto import (
+    decrypt_texts_from_base64,
+    encrypt_text_to_base64_async,
+    encrypt_texts_to_base64,
+    generate_aes_key,
+)
+from src.body_streaming_response import BodyStreamingResponse
+from src.crypto_executor import crypto_executor, CryptoExecutorBusy
 
 
 @router.post("/encrypt_text")
@@ -37,7 +48,10 @@ async def aes_encrypt_text(request: Request):
         return {"error": "AES key must be at least 4 characters"}, 400
 
     try:
-        encrypted = encrypt_text_to_base64(text, key)
+        encrypted = await encrypt_text_to_base64_async(text, key)
+    except CryptoExecutorBusy as error:
+        Logging.server_log(f"  Error: {error}")
+        return JSONResponse({"error": "Server busy, try again"}, status_code=503, headers={"Retry-After": "1"})
     except Exception as error:
         Logging.server_log(f"  Error: AES encryption failed: {error}")
         return {"error": "AES encryption failed"}, 500
@@ -54,3 +68,175 @@ async def aes_generate_key(request: Request):
     """
     Logging.server_log(f"{request.client.host} request /v0/api/aes/generate_key")
     return {"key": generate_aes_key()}
+
+
+class BatchLimitError(Exception):
+    pass
+
+
+async def _ndjson_lines(request: Request, max_bytes: int):
+    """
+    Yield parsed NDJSON lines from the request body as they arrive
+    """
+    size = 0
+    pending = bytearray()
+    scanned = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise BatchLimitError(f"batch larger than {max_bytes} bytes")
+        pending += chunk
+        # only the new bytes are searched, long lines stay linear
+        while (end := pending.find(b"\n", scanned)) >= 0:
+            line = bytes(pending[:end])
+            del pending[:end + 1]
+            scanned = 0
+            if line.strip():
+                yield json.loads(line)
+        scanned = len(pending)
+    if pending.strip():
+        yield json.loads(pending)
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise BatchLimitError(f"batch larger than {max_bytes} bytes")
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise BatchLimitError(f"batch larger than {max_bytes} bytes")
+    return bytes(body)
+
+
+def _batch_item(item, field: str) -> str:
+    if isinstance(item, dict):
+        if field not in item:
+            raise ValueError(f"item must contain '{field}'")
+        return str(item[field])
+    return str(item)
+
+
+async def _run_batch(job, items, key: str, mode: str, field: str):
+    """
+    Process items in groups of `GROUP_SIZE` on the crypto executor
+    and stream one NDJSON line per item back
+    """
+    if mode == "encrypt":
+        worker = encrypt_texts_to_base64
+    else:
+        # one set for all groups, the KDF params limit is per request
+        worker = functools.partial(decrypt_texts_from_base64, kdf_params=set())
+    group_size = Config.BatchConfig.GROUP_SIZE
+    max_items = Config.BatchConfig.MAX_ITEMS
+    count = 0
+    group: list[str] = []
+
+    async def flush():
+        results = await job.run(worker, group, key)
+        lines = []
+        for offset, result in enumerate(results):
+            index = count - len(group) + offset
+            if result is None:
+                lines.append(json.dumps({"index": index, "error": "Decryption failed"}))
+            else:
+                lines.append(json.dumps({"index": index, "result": result}))
+        group.clear()
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    async with job:
+        try:
+            async for item in items:
+                count += 1
+                if count > max_items:
+                    raise BatchLimitError(f"batch has more than {max_items} items")
+                group.append(_batch_item(item, field))
+                if len(group) >= group_size:
+                    yield await flush()
+            if group:
+                yield await flush()
+        except (BatchLimitError, ValueError) as error:
+            Logging.server_log(f"  Error: batch {mode} stopped: {error}")
+            yield (json.dumps({"error": str(error)}) + "\n").encode("utf-8")
+            return
+
+        Logging.server_log(f"  Batch {mode} finished, {count} items")
+        yield (json.dumps({"done": True, "count": count}) + "\n").encode("utf-8")
+
+
+async def _batch(request: Request, mode: str):
+    field = "text" if mode == "encrypt" else "data"
+    max_bytes = Config.BatchConfig.MAX_BATCH_BYTES
+    content_type = request.headers.get("content-type", "")
+
+    try:
+        if content_type.startswith("application/x-ndjson"):
+            # first line carries the key, every other line is one item
+            lines = _ndjson_lines(request, max_bytes)
+            head = await lines.__anext__()
+            key = str(head.get("key", "")).strip() if isinstance(head, dict) else ""
+            items = lines
+        else:
+            data = json.loads(await _read_body(request, max_bytes))
+            if not isinstance(data, dict) or "key" not in data or not isinstance(data.get("texts"), list):
+                Logging.server_log("  Error: texts or key is missing")
+                return JSONResponse({"error": "JSON must contain 'texts' list and 'key'"}, status_code=400)
+            if len(data["texts"]) > Config.BatchConfig.MAX_ITEMS:
+                raise BatchLimitError(f"batch has more than {Config.BatchConfig.MAX_ITEMS} items")
+            key = str(data["key"]).strip()
+
+            async def list_items():
+                for item in data["texts"]:
+                    yield item
+
+            items = list_items()
+    except BatchLimitError as error:
+        Logging.server_log(f"  Error: {error}")
+        return JSONResponse({"error": str(error)}, status_code=413)
+    except (StopAsyncIteration, ValueError):
+        Logging.server_log("  Error: Invalid JSON")
+        return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+
+    if len(key) < 4:
+        Logging.server_log("  Error: AES key missing or too short")
+        return JSONResponse({"error": "AES key must be at least 4 characters"}, status_code=400)
+
+    # no slot is held while the response waits for the client, each
+    # group takes one while it runs
+    try:
+        job = crypto_executor.reserve(f"batch {mode}", hold=False)
+    except CryptoExecutorBusy as error:
+        Logging.server_log(f"  Error: {error}")
+        return JSONResponse({"error": "Server busy, try again"}, status_code=503, headers={"Retry-After": "1"})
+
+    # the NDJSON items are still read from the body while results stream out
+    return BodyStreamingResponse(_run_batch(job, items, key, mode, field), media_type="application/x-ndjson")
+
+
+@router.post("/encrypt_batch")
+async def aes_encrypt_batch(request: Request):
+    """
+    Endpoint /v0/api/aes/encrypt_batch
+
+    Encrypt many texts under one key. Body is either
+    `{"key": "...", "texts": ["...", ...]}` or an `application/x-ndjson`
+    stream whose first line is `{"key": "..."}` followed by one text
+    (or `{"text": "..."}`) per line. Results stream back as NDJSON
+    `{"index": i, "result": "..."}` lines and end with `{"done": true}`.
+    """
+    Logging.server_log(f"{request.client.host} request /v0/api/aes/encrypt_batch")
+    return await _batch(request, "encrypt")
+
+
+@router.post("/decrypt_batch")
+async def aes_decrypt_batch(request: Request):
+    """
+    Endpoint /v0/api/aes/decrypt_batch
+
+    Same shapes as encrypt_batch, items are Base64 payloads (or `{"data": "..."}`
+    lines). Items that fail to decrypt come back as `{"index": i, "error": ...}`.
+    """
+    Logging.server_log(f"{request.client.host} request /v0/api/aes/decrypt_batch")
+    return await _batch(request, "decrypt")
@@ -0,0 +1,260 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+import time
+
+router = APIRouter()
+
+from src.logging_utils import Logging
+from src.config import Config
+from src.aes_crypto import BATCH_READ_SIZE, StreamDecryptor, StreamEncryptor
+from src.blob_store import blob_store
+from src.compression import Codec
+from src.crypto_executor import crypto_executor
+from src.job_queue import FINISHED, PRIORITIES, job_runner, job_store
+from src.storage import storage
+from src.multipart_stream import MultipartError, MultipartStream
+from src.routes.process_file.main import (
+    UploadRejected,
+    check_fields,
+    check_upload_name,
+    file_too_large,
+    issue_download_token,
+    log_compression,
+    output_name_for,
+    pick_compression,
+    storage_full,
+)
+
+
+def job_status(job_id: str, meta: dict) -> dict:
+    status = {
+        "job_id": job_id,
+        "state": meta["state"],
+        "progress": meta["progress"],
+        "filename": meta["filename"],
+        "mode": meta["mode"],
+        "size": meta["size"],
+        "priority": meta["priority_name"],
+    }
+    if meta["state"] == "done":
+        status.update(meta["result"])
+    elif meta["state"] == "failed":
+        status["error"] = meta.get("error", "File processing failed")
+    return status
+
+
+async def run_job(job_id: str, meta: dict, key: str, progress) -> dict:
+    """
+    Job handler, pipes the staged input through the AES stream into the
+    blob store and returns the download token
+    """
+    # like process_file, a slot is only taken while a step runs
+    job = crypto_executor.reserve(f"job {job_id[:8]}", hold=False)
+    if meta["mode"] == 'encrypt':
+        compress = meta.get("compress")
+        codec = Codec(compress["codec"], compress["level"]) if compress else None
+        transform = StreamEncryptor(key, compress=codec, sample=bool(compress and compress["sample"]))
+    else:
+        transform = StreamDecryptor(key)
+    output = blob_store.writer()
+
+    def step(source) -> int:
+        chunk = source.read(BATCH_READ_SIZE)
+        output.write(transform.update(chunk) if chunk else transform.finalize())
+        return len(chunk)
+
+    done = 0
+    try:
+        async with job:
+            source = await run_in_threadpool(open, job_store.input_path(job_id), "rb")
+            try:
+                while read := await job.run(step, source):
+                    done += read
+                    await progress(done / max(meta["size"], 1))
+            finally:
+                source.close()
+    except BaseException:
+        output.abort()
+        raise
+
+    output_digest = await run_in_threadpool(output.commit, meta["output_name"])
+    Logging.server_log(f"  Job {job_id[:8]} processed {meta['size']} bytes into {meta['output_name']} ({output_digest[:12]})")
+    token = await run_in_threadpool(issue_download_token, output_digest, meta["output_name"], meta["size"])
+    result = {
+        "output_filename": meta["output_name"],
+        "download_token": token,
+    }
+    compression = getattr(transform, "compression", None)
+    if compression is not None:
+        log_compression(compression)
+        result["compression"] = compression
+    return result
+
+
+@router.post("/jobs")
+async def submit_job(request: Request):
+    """
+    Endpoint /v0/hashing_file/jobs
+
+    Same multipart form as /process_file (`compress` included) plus an
+    optional `priority` ("high", "normal", "low"). The file is only stored here, the answer
+    (202) carries the job id right away and the work runs in the
+    background. Poll `status_url` or follow `events_url` (SSE) until the
+    job is `done`, its status then holds the download token.
+    """
+    Logging.server_log(f"{request.client.host} request submit job")
+
+    if storage.full():
+        return storage_full()
+
+    MAX_FILE_SIZE = Config.JobConfig.MAX_FILE_SIZE
+    body_limit = MAX_FILE_SIZE + Config.ProcessFileConfig.MULTIPART_OVERHEAD
+
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > body_limit:
+        return file_too_large(int(content_length), MAX_FILE_SIZE).response
+
+    try:
+        form = MultipartStream(request.headers.get("content-type", ""))
+    except MultipartError as form_error:
+        Logging.server_log(f"  Error: {form_error}")
+        return JSONResponse({"error": str(form_error)}, status_code=400)
+
+    fields = {}
+    field_data = bytearray()
+    file_part = None
+    staged = None
+    body_size = 0
+    job_id = await run_in_threadpool(job_store.stage)
+
+    try:
+        try:
+            async for piece in request.stream():
+                body_size += len(piece)
+                if body_size > body_limit:
+                    raise file_too_large(body_size, MAX_FILE_SIZE)
+
+                for event, part, data in form.feed(piece):
+                    if part.filename is None:
+                        if event == "data":
+                            field_data += data
+                            if len(field_data) > Config.ProcessFileConfig.MAX_FIELD_SIZE:
+                                raise UploadRejected(400, f"Form field {part.name} too large")
+                        elif event == "end":
+                            fields[part.name] = form.decode(bytes(field_data))
+                            field_data.clear()
+                        continue
+
+                    if event == "begin":
+                        if file_part is not None:
+                            raise UploadRejected(400, "Only one file per request")
+                        file_part = part
+                        check_upload_name(part.filename)
+                        staged = await run_in_threadpool(open, job_store.input_path(job_id), "wb")
+                    elif event == "data":
+                        if part.size > MAX_FILE_SIZE:
+                            raise file_too_large(part.size, MAX_FILE_SIZE)
+                        await run_in_threadpool(staged.write, data)
+
+            form.finish()
+        finally:
+            if staged is not None:
+                staged.close()
+
+        if file_part is None:
+            Logging.server_log("  Error: No selected file")
+            raise UploadRejected(400, "No selected file")
+
+        key, mode = check_fields(fields)
+        priority = fields.get("priority") or "normal"
+        if priority not in PRIORITIES:
+            Logging.server_log(f"  Error: Invalid priority {priority}")
+            raise UploadRejected(400, "Invalid priority")
+        codec, sample = pick_compression(fields, file_part.filename, mode)
+
+        meta = await run_in_threadpool(job_store.submit, job_id, {
+            "filename": file_part.filename,
+            "output_name": output_name_for(file_part.filename, mode),
+            "mode": mode,
+            "size": file_part.size,
+            "priority": PRIORITIES[priority],
+            "priority_name": priority,
+            "compress": dict(codec.describe(), sample=sample) if codec is not None else None,
+        }, key)
+
+    except Exception as e:
+        await run_in_threadpool(job_store.remove, job_id)
+        if isinstance(e, UploadRejected):
+            return e.response
+        if isinstance(e, MultipartError):
+            Logging.server_log(f"  Error: {e}")
+            return JSONResponse({"error": str(e)}, status_code=400)
+        Logging.server_log(f"  Internal server error: {str(e)}")
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+    job_runner.wake()
+    Logging.server_log(f"  Queued job {job_id} for {file_part.filename}", size=file_part.size, priority=priority)
+
+    status = job_status(job_id, meta)
+    status["status_url"] = f"/v0/hashing_file/jobs/{job_id}"
+    status["events_url"] = f"/v0/hashing_file/jobs/{job_id}/events"
+    return JSONResponse(status, status_code=202)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    """
+    Endpoint /v0/hashing_file/jobs/{job_id}
+
+    State (`queued`, `running`, `done`, `failed`), progress from 0 to 1,
+    and once done `output_filename` and `download_token`
+    """
+    meta = await run_in_threadpool(job_store.load, job_id)
+    if meta is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return JSONResponse(job_status(job_id, meta))
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Endpoint /v0/hashing_file/jobs/{job_id}/events
+
+    Server-sent events, one `status` event (same body as the status
+    endpoint) whenever the state or progress changes. The stream ends
+    after the `done` or `failed` event.
+    """
+    if await run_in_threadpool(job_store.load, job_id) is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+
+    async def events():
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            meta = await run_in_threadpool(job_store.load, job_id)
+            if meta is None:
+                yield "event: error\ndata: {\"error\": \"Job not found\"}\n\n"
+                return
+
+            status = job_status(job_id, meta)
+            if status != last:
+                last = status
+                last_sent = time.monotonic()
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+                if meta["state"] in FINISHED:
+                    return
+            elif time.monotonic() - last_sent >= Config.JobConfig.EVENTS_HEARTBEAT:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(Config.JobConfig.EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,20 +1,18 @@
 from fastapi import APIRouter, Request 
-import os
-from fastapi.responses import FileResponse
 
 router = APIRouter()
 
 from src.logging_utils import Logging
 from src.config import Config
+from src.asset_cache import asset_cache
 
 @router.get("/hashing_file")
-async def hashing_photo():
-    file_path = os.path.join(Config.Paths.Sites.SITES_FOLDER, Config.Paths.Sites.HASHING_FILE_SITE, "index.html")
-    return FileResponse(file_path)
+async def hashing_photo(request: Request):
+    Logging.server_log(f"{request.client.host} request hashing_file html")
+    return asset_cache.response(request, Config.Paths.Sites.HASHING_FILE_SITE + "index.html", Config.AssetConfig.PAGE_CACHE_CONTROL)
 
 
 @router.get("/hashing_text_base64")
 async def hashing_text_base64(request: Request):
     Logging.server_log(f"{request.client.host} request hashing_text_base64 html")
-    file_path = os.path.join(Config.Paths.Sites.SITES_FOLDER, Config.Paths.Sites.HASHING_TEXT_BASE64, "index.html")
-    return FileResponse(file_path)
+    return asset_cache.response(request, Config.Paths.Sites.HASHING_TEXT_BASE64 + "index.html", Config.AssetConfig.PAGE_CACHE_CONTROL)
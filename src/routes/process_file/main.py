@@ -1,124 +1,657 @@
-from fastapi import APIRouter, Request, UploadFile, File, Form
+from fastapi import APIRouter, Request
 import os
-from fastapi.responses import JSONResponse, FileResponse
-from typing import Optional
+from contextlib import AsyncExitStack
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter()
 
 from src.logging_utils import Logging
 from src.path_traversal_check import PathTraversal
 from src.config import Config
-from src.aes_crypto import encrypt_file, decrypt_file
+from src.aes_crypto import (
+    BATCH_READ_SIZE,
+    StreamDecryptor,
+    StreamEncryptor,
+    decrypted_file_path,
+    encrypted_file_path,
+)
+from src.compression import Codec, compression_skipped, skip_extension
+from src.crypto_executor import crypto_executor, CryptoExecutorBusy
+from src.blob_store import blob_store
+from src.body_streaming_response import BodyStreamingResponse
+from src.multipart_stream import MultipartError, MultipartStream
+from src.range_file_response import RangeFileResponse
+from src.storage import storage
 from src.Tokens import Tokens
 
 download_tokens = Tokens(tokens_file=Config.Paths.Tokens.TOKENS_FOLDER + Config.Paths.Tokens.DOWNLOAD_TOKENS, tokens_length=15, token_start="download_")
 
 path_traversal = PathTraversal()
 
+
+def release_token_target(meta: dict | None) -> None:
+    """
+    Free what a finished or expired download token pointed to
+    """
+    meta = meta or {}
+    if meta.get("blob"):
+        if blob_store.release(meta["blob"]):
+            Logging.server_log(f"  Removed blob {meta['blob'][:12]} ({meta.get('name')})")
+        return
+
+    target = meta.get("file")
+    if target and os.path.exists(target):
+        try:
+            os.remove(target)
+            Logging.server_log(f"  Removed expired output {os.path.basename(target)}")
+        except OSError as e:
+            Logging.server_log(f"  Warning: Failed to remove expired output: {e}")
+
+
+def sweep_download_tokens() -> int:
+    """
+    Drop expired download tokens and release the outputs they pointed to
+    """
+    expired = download_tokens.sweep()
+    for token, meta in expired:
+        release_token_target(meta)
+    return len(expired)
+
+
+def storage_full() -> JSONResponse:
+    """
+    New uploads, sessions and jobs are refused while the uploads directory
+    is over its quota watermark
+    """
+    Logging.server_log("  Error: Storage quota reached")
+    return JSONResponse(
+        {"error": "Storage full, try again later"}, status_code=507,
+        headers={"Retry-After": str(Config.StorageConfig.JANITOR_INTERVAL)},
+    )
+
+
+def issue_download_token(output_digest: str, output_name: str, size: int) -> str:
+    """
+    Download token for a stored output, the token owns one reference to
+    the output blob
+    """
+    return download_tokens.issue_token(
+        ttl=Config.TokensConfig.DOWNLOAD_TTL_SECONDS,
+        uses=Config.TokensConfig.DOWNLOAD_USES,
+        blob=output_digest,
+        name=output_name,
+        size=size
+    )
+
+
+def issue_download(output_digest: str, output_name: str, size: int, compression: dict | None = None) -> JSONResponse:
+    """
+    Hand out a download token for a stored output
+    """
+    token = issue_download_token(output_digest, output_name, size)
+    result = {
+        "success": True,
+        "message": "File processed successfully",
+        "output_filename": output_name,
+        "download_token": token
+    }
+    if compression is not None:
+        result["compression"] = compression
+    return JSONResponse(result)
+
+
+class UploadRejected(Exception):
+    """
+    Ends an upload early, carries the response to send
+    """
+
+    def __init__(self, status_code: int, error: str, headers: dict | None = None):
+        super().__init__(error)
+        self.response = JSONResponse({"error": error}, status_code=status_code, headers=headers)
+
+
+def file_too_large(size: int, limit: int = Config.ProcessFileConfig.MAX_FILE_SIZE) -> UploadRejected:
+    Logging.server_log(f"  Error: File too large {size}")
+    return UploadRejected(413, f"File too large. Maximum size is {limit//1024//1024}MB")
+
+
+def check_fields(fields: dict) -> tuple[str, str]:
+    """
+    Validate the key and mode form fields, returns (key, mode)
+    """
+    provided_key = (fields.get("key") or fields.get("password") or "").strip()
+    if not provided_key:
+        Logging.server_log("  Error: AES key is required")
+        raise UploadRejected(400, "AES key is required")
+
+    if len(provided_key) < 4:
+        Logging.server_log("  Error: AES key too short")
+        raise UploadRejected(400, "AES key must be at least 4 characters")
+
+    mode = fields.get("mode")
+    if mode not in ['encrypt', 'decrypt']:
+        Logging.server_log(f"  Error: Invalid mode {mode}")
+        raise UploadRejected(400, "Invalid mode")
+
+    return provided_key, mode
+
+
+def pick_compression(fields: dict, filename: str, mode: str) -> tuple[Codec | None, bool]:
+    """
+    Compression for an encrypt upload from the optional `compress` field
+    ("off", "auto" or a codec name), returns (codec or None, sample first).
+    "auto" takes the preferred installed codec, skips formats that are
+    compressed already and leaves the rest to a sample of the first block.
+    """
+    choice = (fields.get("compress") or Config.CompressionConfig.DEFAULT_MODE).strip().lower()
+    if mode != 'encrypt' or choice == "off":
+        return None, False
+
+    if choice != "auto":
+        try:
+            return Codec(choice), False
+        except ValueError as codec_error:
+            Logging.server_log(f"  Error: {codec_error}")
+            raise UploadRejected(400, str(codec_error))
+
+    if skip_extension(filename):
+        compression_skipped.inc(1, "extension")
+        return None, False
+    return Codec.pick(), True
+
+
+def log_compression(compression: dict | None) -> None:
+    if compression is not None:
+        Logging.server_log(
+            f"  Compressed {compression['raw_bytes']} into {compression['compressed_bytes']} bytes"
+            f" with {compression['codec']} (ratio {compression['ratio']}, {compression['mb_per_s']}MB/s)"
+        )
+
+
+class UploadPipeline:
+    """
+    Pipe upload bytes through the AES stream straight into the blob store.
+
+    Every `write()` waits for its chunk to be processed on the crypto job
+    before the next one is read, so at most one chunk per upload is held
+    in memory and a slow disk or busy pool slows the client down instead of
+    buffering. The raw upload is only kept when `keep_upload` is set.
+    Encryption compresses first when given a `codec`.
+    """
+
+    def __init__(self, job, key: str, mode: str, keep_upload: bool, codec: Codec | None = None, sample: bool = False):
+        self.job = job
+        if mode == 'encrypt':
+            self.transform = StreamEncryptor(key, compress=codec, sample=sample)
+        else:
+            self.transform = StreamDecryptor(key)
+        self.output = blob_store.writer()
+        self.upload = blob_store.writer() if keep_upload else None
+
+    def _process(self, chunk: bytes) -> None:
+        if self.upload is not None:
+            self.upload.write(chunk)
+        self.output.write(self.transform.update(chunk))
+
+    def _replay(self, path: str) -> None:
+        with open(path, "rb") as source:
+            while chunk := source.read(BATCH_READ_SIZE):
+                self._process(chunk)
+
+    async def _run(self, func, *args) -> None:
+        try:
+            await self.job.run(func, *args)
+        except Exception as crypto_error:
+            Logging.server_log(f"  Crypto error: {str(crypto_error)}")
+            raise UploadRejected(500, "File processing failed")
+
+    async def write(self, chunk: bytes) -> None:
+        await self._run(self._process, chunk)
+
+    async def replay(self, path: str) -> None:
+        """
+        Process a file staged before the form fields were known
+        """
+        await self._run(self._replay, path)
+
+    async def finish(self, upload_name: str, output_name: str) -> tuple[str, str | None]:
+        """
+        Returns (output digest, upload digest or None)
+        """
+        await self._run(lambda: self.output.write(self.transform.finalize()))
+        # commits wait on the blob index lock, never on the event loop
+        # kept uploads hold no reference, the janitor removes them first
+        upload_digest = await run_in_threadpool(self.upload.commit, upload_name, ref=False) if self.upload is not None else None
+        return await run_in_threadpool(self.output.commit, output_name), upload_digest
+
+    @property
+    def compression(self) -> dict | None:
+        return getattr(self.transform, "compression", None)
+
+    def abort(self) -> None:
+        self.output.abort()
+        if self.upload is not None:
+            self.upload.abort()
+
+
+def check_upload_name(filename: str) -> None:
+    if not filename:
+        Logging.server_log("  Error: No selected file")
+        raise UploadRejected(400, "No selected file")
+
+    if not path_traversal.allowed_filename(filename):
+        Logging.server_log(f"  Error: Invalid filename {filename}")
+        raise UploadRejected(400, "Invalid filename")
+
+    if not path_traversal.safe_join(Config.Paths.Client.UPLOADS, filename):
+        Logging.server_log(f"  Error: Path traversal detected for {filename}")
+        raise UploadRejected(400, "Invalid file path")
+
+
+def output_name_for(filename: str, mode: str) -> str:
+    if mode == 'encrypt':
+        return os.path.basename(encrypted_file_path(filename))
+    return os.path.basename(decrypted_file_path(filename))
+
+
 @router.post("/process_file")
-async def process_file(
-    request: Request,
-    file: UploadFile = File(...),
-    key: Optional[str] = Form(None),
-    password: Optional[str] = Form(None),
-    mode: str = Form(...)
-):
+async def process_file(request: Request):
+    """
+    Endpoint /v0/hashing_file/process_file
+
+    multipart/form-data with `file`, `key` (or `password`) and `mode`,
+    optionally `compress` ("off", "auto", "zstd", "lz4", "zlib").
+    The body is parsed while it arrives: an oversized `Content-Length` is
+    refused before anything is read, the running byte count aborts as soon
+    as it crosses `MAX_FILE_SIZE`, and file data goes straight into the
+    crypto pipeline. When the file part comes before `key` and `mode` the
+    raw bytes are staged on disk until they arrive.
+    """
     Logging.server_log(f"{request.client.host} request process_file")
 
+    if storage.full():
+        return storage_full()
+
     MAX_FILE_SIZE = Config.ProcessFileConfig.MAX_FILE_SIZE
-    
-    # Check file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        Logging.server_log(f"  Error: File too large {len(contents)}")
-        return JSONResponse(
-            {"error": f"File too large. Maximum size is {MAX_FILE_SIZE//1024//1024}MB"},
-            status_code=413
-        )
+    body_limit = MAX_FILE_SIZE + Config.ProcessFileConfig.MULTIPART_OVERHEAD
+
+    # Reject before reading the body when its declared size is already too big
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > body_limit:
+        return file_too_large(int(content_length)).response
 
     try:
-        if not file or file.filename == '':
-            Logging.server_log("  Error: No selected file")
-            return JSONResponse({"error": "No selected file"}, status_code=400)
+        form = MultipartStream(request.headers.get("content-type", ""))
+    except MultipartError as form_error:
+        Logging.server_log(f"  Error: {form_error}")
+        return JSONResponse({"error": str(form_error)}, status_code=400)
 
-        if not path_traversal.allowed_filename(file.filename):
-            Logging.server_log(f"  Error: Invalid filename {file.filename}")
-            return JSONResponse({"error": "Invalid filename"}, status_code=400)
+    fields = {}
+    field_data = bytearray()
+    file_part = None
+    output_name = None
+    pipeline = None
+    staging = None
+    body_size = 0
 
-        provided_key = (key or password or "").strip()
-        if not provided_key:
-            Logging.server_log("  Error: AES key is required")
-            return JSONResponse({"error": "AES key is required"}, status_code=400)
+    try:
+        async with AsyncExitStack() as stack:
+            async for piece in request.stream():
+                body_size += len(piece)
+                if body_size > body_limit:
+                    raise file_too_large(body_size)
+
+                for event, part, data in form.feed(piece):
+                    if part.filename is None:
+                        # small form field
+                        if event == "data":
+                            field_data += data
+                            if len(field_data) > Config.ProcessFileConfig.MAX_FIELD_SIZE:
+                                raise UploadRejected(400, f"Form field {part.name} too large")
+                        elif event == "end":
+                            fields[part.name] = form.decode(bytes(field_data))
+                            field_data.clear()
+                        continue
+
+                    if event == "begin":
+                        if file_part is not None:
+                            raise UploadRejected(400, "Only one file per request")
+                        file_part = part
+                        check_upload_name(part.filename)
+                        try:
+                            # slots are taken per step, not while waiting on the client
+                            job = crypto_executor.reserve(f"upload {part.filename}", hold=False)
+                        except CryptoExecutorBusy as busy_error:
+                            Logging.server_log(f"  Error: {busy_error}")
+                            raise UploadRejected(503, "Server busy, try again", headers={"Retry-After": "1"})
+                        await stack.enter_async_context(job)
+
+                        if "mode" in fields and ("key" in fields or "password" in fields):
+                            key, mode = check_fields(fields)
+                            output_name = output_name_for(part.filename, mode)
+                            codec, sample = pick_compression(fields, part.filename, mode)
+                            pipeline = UploadPipeline(
+                                job, key, mode, Config.FileManaging.LEAVE_UPLOADED_FILE, codec=codec, sample=sample,
+                            )
+                        else:
+                            staging = blob_store.writer()
 
-        if len(provided_key) < 4:
-            Logging.server_log("  Error: AES key too short")
-            return JSONResponse({"error": "AES key must be at least 4 characters"}, status_code=400)
+                    elif event == "data":
+                        if part.size > MAX_FILE_SIZE:
+                            raise file_too_large(part.size)
+                        if pipeline is not None:
+                            await pipeline.write(data)
+                        else:
+                            await job.run(staging.write, data)
 
-        if mode not in ['encrypt', 'decrypt']:
-            Logging.server_log(f"  Error: Invalid mode {mode}")
-            return JSONResponse({"error": "Invalid mode"}, status_code=400)
+            form.finish()
 
-        upload_folder = Config.Paths.Client.UPLOADS
-        os.makedirs(upload_folder, exist_ok=True)
+            if file_part is None:
+                Logging.server_log("  Error: No selected file")
+                raise UploadRejected(400, "No selected file")
 
-        safe_file_path = path_traversal.safe_join(upload_folder, file.filename)
-        if not safe_file_path:
-            Logging.server_log(f"  Error: Path traversal detected for {file.filename}")
-            return JSONResponse({"error": "Invalid file path"}, status_code=400)
+            if pipeline is None:
+                key, mode = check_fields(fields)
+                output_name = output_name_for(file_part.filename, mode)
+                codec, sample = pick_compression(fields, file_part.filename, mode)
+                pipeline = UploadPipeline(job, key, mode, keep_upload=False, codec=codec, sample=sample)
+                await job.run(staging.close)
+                await pipeline.replay(staging.temp_path)
 
-        if os.path.exists(safe_file_path):
-            Logging.server_log(f"  Error: File already exists {safe_file_path}")
-            return JSONResponse({"error": "File already exists"}, status_code=409)
+            output_digest, upload_digest = await pipeline.finish(file_part.filename, output_name)
 
-        # Save uploaded file
-        with open(safe_file_path, 'wb') as f:
-            f.write(contents)
-        Logging.server_log(f"  Saved temp file {os.path.basename(safe_file_path)}")
+            if staging is not None and Config.FileManaging.LEAVE_UPLOADED_FILE:
+                upload_digest = await run_in_threadpool(staging.commit, file_part.filename, ref=False)
+                staging = None
 
+    except Exception as e:
+        if pipeline is not None:
+            pipeline.abort()
+        if staging is not None:
+            staging.abort()
+        if isinstance(e, UploadRejected):
+            return e.response
+        if isinstance(e, MultipartError):
+            Logging.server_log(f"  Error: {e}")
+            return JSONResponse({"error": str(e)}, status_code=400)
+        Logging.server_log(f"  Internal server error: {str(e)}")
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+    if staging is not None:
+        staging.abort()
+    if upload_digest is not None:
+        Logging.server_log(f"  Saved uploaded file {file_part.filename} as {upload_digest[:12]}")
+    Logging.server_log(f"  Processed {file_part.size} bytes into {output_name} ({output_digest[:12]})")
+    log_compression(pipeline.compression)
+
+    return await run_in_threadpool(issue_download, output_digest, output_name, file_part.size, pipeline.compression)
+
+
+DECRYPTION_FAILED = "Decryption failed, wrong key or corrupted file"
+
+
+async def decrypt_body(request: Request, form: MultipartStream, body_limit: int, upload: dict):
+    """
+    Yields plaintext as the multipart body arrives, AES2 / AES3 segment by
+    segment once each one authenticated. AES1 is held until its tag checks
+    out. A file part sent before the key is staged as ciphertext first.
+    Sets `upload["filename"]`, raises UploadRejected.
+    """
+    MAX_FILE_SIZE = Config.ProcessFileConfig.STREAM_MAX_FILE_SIZE
+
+    fields = {}
+    field_data = bytearray()
+    file_part = None
+    decryptor = None
+    staging = None
+    held = bytearray()
+    body_size = 0
+
+    async def opened(func, *args):
         try:
-            if mode == 'encrypt':
-                output_path = encrypt_file(safe_file_path, provided_key)
-            else:
-                output_path = decrypt_file(safe_file_path, provided_key)
+            out = await job.run(func, *args)
         except Exception as crypto_error:
             Logging.server_log(f"  Crypto error: {str(crypto_error)}")
-            if os.path.exists(safe_file_path):
-                os.remove(safe_file_path)
-            return JSONResponse({"error": "File processing failed"}, status_code=500)
-
-        token = download_tokens.gen_token()
-        download_tokens.add_token(token)
-
-        if not Config.FileManaging.LEAVE_UPLOADED_FILE and os.path.exists(safe_file_path):
-            try:
-                os.remove(safe_file_path)
-                Logging.server_log(f"  Removed temp file {os.path.basename(safe_file_path)}")
-            except OSError as e:
-                Logging.server_log(f"  Warning: Failed to remove temp file: {e}")
-
-        return JSONResponse({
-            "success": True,
-            "message": "File processed successfully",
-            "output_filename": os.path.basename(output_path),
-            "download_token": token
-        })
-        
+            raise UploadRejected(400, DECRYPTION_FAILED)
+        if not decryptor.legacy:
+            return out
+        held.extend(out)
+        if len(held) > Config.ProcessFileConfig.MAX_FILE_SIZE:
+            raise file_too_large(len(held))
+        return b""
+
+    try:
+        async with AsyncExitStack() as stack:
+            async for piece in request.stream():
+                body_size += len(piece)
+                if body_size > body_limit:
+                    raise file_too_large(body_size, MAX_FILE_SIZE)
+
+                for event, part, data in form.feed(piece):
+                    if part.filename is None:
+                        if event == "data":
+                            field_data += data
+                            if len(field_data) > Config.ProcessFileConfig.MAX_FIELD_SIZE:
+                                raise UploadRejected(400, f"Form field {part.name} too large")
+                        elif event == "end":
+                            fields[part.name] = form.decode(bytes(field_data))
+                            field_data.clear()
+                        continue
+
+                    if event == "begin":
+                        if file_part is not None:
+                            raise UploadRejected(400, "Only one file per request")
+                        file_part = part
+                        check_upload_name(part.filename)
+                        upload["filename"] = part.filename
+                        try:
+                            # no slot is held while the client reads or sends, each step takes one
+                            job = crypto_executor.reserve(f"decrypt stream {part.filename}", hold=False)
+                        except CryptoExecutorBusy as busy_error:
+                            Logging.server_log(f"  Error: {busy_error}")
+                            raise UploadRejected(503, "Server busy, try again", headers={"Retry-After": "1"})
+                        await stack.enter_async_context(job)
+
+                        if "key" in fields or "password" in fields:
+                            decryptor = StreamDecryptor(check_fields(dict(fields, mode="decrypt"))[0])
+                        else:
+                            staging = blob_store.writer()
+
+                    elif event == "data":
+                        if part.size > MAX_FILE_SIZE:
+                            raise file_too_large(part.size, MAX_FILE_SIZE)
+                        if decryptor is not None:
+                            yield await opened(decryptor.update, data)
+                        else:
+                            await job.run(staging.write, data)
+
+            form.finish()
+
+            if file_part is None:
+                Logging.server_log("  Error: No selected file")
+                raise UploadRejected(400, "No selected file")
+
+            if decryptor is None:
+                decryptor = StreamDecryptor(check_fields(dict(fields, mode="decrypt"))[0])
+                await job.run(staging.close)
+                with open(staging.temp_path, "rb") as source:
+                    while chunk := await job.run(source.read, BATCH_READ_SIZE):
+                        yield await opened(decryptor.update, chunk)
+
+            yield await opened(decryptor.finalize)
+            if held:
+                yield bytes(held)
+    except MultipartError as e:
+        Logging.server_log(f"  Error: {e}")
+        raise UploadRejected(400, str(e))
+    finally:
+        if staging is not None:
+            staging.abort()
+
+
+@router.post("/decrypt_stream")
+async def decrypt_stream(request: Request):
+    """
+    Endpoint /v0/hashing_file/decrypt_stream
+
+    multipart/form-data with `key` (or `password`) and `file`, answers with
+    the plaintext itself instead of a download token. Nothing decrypted is
+    written to disk. The response starts once the first segment
+    authenticated, so a wrong key still gets a 400; a segment that fails
+    later cuts the response off.
+    """
+    Logging.server_log(f"{request.client.host} request decrypt_stream")
+
+    MAX_FILE_SIZE = Config.ProcessFileConfig.STREAM_MAX_FILE_SIZE
+    body_limit = MAX_FILE_SIZE + Config.ProcessFileConfig.MULTIPART_OVERHEAD
+
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > body_limit:
+        return file_too_large(int(content_length), MAX_FILE_SIZE).response
+
+    try:
+        form = MultipartStream(request.headers.get("content-type", ""))
+    except MultipartError as form_error:
+        Logging.server_log(f"  Error: {form_error}")
+        return JSONResponse({"error": str(form_error)}, status_code=400)
+
+    upload = {}
+    plaintext = decrypt_body(request, form, body_limit, upload)
+    # hold the headers back until there is authenticated output (or none at all)
+    first = b""
+    try:
+        async for first in plaintext:
+            if first:
+                break
+    except UploadRejected as e:
+        return e.response
     except Exception as e:
         Logging.server_log(f"  Internal server error: {str(e)}")
-        if 'safe_file_path' in locals() and os.path.exists(safe_file_path):
-            try:
-                os.remove(safe_file_path)
-            except:
-                pass
         return JSONResponse({"error": "Internal server error"}, status_code=500)
 
+    output_name = output_name_for(upload["filename"], "decrypt")
+    sent = len(first)
+
+    async def body():
+        nonlocal sent
+        try:
+            yield first
+            async for chunk in plaintext:
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+            Logging.server_log(f"  Streamed {sent} bytes of {output_name}")
+        finally:
+            await plaintext.aclose()
+
+    # the rest of the multipart body is still read while plaintext goes out
+    return BodyStreamingResponse(
+        body(),
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "no-store", "Content-Disposition": f'attachment; filename="{output_name}"'},
+    )
+
+
+def reserve_download(token: str, planned: int, size: int) -> bool:
+    """
+    Book `planned` bytes against the uses left on a download token.
+
+    Every use allows `size` bytes: parallel parts and resumed ranges add
+    up, a response only starts while the uses left still have bytes.
+    """
+    def reserve(meta: dict):
+        sent = meta.get("sent", 0)
+        if size and sent >= size * max(meta.get("uses") or 1, 1):
+            return meta, False
+        return dict(meta, sent=sent + planned), True
+
+    return bool(download_tokens.update_token(token, reserve))
+
+
+def finish_download(token: str, response: RangeFileResponse, planned: int) -> None:
+    """
+    Settle a download once its body is done: bytes that never went out
+    are booked back, and a use is taken when the response ended cleanly
+    and the bytes of the use add up to the file. The last use releases
+    the output. A dropped transfer keeps its token and can resume.
+    """
+    def settle(meta: dict):
+        sent = max(meta.get("sent", 0) - (planned - response.sent), 0)
+        if not response.complete or sent < response.size:
+            return dict(meta, sent=sent), None
+        uses = meta.get("uses")
+        if uses is not None and uses > 1:
+            return dict(meta, uses=uses - 1, sent=sent - response.size), None
+        return None, meta
+
+    last = download_tokens.update_token(token, settle)
+    if last is not None:
+        release_token_target(last)
+
+
+async def serve_download(request: Request, filename: str, token: str):
+    """
+    Serve the output a download token points to.
+
+    A use is only taken after a response that ended cleanly, once the
+    bytes served under it add up to the whole file (see
+    `reserve_download`). Clients can fetch parts in parallel and resume
+    interrupted downloads. After the last use the output is released.
+    """
+    if not await run_in_threadpool(download_tokens.check_token, token):
+        Logging.server_log(" Permission denied")
+        return JSONResponse({"error": "Permission denied"}, status_code=403)
+
+    meta = await run_in_threadpool(download_tokens.token_meta, token) or {}
+    # a token only unlocks the file it was issued for
+    bound_name = meta.get("name") or (os.path.basename(meta["file"]) if meta.get("file") else None)
+    if bound_name and bound_name != filename:
+        Logging.server_log(" Permission denied, token issued for another file")
+        return JSONResponse({"error": "Permission denied"}, status_code=403)
+
+    if meta.get("blob"):
+        path = blob_store.path(meta["blob"])
+        # keeps outputs that are being fetched away from the storage janitor
+        await run_in_threadpool(blob_store.touch, meta["blob"])
+    else:
+        path = os.path.join(Config.Paths.Client.UPLOADS, filename)
+
+    try:
+        response = RangeFileResponse(path, request.headers, filename=filename, digest=meta.get("blob"))
+    except (FileNotFoundError, IsADirectoryError):
+        Logging.server_log(f"  File not found: {path}")
+        return JSONResponse({"error": "File not found"}, status_code=404)
+
+    planned = response.body_bytes(request.method)
+    if planned or (response.size == 0 and response.status_code == 200 and request.method != "HEAD"):
+        # booking is atomic across workers, the use is settled after the body
+        if not await run_in_threadpool(reserve_download, token, planned, response.size):
+            response.file.close()
+            Logging.server_log(" Permission denied, download use already served")
+            return JSONResponse({"error": "Permission denied"}, status_code=403)
+        response.background = BackgroundTask(finish_download, token, response, planned)
+
+    Logging.server_log(f"  Serving {filename} status={response.status_code}", range=request.headers.get("range"))
+    return response
+
+
+@router.get("/download/hashing_file/{filename}")
+async def download_file_get(filename: str, request: Request, token: str = ""):
+    Logging.server_log(f"{request.client.host} download request for {filename}")
+
+    if not token:
+        Logging.server_log("  Error: token missing")
+        return JSONResponse({"error": "Error: token missing"}, status_code=400)
+
+    return await serve_download(request, filename, token)
+
 
 @router.post("/download/hashing_file/{filename}")
 async def download_file(filename: str, request: Request):
     Logging.server_log(f"{request.client.host} download request for {filename}")
 
-    path = os.path.join(Config.Paths.Client.UPLOADS, filename)
-
     try:
         data = await request.json()
     except:
@@ -129,31 +662,4 @@ async def download_file(filename: str, request: Request):
         Logging.server_log("  Error: token missing")
         return {"error": "Error: token missing"}, 400
 
-    token = data["token"]
-    if not download_tokens.check_token(token):
-        Logging.server_log(" Permission denied")
-        return {"error": "Permission denied"}, 403
-
-    download_tokens.remove_token(token)
-
-    try:
-        response = FileResponse(
-            path,
-            media_type="application/octet-stream",
-            filename=filename
-        )
-        
-        # Delete file after download
-        def cleanup():
-            try:
-                os.remove(path)
-                Logging.server_log(f"  Deleted {path}")
-            except Exception as e:
-                Logging.server_log(f"  Error deleting {path}: {e}")
-
-        # Note: In FastAPI, file deletion needs to be handled differently
-        # This is a background task that can be implemented with BackgroundTasks
-        return response
-    except FileNotFoundError:
-        Logging.server_log(f"  File not found: {path}")
-        return {"error": "File not found"}, 404
+    return await serve_download(request, filename, data["token"])
@@ -0,0 +1,378 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+import hashlib
+import hmac
+import math
+import os
+import time
+
+router = APIRouter()
+
+from src.logging_utils import Logging
+from src.config import Config
+from src.aes_crypto import (
+    BATCH_READ_SIZE,
+    SEGMENT_SIZE,
+    SegmentSealer,
+    StreamDecryptor,
+    decrypted_file_path,
+    encrypted_file_path,
+    key_fingerprint,
+)
+from src.kdf import KdfParams
+from src.blob_store import blob_store
+from src.crypto_executor import crypto_executor, CryptoExecutorBusy
+from src.path_traversal_check import PathTraversal
+from src.routes.process_file.main import issue_download, storage_full
+from src.storage import storage
+from src.upload_sessions import upload_sessions
+
+path_traversal = PathTraversal()
+
+
+def busy_response(error: CryptoExecutorBusy) -> JSONResponse:
+    Logging.server_log(f"  Error: {error}")
+    return JSONResponse({"error": "Server busy, try again"}, status_code=503, headers={"Retry-After": "1"})
+
+
+def chunk_length(meta: dict, index: int) -> int:
+    return max(min(meta["chunk_size"], meta["size"] - index * meta["chunk_size"]), 0)
+
+
+def session_params(meta: dict) -> KdfParams | None:
+    # sessions created before AES3 have no KDF params and stay AES2
+    return KdfParams.decode(bytes.fromhex(meta["kdf"])) if meta.get("kdf") else None
+
+
+async def check_key(meta: dict, key: str) -> bool:
+    """
+    Compare against the stored fingerprint, the KDF runs on the crypto
+    executor (raises CryptoExecutorBusy)
+    """
+    if len(key) < 4:
+        return False
+    expected = await crypto_executor.run(
+        key_fingerprint, key, bytes.fromhex(meta["key_salt"]), session_params(meta), name="session key",
+    )
+    return hmac.compare_digest(expected, meta["key_check"])
+
+
+def session_status(session_id: str, meta: dict) -> dict:
+    received = upload_sessions.received(session_id)
+    have = set(received)
+    return {
+        "session_id": session_id,
+        "filename": meta["filename"],
+        "mode": meta["mode"],
+        "size": meta["size"],
+        "chunk_size": meta["chunk_size"],
+        "chunks": meta["chunks"],
+        "received": received,
+        "missing": [index for index in range(meta["chunks"]) if index not in have],
+        "expires_in": max(int(upload_sessions.ttl_seconds - (time.time() - upload_sessions.last_activity(session_id))), 0),
+    }
+
+
+@router.post("/upload_sessions")
+async def create_upload_session(request: Request):
+    """
+    Endpoint /v0/hashing_file/upload_sessions
+
+    Start a resumable upload, body
+    `{"filename": ..., "size": ..., "mode": "encrypt"|"decrypt", "key": ..., "chunk_size": ...}`
+    """
+    Logging.server_log(f"{request.client.host} request create upload session")
+
+    if storage.full():
+        return storage_full()
+
+    try:
+        data = await request.json()
+    except Exception:
+        Logging.server_log("  Error: Invalid JSON")
+        return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+
+    filename = str(data.get("filename") or "")
+    mode = data.get("mode")
+    key = str(data.get("key") or data.get("password") or "").strip()
+    size = data.get("size")
+    chunk_size = data.get("chunk_size", Config.UploadSessionConfig.CHUNK_SIZE)
+
+    if not filename or not path_traversal.allowed_filename(filename):
+        Logging.server_log(f"  Error: Invalid filename {filename}")
+        return JSONResponse({"error": "Invalid filename"}, status_code=400)
+
+    if mode not in ['encrypt', 'decrypt']:
+        Logging.server_log(f"  Error: Invalid mode {mode}")
+        return JSONResponse({"error": "Invalid mode"}, status_code=400)
+
+    if len(key) < 4:
+        Logging.server_log("  Error: AES key too short")
+        return JSONResponse({"error": "AES key must be at least 4 characters"}, status_code=400)
+
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return JSONResponse({"error": "size must be a non-negative integer"}, status_code=400)
+
+    MAX_FILE_SIZE = Config.UploadSessionConfig.MAX_FILE_SIZE
+    if size > MAX_FILE_SIZE:
+        Logging.server_log(f"  Error: File too large {size}")
+        return JSONResponse(
+            {"error": f"File too large. Maximum size is {MAX_FILE_SIZE//1024//1024}MB"},
+            status_code=413
+        )
+
+    if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size <= 0:
+        return JSONResponse({"error": "chunk_size must be a positive integer"}, status_code=400)
+    # whole AES2 segments per chunk, so every chunk can be sealed on its own
+    chunk_size = min(math.ceil(chunk_size / SEGMENT_SIZE) * SEGMENT_SIZE, Config.UploadSessionConfig.MAX_CHUNK_SIZE)
+
+    if mode == 'encrypt':
+        output_name = os.path.basename(encrypted_file_path(filename))
+    else:
+        output_name = os.path.basename(decrypted_file_path(filename))
+
+    key_salt = os.urandom(16)
+    params = KdfParams.new()
+    try:
+        key_check = await crypto_executor.run(key_fingerprint, key, key_salt, params, name="session key")
+    except CryptoExecutorBusy as busy_error:
+        return busy_response(busy_error)
+
+    session_id = upload_sessions.create({
+        "filename": filename,
+        "output_name": output_name,
+        "mode": mode,
+        "size": size,
+        "chunk_size": chunk_size,
+        "chunks": max(math.ceil(size / chunk_size), 1),
+        "prefix": os.urandom(7).hex(),
+        "kdf": params.encode().hex(),
+        "key_salt": key_salt.hex(),
+        "key_check": key_check,
+    })
+    Logging.server_log(f"  Upload session {session_id} for {filename}", size=size, chunk_size=chunk_size)
+
+    return JSONResponse(session_status(session_id, upload_sessions.load(session_id)), status_code=201)
+
+
+@router.get("/upload_sessions/{session_id}")
+async def upload_session_status(session_id: str, request: Request):
+    """
+    Endpoint /v0/hashing_file/upload_sessions/{session_id}
+
+    Which chunks arrived, clients resume by sending the `missing` ones
+    """
+    meta = upload_sessions.load(session_id)
+    if meta is None:
+        return JSONResponse({"error": "Upload session not found"}, status_code=404)
+    return JSONResponse(session_status(session_id, meta))
+
+
+@router.put("/upload_sessions/{session_id}/chunks/{index}")
+async def upload_chunk(session_id: str, index: int, request: Request):
+    """
+    Endpoint /v0/hashing_file/upload_sessions/{session_id}/chunks/{index}
+
+    Raw chunk body with `X-AES-Key` and `X-Chunk-SHA256` (hex) headers.
+    Encrypt sessions seal the chunk right away, chunks may arrive in any
+    order and in parallel. The first checksum sent for a chunk pins it, it
+    can be sent again only with the same data (409 otherwise).
+    """
+    Logging.server_log(f"{request.client.host} upload chunk {index} of {session_id}")
+
+    meta = upload_sessions.load(session_id)
+    if meta is None:
+        return JSONResponse({"error": "Upload session not found"}, status_code=404)
+
+    if not 0 <= index < meta["chunks"]:
+        return JSONResponse({"error": "Chunk index out of range"}, status_code=400)
+
+    try:
+        key_ok = await check_key(meta, request.headers.get("x-aes-key", "").strip())
+    except CryptoExecutorBusy as busy_error:
+        return busy_response(busy_error)
+    if not key_ok:
+        Logging.server_log("  Permission denied, wrong key for session")
+        return JSONResponse({"error": "Permission denied"}, status_code=403)
+
+    checksum = request.headers.get("x-chunk-sha256", "").strip().lower()
+    if len(checksum) != 64:
+        return JSONResponse({"error": "X-Chunk-SHA256 header is required"}, status_code=400)
+
+    expected = chunk_length(meta, index)
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length != str(expected):
+        Logging.server_log(f"  Error: Chunk size {content_length}, expected {expected}")
+        return JSONResponse({"error": f"Chunk {index} must be {expected} bytes"}, status_code=400)
+
+    try:
+        pinned = await run_in_threadpool(upload_sessions.pin_chunk, session_id, index, checksum)
+    except OSError:
+        return JSONResponse({"error": "Upload session not found"}, status_code=404)
+    if not pinned:
+        Logging.server_log(f"  Error: Chunk {index} was sent before with a different checksum")
+        return JSONResponse({"error": f"Chunk {index} was sent before with different data"}, status_code=409)
+
+    final = index == meta["chunks"] - 1
+    sealer = None
+    if meta["mode"] == 'encrypt':
+        sealer = SegmentSealer(request.headers["x-aes-key"].strip(), bytes.fromhex(meta["prefix"]), params=session_params(meta))
+    next_segment = index * meta["chunk_size"] // SEGMENT_SIZE
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    temp_path = upload_sessions.temp_path(session_id)
+    received = 0
+
+    try:
+        # slots are taken per sealing step, not across the network read
+        job = crypto_executor.reserve(f"chunk {index} {session_id[:8]}", hold=False)
+    except CryptoExecutorBusy as busy_error:
+        return busy_response(busy_error)
+
+    def write_piece(out, piece: bytes) -> None:
+        nonlocal next_segment
+        hasher.update(piece)
+        if sealer is None:
+            out.write(piece)
+            return
+        buffer.extend(piece)
+        # hold the last segment back, it may have to be sealed as final
+        ready = (len(buffer) - 1) // SEGMENT_SIZE * SEGMENT_SIZE
+        if ready > 0:
+            out.write(sealer.seal(next_segment, bytes(buffer[:ready]), final=False))
+            next_segment += ready // SEGMENT_SIZE
+            del buffer[:ready]
+
+    def write_rest(out) -> None:
+        if sealer is not None:
+            out.write(sealer.seal(next_segment, bytes(buffer), final=final))
+
+    try:
+        async with job:
+            with open(temp_path, "wb") as out:
+                async for piece in request.stream():
+                    if not piece:
+                        continue
+                    received += len(piece)
+                    if received > expected:
+                        break
+                    await job.run(write_piece, out, piece)
+                if received == expected:
+                    await job.run(write_rest, out)
+
+        if received != expected:
+            Logging.server_log(f"  Error: Chunk size {received}, expected {expected}")
+            return JSONResponse({"error": f"Chunk {index} must be {expected} bytes"}, status_code=400)
+
+        if not hmac.compare_digest(hasher.hexdigest(), checksum):
+            Logging.server_log(f"  Error: Chunk {index} checksum mismatch")
+            return JSONResponse({"error": "Chunk checksum mismatch"}, status_code=400)
+
+        await run_in_threadpool(upload_sessions.commit_chunk, session_id, index, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    received_chunks = upload_sessions.received(session_id)
+    return JSONResponse({"index": index, "received": len(received_chunks), "chunks": meta["chunks"]})
+
+
+@router.post("/upload_sessions/{session_id}/finalize")
+async def finalize_upload_session(session_id: str, request: Request):
+    """
+    Endpoint /v0/hashing_file/upload_sessions/{session_id}/finalize
+
+    Join the chunks into the output, body `{"key": ...}`. Answers like
+    /process_file with a download token.
+    """
+    Logging.server_log(f"{request.client.host} finalize upload session {session_id}")
+
+    try:
+        data = await request.json()
+    except Exception:
+        Logging.server_log("  Error: Invalid JSON")
+        return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+
+    meta = upload_sessions.load(session_id)
+    if meta is None:
+        return JSONResponse({"error": "Upload session not found"}, status_code=404)
+
+    key = str((data or {}).get("key") or (data or {}).get("password") or "").strip()
+    try:
+        key_ok = await check_key(meta, key)
+    except CryptoExecutorBusy as busy_error:
+        return busy_response(busy_error)
+    if not key_ok:
+        Logging.server_log("  Permission denied, wrong key for session")
+        return JSONResponse({"error": "Permission denied"}, status_code=403)
+
+    missing = session_status(session_id, meta)["missing"]
+    if missing:
+        return JSONResponse({"error": "Chunks missing", "missing": missing}, status_code=409)
+
+    if not upload_sessions.claim(session_id):
+        return JSONResponse({"error": "Upload session is already being finalized"}, status_code=409)
+
+    try:
+        job = crypto_executor.reserve(f"finalize {session_id[:8]}", hold=False)
+    except CryptoExecutorBusy as busy_error:
+        upload_sessions.unclaim(session_id)
+        return busy_response(busy_error)
+
+    output = blob_store.writer()
+    decryptor = StreamDecryptor(key) if meta["mode"] == 'decrypt' else None
+
+    def copy_part(index: int) -> None:
+        with open(upload_sessions.chunk_path(session_id, index), "rb") as part:
+            while piece := part.read(BATCH_READ_SIZE):
+                output.write(decryptor.update(piece) if decryptor is not None else piece)
+
+    try:
+        async with job:
+            if decryptor is None:
+                header = SegmentSealer(key, bytes.fromhex(meta["prefix"]), params=session_params(meta)).header
+                await job.run(output.write, header)
+            for index in range(meta["chunks"]):
+                await job.run(copy_part, index)
+            if decryptor is not None:
+                await job.run(lambda: output.write(decryptor.finalize()))
+    except Exception as crypto_error:
+        output.abort()
+        upload_sessions.unclaim(session_id)
+        Logging.server_log(f"  Crypto error: {str(crypto_error)}")
+        return JSONResponse({"error": "File processing failed"}, status_code=500)
+
+    output_digest = await run_in_threadpool(output.commit, meta["output_name"])
+    await run_in_threadpool(upload_sessions.remove, session_id)
+    Logging.server_log(f"  Processed {meta['size']} bytes into {meta['output_name']} ({output_digest[:12]})")
+
+    return await run_in_threadpool(issue_download, output_digest, meta["output_name"], meta["size"])
+
+
+@router.delete("/upload_sessions/{session_id}")
+async def abort_upload_session(session_id: str, request: Request):
+    """
+    Endpoint /v0/hashing_file/upload_sessions/{session_id}
+
+    Throw away a session and its chunks, needs the `X-AES-Key` header
+    """
+    Logging.server_log(f"{request.client.host} abort upload session {session_id}")
+
+    meta = upload_sessions.load(session_id)
+    if meta is None:
+        return JSONResponse({"error": "Upload session not found"}, status_code=404)
+
+    try:
+        key_ok = await check_key(meta, request.headers.get("x-aes-key", "").strip())
+    except CryptoExecutorBusy as busy_error:
+        return busy_response(busy_error)
+    if not key_ok:
+        Logging.server_log("  Permission denied, wrong key for session")
+        return JSONResponse({"error": "Permission denied"}, status_code=403)
+
+    await run_in_threadpool(upload_sessions.remove, session_id)
+    return JSONResponse({"success": True})
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
 from datetime import datetime
 import os
 import sys
@@ -12,29 +12,126 @@ from src.config import Config
 from src.logging_utils import Logging
 
 # adding other routers
-from src.routes.admin_routes.admin_routes import router as admin_router
-from src.routes.process_file.main import router as process_file_router
+from src.routes.admin_routes.admin_routes import router as admin_router, admin_tokens
+from src.routes.process_file.main import router as process_file_router, sweep_download_tokens, download_tokens
 from src.routes.base64.main import router as aes_router
 from src.routes.pages.main import router as pages_router
+from src.routes.upload_sessions.main import router as upload_sessions_router
+from src.routes.jobs.main import router as jobs_router, run_job
+from src.upload_sessions import upload_sessions
+from src.job_queue import job_runner, job_store
+from src.blob_store import blob_store
+from src.crypto_executor import crypto_executor
+from src.aes_crypto import key_cache
+from src.metrics import MetricsMiddleware, metrics
+from src.rate_limit import AdmissionMiddleware, upload_budget
+from src.asset_cache import asset_cache
+from src.storage import storage
 
 # Initialize FastAPI app
 app = FastAPI(title="Hash Server")
+# added first so it runs inside the metrics middleware, refusals get counted
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(admin_router, prefix="/v0/admin", tags=["admin"])
 app.include_router(process_file_router, prefix="/v0/hashing_file", tags=["hashing"])
+app.include_router(upload_sessions_router, prefix="/v0/hashing_file", tags=["hashing"])
+app.include_router(jobs_router, prefix="/v0/hashing_file", tags=["hashing"])
 app.include_router(aes_router, prefix="/v0/api/aes", tags=["hashing"])
 app.include_router(pages_router, prefix="/v0/pages", tags=["pages"])
 
-# Mount static files for templates
-app.mount("/static", StaticFiles(directory="templates"), name="static")
+# Static files for templates, served from memory
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def static_files(path: str, request: Request):
+    asset = asset_cache.get(path)
+    if asset is not None and request.query_params.get("v") == asset.version:
+        # the URL changes with the content, safe to keep for good
+        cache_control = f"public, max-age={Config.AssetConfig.VERSIONED_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={Config.AssetConfig.STATIC_MAX_AGE}"
+    return asset_cache.response(request, path, cache_control)
+
+# values owned by other modules, read when /v0/admin/metrics is scraped
+metrics.gauge_func(
+    "hash_server_tokens", "Live tokens per store",
+    lambda: {("admin",): admin_tokens.stats()["live"], ("download",): download_tokens.stats()["live"]},
+    ("store",),
+)
+metrics.gauge_func("hash_server_upload_blobs", "Stored output blobs", lambda: blob_store.stats()["blobs"])
+metrics.gauge_func("hash_server_upload_bytes", "Bytes used by stored output blobs", lambda: blob_store.stats()["bytes"])
+metrics.gauge_func("hash_server_storage_quota_bytes", "Disk quota of the uploads directory", lambda: storage.quota_bytes)
+metrics.gauge_func("hash_server_storage_full", "1 while new uploads are refused over the quota", lambda: int(storage.full()))
+metrics.gauge_func("hash_server_upload_sessions", "Open resumable upload sessions", lambda: len(upload_sessions.sessions()))
+metrics.gauge_func(
+    "hash_server_jobs", "Background file jobs per state",
+    lambda: {(state,): count for state, count in job_runner.counts.items()}, ("state",),
+)
+metrics.gauge_func("hash_server_crypto_jobs_pending", "Crypto executor jobs running or queued", lambda: crypto_executor.stats()["pending"])
+metrics.gauge_func(
+    "hash_server_crypto_jobs_rejected_total", "Crypto jobs refused with 503",
+    lambda: crypto_executor.stats()["rejected"], kind="counter",
+)
+metrics.gauge_func("hash_server_key_cache_entries", "Derived keys held in the key cache", lambda: key_cache.stats()["entries"])
+metrics.gauge_func("hash_server_upload_inflight_bytes", "Upload bytes admitted and still being received", lambda: upload_budget.inflight)
+
+async def token_sweeper():
+    """
+    Background loop that expires download tokens and their files,
+    stale upload sessions and finished jobs
+    """
+    while True:
+        await asyncio.sleep(Config.TokensConfig.SWEEP_INTERVAL)
+        try:
+            removed = await run_in_threadpool(sweep_download_tokens)
+            if removed:
+                Logging.server_log(f"Token sweeper expired {removed} download tokens")
+            stale = await run_in_threadpool(upload_sessions.sweep)
+            if stale:
+                Logging.server_log(f"Token sweeper removed {stale} stale upload sessions")
+            old_jobs = await run_in_threadpool(job_store.sweep)
+            if old_jobs:
+                Logging.server_log(f"Token sweeper removed {old_jobs} old jobs")
+        except Exception as e:
+            Logging.server_log(f"Token sweeper error: {e}")
+
+
+async def storage_janitor():
+    """
+    Background loop that keeps the uploads directory under its quota
+    """
+    while True:
+        await asyncio.sleep(Config.StorageConfig.JANITOR_INTERVAL)
+        try:
+            evicted = await run_in_threadpool(storage.evict)
+            if evicted:
+                Logging.server_log(f"Storage janitor removed {evicted} blobs")
+        except Exception as e:
+            Logging.server_log(f"Storage janitor error: {e}")
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await run_in_threadpool(asset_cache.load)
+    app.state.token_sweeper = asyncio.create_task(token_sweeper())
+    app.state.storage_janitor = asyncio.create_task(storage_janitor())
+    os.makedirs(job_store.root, exist_ok=True)
+    job_runner.start(run_job)
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.token_sweeper.cancel()
+    app.state.storage_janitor.cancel()
+    await job_runner.stop()
+
 
 # Web index of this site
 @app.get("/")
 async def ok(request: Request):
     Logging.server_log(f"{request.client.host} request /")
-    file_path = os.path.join(Config.Paths.Sites.SITES_FOLDER, Config.Paths.Sites.MAIN_SITE, "index.html")
-    return FileResponse(file_path)
+    return asset_cache.response(request, Config.Paths.Sites.MAIN_SITE + "index.html", Config.AssetConfig.PAGE_CACHE_CONTROL)
 
 
 def create_server_dirs():
@@ -52,11 +149,28 @@ def main():
     current_time_only = datetime.now().time()
     Logging.server_log(f"={current_time_only}=======================================================")
     Logging.server_log(f"FastAPI server started on http://{Config.Link.HOST}:{Config.Link.PORT}")
+
+    if Config.ServerConfig.MODE == "production":
+        from src.prefork import WorkerSupervisor
+
+        if Config.TokensConfig.BACKEND != "log":
+            Logging.server_log("  Warning: token BACKEND is not 'log', tokens will not be shared between workers")
+
+        WorkerSupervisor(
+            "src.server:app",
+            host=Config.Link.HOST,
+            port=int(Config.Link.PORT),
+            workers=Config.ServerConfig.WORKERS,
+            reuse_port=Config.ServerConfig.REUSE_PORT,
+            graceful_timeout=Config.ServerConfig.GRACEFUL_TIMEOUT,
+            backlog=Config.ServerConfig.BACKLOG,
+        ).run()
+        return
     
     uvicorn.run(
         "src.server:app",
         host=Config.Link.HOST,
-        port=Config.Link.PORT,
+        port=int(Config.Link.PORT),
         reload=True,
         log_level="info"
     )
@@ -0,0 +1,271 @@
+import asyncio
+import os
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from src.blob_store import BlobStore, blob_store
+from src.config import Config
+from src.logging_utils import Logging
+from src.metrics import metrics
+
+
+storage_evicted = metrics.counter(
+    "hash_server_storage_evicted_total", "Blobs removed by the storage janitor", ("reason",),
+)
+
+
+IDLE_CLEAR = {"running": False, "removed": 0, "started": None, "finished": None}
+IDLE_JANITOR = {"running": False, "full": False, "started": None, "finished": None}
+
+
+class StorageManager:
+    """
+    # disk quota for the uploads directory
+
+    Blob usage and access times come from the blob index, which every
+    commit, download and release already keeps current. Bytes staged by
+    upload sessions and jobs (`staged_areas`) are counted in the index as
+    chunks and inputs come and go, nothing walks their directories.
+    `evict()` is one janitor pass, run by one worker at a time
+    - unreferenced blobs not accessed for `max_age_seconds` are removed
+    - above `high_watermark` of the quota the least recently used blobs
+      are removed until usage is under `low_watermark`, unreferenced ones
+      first and those a download token holds only when that is not enough
+    - `full()` stays True while the last pass still ended above
+      `high_watermark`, routes then refuse new uploads, sessions and jobs.
+      The verdict is shared in the blob index, workers that skip a pass
+      because another one runs it pick it up from there
+
+    `start_clear()` empties the directory in the background, `batch_size`
+    entries per step, the request that asked for it returns right away.
+    Its progress is kept in the blob index, so every worker sees it.
+
+    ```python
+    await run_in_threadpool(storage.evict)
+    storage.usage()
+    ```
+    """
+
+    def __init__(self, store: BlobStore, quota_bytes: int, high_watermark: float, low_watermark: float,
+                 max_age_seconds: float, batch_size: int, staged_areas: tuple = ()):
+        self.store = store
+        self.quota_bytes = quota_bytes
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_age_seconds = max_age_seconds
+        self.batch_size = batch_size
+        self.staged_areas = staged_areas
+
+        self._over_quota = False
+        self._clear_task: asyncio.Task | None = None
+
+    def _measure(self) -> dict:
+        """
+        Bytes per area, `bytes` is the total the quota applies to
+        """
+        stats = self.store.stats()
+        staged = self.store.staged()
+        sizes = {"blobs": stats["bytes"]}
+        for area in self.staged_areas:
+            sizes[area] = staged.get(area, 0)
+        return dict(sizes, blob_count=stats["blobs"], bytes=sum(sizes.values()))
+
+    def full(self) -> bool:
+        # refreshed from the shared janitor state on every pass, routes
+        # call this on the event loop
+        return self._over_quota
+
+    @property
+    def janitor(self) -> dict:
+        return self.store.get_state("janitor") or dict(IDLE_JANITOR)
+
+    @property
+    def clearing(self) -> dict:
+        return self.store.get_state("clear") or dict(IDLE_CLEAR)
+
+    def usage(self) -> dict:
+        sizes = self._measure()
+        return {
+            "blobs": sizes["blob_count"],
+            "bytes": sizes["bytes"],
+            "areas": {area: size for area, size in sizes.items() if area not in ("blob_count", "bytes")},
+            "quota_bytes": self.quota_bytes,
+            "used": round(sizes["bytes"] / self.quota_bytes, 4) if self.quota_bytes else 0,
+            "full": self.janitor["full"],
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "max_age_seconds": self.max_age_seconds,
+            "clear": self.clearing,
+        }
+
+    def _evict_lru(self, used: int, target: float, referenced: bool) -> tuple[int, int]:
+        """
+        Drop least recently used blobs until `used` is at `target`,
+        returns (blobs removed, bytes still used)
+        """
+        removed = 0
+        reason = "quota_referenced" if referenced else "quota"
+        while used > target and (batch := self.store.least_recent(self.batch_size, referenced=referenced)):
+            victims = []
+            for entry in batch:
+                if used <= target:
+                    break
+                victims.append(entry["digest"])
+                used -= entry["size"]
+            self.store.drop(victims)
+            storage_evicted.inc(len(victims), reason)
+            removed += len(victims)
+        return removed, used
+
+    def _begin_pass(self) -> bool:
+        def begin(state: dict | None):
+            state = state or dict(IDLE_JANITOR)
+            # a pass whose worker died counts as finished
+            if state["running"] and _alive(state.get("pid")):
+                return state, False
+            return dict(state, running=True, started=time.time(), pid=os.getpid()), True
+
+        return self.store.update_state("janitor", begin)
+
+    def _end_pass(self, full: bool) -> None:
+        def end(state: dict | None):
+            return dict(state or IDLE_JANITOR, running=False, full=full, finished=time.time()), None
+
+        self.store.update_state("janitor", end)
+
+    def evict(self) -> int:
+        """
+        One janitor pass, returns how many blobs were removed. Skipped
+        while another worker runs one, so the same bytes are never evicted
+        twice.
+        """
+        if not self._begin_pass():
+            self._over_quota = self.janitor["full"]
+            return 0
+
+        full = self._over_quota
+        try:
+            removed, full = self._evict()
+        finally:
+            self._end_pass(full)
+            self._over_quota = full
+        return removed
+
+    def _evict(self) -> tuple[int, bool]:
+        removed = 0
+
+        if self.max_age_seconds:
+            cutoff = time.time() - self.max_age_seconds
+            while batch := self.store.least_recent(self.batch_size, accessed_before=cutoff, referenced=False):
+                self.store.drop([entry["digest"] for entry in batch])
+                storage_evicted.inc(len(batch), "age")
+                removed += len(batch)
+
+        used = self._measure()["bytes"]
+        if self.quota_bytes and used > self.quota_bytes * self.high_watermark:
+            target = self.quota_bytes * self.low_watermark
+            Logging.server_log(f"Storage over quota watermark, {used} of {self.quota_bytes} bytes used")
+            dropped, used = self._evict_lru(used, target, referenced=False)
+            removed += dropped
+            if used > target:
+                dropped, used = self._evict_lru(used, target, referenced=True)
+                if dropped:
+                    Logging.server_log(f"  Warning: Evicted {dropped} blobs download tokens still pointed to")
+                removed += dropped
+
+        return removed, bool(self.quota_bytes) and used > self.quota_bytes * self.high_watermark
+
+    def _loose_files(self) -> list[str]:
+        """
+        Files kept next to the blob store by older versions, the blob index
+        and the shared rate limit buckets stay
+        """
+        paths = []
+        with os.scandir(self.store.root) as entries:
+            for entry in entries:
+                if entry.name == Config.RateLimitConfig.STATE_FILE:
+                    continue
+                if entry.is_file() and not entry.path.startswith(self.store.index_path):
+                    paths.append(entry.path)
+        return paths
+
+    def _remove_files(self, paths: list[str]) -> int:
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                Logging.server_log(f"  Warning: Failed to remove {path}: {e}")
+        return removed
+
+    def _begin_clear(self) -> bool:
+        def begin(state: dict | None):
+            state = state or dict(IDLE_CLEAR)
+            # a clear whose worker died counts as finished
+            if state["running"] and _alive(state.get("pid")):
+                return state, False
+            return {"running": True, "removed": 0, "started": time.time(), "finished": None, "pid": os.getpid()}, True
+
+        return self.store.update_state("clear", begin)
+
+    def _clear_progress(self, removed: int, finished: bool = False) -> None:
+        def progress(state: dict | None):
+            state = dict(state or IDLE_CLEAR, removed=(state or IDLE_CLEAR)["removed"] + removed)
+            if finished:
+                state.update(running=False, finished=time.time())
+            return state, None
+
+        self.store.update_state("clear", progress)
+
+    async def start_clear(self) -> bool:
+        """
+        Start emptying the uploads directory, False when a clear is running
+        in any worker
+        """
+        if not await run_in_threadpool(self._begin_clear):
+            return False
+        self._clear_task = asyncio.create_task(self._clear())
+        return True
+
+    async def _clear(self) -> None:
+        removed = 0
+        try:
+            while count := await run_in_threadpool(self.store.clear, self.batch_size):
+                removed += count
+                await run_in_threadpool(self._clear_progress, count)
+
+            paths = await run_in_threadpool(self._loose_files)
+            for start in range(0, len(paths), self.batch_size):
+                count = await run_in_threadpool(self._remove_files, paths[start:start + self.batch_size])
+                removed += count
+                await run_in_threadpool(self._clear_progress, count)
+            Logging.server_log(f"  Cleared uploads, removed {removed} files")
+        except Exception as e:
+            Logging.server_log(f"  Error: clearing uploads failed: {e}")
+        finally:
+            await run_in_threadpool(self._clear_progress, 0, True)
+
+
+def _alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+storage = StorageManager(
+    blob_store,
+    quota_bytes=Config.StorageConfig.QUOTA_BYTES,
+    high_watermark=Config.StorageConfig.HIGH_WATERMARK,
+    low_watermark=Config.StorageConfig.LOW_WATERMARK,
+    max_age_seconds=Config.StorageConfig.MAX_AGE_SECONDS,
+    batch_size=Config.StorageConfig.BATCH_SIZE,
+    staged_areas=("sessions", "jobs"),
+)
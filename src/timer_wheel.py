@@ -0,0 +1,72 @@
+import math
+
+
+class TimerWheel:
+    """
+    # hashed timer wheel
+
+    Keys are dropped into a slot per `resolution` seconds. `pop_due()` walks
+    the slots between the last call and now, so scheduling, cancelling and
+    expiring are all amortized O(1) per key.
+
+    ```python
+    wheel = TimerWheel(resolution=1.0)
+    wheel.schedule("token", time.time() + 60)
+    for key in wheel.pop_due(time.time()):
+        ...
+    ```
+    """
+
+    def __init__(self, resolution: float = 1.0):
+        self.resolution = resolution
+        self._slots: dict[int, set] = {}
+        self._slot_of: dict = {}
+        self._cursor: int | None = None
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, key, when: float) -> None:
+        self.cancel(key)
+        # round up so a key never comes out before `when`
+        slot = math.ceil(when / self.resolution)
+        if self._cursor is not None and slot < self._cursor:
+            slot = self._cursor
+        self._slots.setdefault(slot, set()).add(key)
+        self._slot_of[key] = slot
+
+    def cancel(self, key) -> None:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return
+        keys = self._slots[slot]
+        keys.discard(key)
+        if not keys:
+            del self._slots[slot]
+
+    def clear(self) -> None:
+        self._slots.clear()
+        self._slot_of.clear()
+        self._cursor = None
+
+    def pop_due(self, now: float) -> list:
+        tick = math.floor(now / self.resolution)
+        if self._cursor is None:
+            self._cursor = min(self._slots, default=tick)
+
+        if tick - self._cursor > len(self._slots):
+            # long gap, cheaper to look at the occupied slots only
+            ticks = sorted(slot for slot in self._slots if slot <= tick)
+        else:
+            ticks = range(self._cursor, tick + 1)
+
+        due = []
+        for slot in ticks:
+            keys = self._slots.pop(slot, None)
+            if keys:
+                for key in keys:
+                    del self._slot_of[key]
+                due.extend(keys)
+
+        self._cursor = max(self._cursor, tick + 1)
+        return due
@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from src.blob_store import blob_store
+from src.config import Config
+
+
+SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadSessionStore:
+    """
+    # on-disk state of resumable uploads
+
+    Every session is a directory `<root>/<id>/` with a `session.json`, one
+    `<index>.part` file per received chunk and its `<index>.sha256` pin. Nothing lives in memory, so any
+    worker can take any chunk and chunks can arrive in parallel.
+    `track(delta)` is told how many chunk bytes were committed or removed,
+    the storage quota counts them without walking the directories.
+
+    ```python
+    session_id = upload_sessions.create({"filename": "a.txt", "size": 10})
+    path = upload_sessions.temp_path(session_id)
+    ...
+    upload_sessions.commit_chunk(session_id, 0, path)
+    ```
+    """
+
+    def __init__(self, root: str, ttl_seconds: float, track=None):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.track = track or (lambda delta: None)
+
+    def _dir(self, session_id: str) -> str:
+        if not SESSION_ID.fullmatch(session_id):
+            raise KeyError(session_id)
+        return os.path.join(self.root, session_id)
+
+    def create(self, meta: dict) -> str:
+        session_id = uuid.uuid4().hex
+        directory = self._dir(session_id)
+        os.makedirs(directory)
+        meta = dict(meta, created=time.time())
+        with open(os.path.join(directory, "session.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return session_id
+
+    def load(self, session_id: str) -> dict | None:
+        """
+        Session metadata, None when it does not exist or expired
+        """
+        try:
+            directory = self._dir(session_id)
+            with open(os.path.join(directory, "session.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+        if time.time() - self.last_activity(session_id) > self.ttl_seconds:
+            return None
+        return meta
+
+    def last_activity(self, session_id: str) -> float:
+        try:
+            return os.stat(self._dir(session_id)).st_mtime
+        except (KeyError, OSError):
+            return 0.0
+
+    def chunk_path(self, session_id: str, index: int) -> str:
+        return os.path.join(self._dir(session_id), f"{index}.part")
+
+    def temp_path(self, session_id: str) -> str:
+        return os.path.join(self._dir(session_id), f"{uuid.uuid4().hex}.tmp")
+
+    def pin_chunk(self, session_id: str, index: int, checksum: str) -> bool:
+        """
+        Bind chunk `index` to the first checksum sent for it, False when it
+        is pinned to a different one. Sealing is deterministic, so a chunk
+        sent again with the same data gives the same ciphertext, but other
+        data under the same segment nonces must never be sealed.
+        """
+        path = os.path.join(self._dir(session_id), f"{index}.sha256")
+        temp_path = self.temp_path(session_id)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(checksum)
+        try:
+            # link fails when the pin exists, two racing uploads cannot both win
+            os.link(temp_path, path)
+            return True
+        except FileExistsError:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read() == checksum
+        finally:
+            os.remove(temp_path)
+
+    def commit_chunk(self, session_id: str, index: int, temp_path: str) -> None:
+        path = self.chunk_path(session_id, index)
+        size = os.path.getsize(temp_path)
+        try:
+            size -= os.path.getsize(path)
+        except OSError:
+            pass
+        # rename is atomic, a chunk sent twice (same checksum) replaces itself
+        os.replace(temp_path, path)
+        self.track(size)
+
+    def received(self, session_id: str) -> list[int]:
+        try:
+            names = os.listdir(self._dir(session_id))
+        except (KeyError, OSError):
+            return []
+        return sorted(int(name[:-5]) for name in names if name.endswith(".part") and name[:-5].isdigit())
+
+    def claim(self, session_id: str) -> bool:
+        """
+        Mark the session as being finalized, only one caller wins
+        """
+        try:
+            fd = os.open(os.path.join(self._dir(session_id), "finalize.lock"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except (KeyError, FileExistsError, FileNotFoundError):
+            return False
+        os.close(fd)
+        return True
+
+    def unclaim(self, session_id: str) -> None:
+        try:
+            os.remove(os.path.join(self._dir(session_id), "finalize.lock"))
+        except (KeyError, OSError):
+            pass
+
+    def remove(self, session_id: str) -> None:
+        try:
+            directory = self._dir(session_id)
+        except KeyError:
+            return
+        # renamed away first, of two racing removals only one uncounts the chunks
+        doomed = f"{directory}.{uuid.uuid4().hex}.removing"
+        try:
+            os.rename(directory, doomed)
+        except OSError:
+            return
+        self.track(-_part_bytes(doomed))
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def sessions(self) -> list[str]:
+        try:
+            return [name for name in os.listdir(self.root) if SESSION_ID.fullmatch(name)]
+        except OSError:
+            return []
+
+    def sweep(self) -> int:
+        """
+        Remove sessions idle for longer than the TTL, returns how many
+        """
+        now = time.time()
+        removed = 0
+        for name in self.sessions():
+            if now - self.last_activity(name) > self.ttl_seconds:
+                self.remove(name)
+                removed += 1
+        # removals a crash interrupted, already uncounted
+        try:
+            leftovers = [name for name in os.listdir(self.root) if name.endswith(".removing")]
+        except OSError:
+            leftovers = []
+        for name in leftovers:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        return removed
+
+
+def _part_bytes(directory: str) -> int:
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".part"):
+                    total += entry.stat().st_size
+    except OSError:
+        pass
+    return total
+
+
+upload_sessions = UploadSessionStore(
+    os.path.join(Config.Paths.Client.UPLOADS, "sessions"),
+    Config.UploadSessionConfig.TTL_SECONDS,
+    track=lambda delta: blob_store.add_staged("sessions", delta),
+)
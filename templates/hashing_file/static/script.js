@@ -5,6 +5,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const fileLabel = document.getElementById('fileLabel');
     const fileName = document.getElementById('fileName');
     const keyInput = document.getElementById('password');
+    const compressInput = document.getElementById('compress');
+    const compressOption = document.getElementById('compressOption');
     const processBtn = document.getElementById('processBtn');
     const statusDiv = document.getElementById('status');
     const downloadLink = document.getElementById('downloadLink');
@@ -52,6 +54,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     function updateProcessButtonText() {
         processBtn.textContent = currentMode === 'encrypt' ? 'Encrypt File' : 'Decrypt File';
+        compressOption.hidden = currentMode !== 'encrypt';
     }
 
     downloadLink.addEventListener('click', function(e) {
@@ -100,9 +103,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
     function processFile() {
         const formData = new FormData();
-        formData.append('file', fileInput.files[0]);
+        // fields first, the server can then encrypt the file while it arrives
         formData.append('key', keyInput.value);
         formData.append('mode', currentMode);
+        formData.append('compress', compressInput.checked ? 'auto' : 'off');
+        formData.append('file', fileInput.files[0]);
 
         processBtn.disabled = true;
         showStatus('Processing file...', '');
@@ -114,7 +119,11 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                showStatus('File processed successfully!', 'success');
+                let message = 'File processed successfully!';
+                if (data.compression) {
+                    message += ` Compressed to ${Math.round(data.compression.ratio * 100)}% with ${data.compression.codec}.`;
+                }
+                showStatus(message, 'success');
                 downloadLink.dataset.filename = data.output_filename;
                 downloadLink.dataset.token = data.download_token;
                 downloadLink.textContent = 'Download processed file';